@@ -1,11 +1,16 @@
 import httpx
 import base64
+import asyncio
 import json
 import os
 from sentence_transformers import SentenceTransformer
 from PIL import Image
 import numpy as np
 import logging
+import time
+import metrics_service
+import upstream
+import image_ingest
 
 # 配置日志记录
 logger = logging.getLogger("SmartWardrobe.AI")
@@ -39,7 +44,9 @@ def get_image_embedding(image_path: str):
         
         img = Image.open(image_path)
         # 编码并归一化向量（提升匹配精度）
+        start = time.perf_counter()
         embedding = clip_model.encode(img, normalize_embeddings=True)
+        metrics_service.observe_inference("clip", time.perf_counter() - start)
         return embedding.tolist()  # 转为列表格式，便于数据库存储
     except FileNotFoundError as e:
         logger.error(f"Image processing error: {e}")
@@ -48,6 +55,46 @@ def get_image_embedding(image_path: str):
         logger.error(f"Vector extraction failed: {str(e)}")
         return None
 
+def get_image_embeddings_batch(image_paths: list):
+    """
+    批量提取图片视觉向量，一次前向计算处理多张图片
+    :param image_paths: 图片路径列表
+    :return: 与输入一一对应的向量列表，单张失败时对应位置为 None
+    """
+    if clip_model is None:
+        logger.error("CLIP model is not initialized, cannot extract embedding")
+        return [None] * len(image_paths)
+
+    # 1. 逐张解码，单张失败不影响整批
+    images, valid_idx = [], []
+    for idx, image_path in enumerate(image_paths):
+        try:
+            if not os.path.exists(image_path):
+                raise FileNotFoundError(f"Image file not found: {image_path}")
+            img = Image.open(image_path)
+            img.load()
+            images.append(img)
+            valid_idx.append(idx)
+        except Exception as e:
+            logger.error(f"Image processing error: {e}")
+
+    results = [None] * len(image_paths)
+    if not images:
+        return results
+
+    # 2. 整批编码
+    try:
+        start = time.perf_counter()
+        embeddings = clip_model.encode(images, batch_size=len(images), normalize_embeddings=True)
+        metrics_service.observe_inference("clip", time.perf_counter() - start)
+    except Exception as e:
+        logger.error(f"Batch vector extraction failed: {str(e)}")
+        return results
+
+    for idx, embedding in zip(valid_idx, embeddings):
+        results[idx] = embedding.tolist()
+    return results
+
 # 配置 API 核心参数
 SILICONFLOW_API_KEY = os.getenv("SILICONFLOW_API_KEY", "")
 API_URL = "https://api.siliconflow.cn/v1/chat/completions"
@@ -160,7 +207,7 @@ async def analyze_clothing_image(image_bytes: bytes):
     logger.info("Starting clothing image analysis process")
     
     # 1. 基础参数校验
-    if "sk-" not in SILICONFLOW_API_KEY:
+    if upstream.requires_credentials() and "sk-" not in SILICONFLOW_API_KEY:
         logger.error("Invalid API Key: Missing 'sk-' prefix")
         return {"error": "API Key配置错误，需包含'sk-'前缀"}
     
@@ -168,9 +215,18 @@ async def analyze_clothing_image(image_bytes: bytes):
         logger.error("Empty image data received")
         return {"error": "图片字节流数据为空"}
     
-    # 2. 图片编码处理
+    # 2. 图片预处理与编码：缩放到模型实际使用的分辨率、透明背景铺底色并压缩，减少上传体积与首 token 延迟
     try:
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
+        with metrics_service.stage_timer("vision_payload"):
+            vision_bytes, mime_type = await asyncio.to_thread(image_ingest.prepare_vision_image, image_bytes)
+        logger.info(f"Image prepared for vision model: {len(image_bytes)} -> {len(vision_bytes)} bytes ({mime_type})")
+    except Exception as e:
+        # 无法解码时按原样发送，由模型端判断
+        logger.warning(f"Image preprocessing failed, sending raw bytes: {str(e)}")
+        vision_bytes, mime_type = image_bytes, "image/jpeg"
+
+    try:
+        base64_image = base64.b64encode(vision_bytes).decode('utf-8')
         logger.info("Image converted to base64 successfully")
     except Exception as e:
         logger.error(f"Image base64 encoding failed: {str(e)}")
@@ -184,7 +240,7 @@ async def analyze_clothing_image(image_bytes: bytes):
             {
                 "role": "user", 
                 "content": [
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}},
+                    {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64_image}"}},
                     {"type": "text", "text": "请基于提供的标准属性库，全面分析该衣物并返回指定格式的JSON数据，确保所有属性值符合约束要求。"}
                 ]
             }
@@ -201,56 +257,56 @@ async def analyze_clothing_image(image_bytes: bytes):
 
     # 4. 发送API请求并处理响应
     logger.info(f"Sending request to AI model: {MODEL_NAME}")
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            response = await client.post(API_URL, json=payload, headers=headers)
+    try:
+        with metrics_service.track_upstream("siliconflow_vl"):
+            response = await upstream.post("siliconflow_vl", API_URL, timeout=60.0, json=payload, headers=headers)
             response.raise_for_status()
-            logger.info(f"API request successful, status code: {response.status_code}")
-            
-            result = response.json()
-            content = result['choices'][0]['message']['content']
-            
-            # 清理可能的格式残留
-            content = content.replace("```json", "").replace("```", "").strip()
-            data = json.loads(content)
-            logger.info("AI response parsed to JSON successfully")
-            
-            # 5. 数据二次校验与修正
-            # 5.1 上衣层级修正
-            if data.get("category_main") == "上衣":
-                sub_category = data.get("category_sub", "其他上衣")
-                data["default_layer"] = LAYER_MAPPING.get(sub_category, "Unknown")
-                logger.debug(f"Updated default_layer for top: {data['default_layer']} (sub category: {sub_category})")
-            else:
-                data["default_layer"] = None
-            
-            # 5.2 保暖等级类型修正
-            if not isinstance(data.get("warmth_level"), int):
-                logger.warning(f"Invalid warmth_level type, reset to default. Raw value: {data.get('warmth_level')}")
-                data["warmth_level"] = 3  # 默认中厚等级
-            
-            # 5.3 数组类型属性校验
-            array_fields = ["materials", "seasons", "styles", "occasions"]
-            for field in array_fields:
-                if not isinstance(data.get(field), list):
-                    logger.warning(f"Field {field} is not list type, reset to empty list")
-                    data[field] = []
-            
-            logger.info(f"Clothing analysis completed successfully, result: {data}")
-            return data
-            
-        except httpx.HTTPError as e:
-            logger.error(f"API request failed: {str(e)}")
-            return {"error": f"API请求失败: {str(e)}"}
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON parsing failed: {str(e)} | Raw content: {content}")
-            return {"error": f"AI返回格式错误，无法解析JSON: {str(e)}"}
-        except KeyError as e:
-            logger.error(f"Missing key in AI response: {str(e)} | Raw result: {result}")
-            return {"error": f"AI返回数据缺失关键字段: {str(e)}"}
-        except Exception as e:
-            logger.error(f"Clothing analysis process failed: {str(e)}", exc_info=True)
-            return {"error": f"分析过程异常: {str(e)}"}
+        logger.info(f"API request successful, status code: {response.status_code}")
+        
+        result = response.json()
+        content = result['choices'][0]['message']['content']
+        
+        # 清理可能的格式残留
+        content = content.replace("```json", "").replace("```", "").strip()
+        data = json.loads(content)
+        logger.info("AI response parsed to JSON successfully")
+        
+        # 5. 数据二次校验与修正
+        # 5.1 上衣层级修正
+        if data.get("category_main") == "上衣":
+            sub_category = data.get("category_sub", "其他上衣")
+            data["default_layer"] = LAYER_MAPPING.get(sub_category, "Unknown")
+            logger.debug(f"Updated default_layer for top: {data['default_layer']} (sub category: {sub_category})")
+        else:
+            data["default_layer"] = None
+        
+        # 5.2 保暖等级类型修正
+        if not isinstance(data.get("warmth_level"), int):
+            logger.warning(f"Invalid warmth_level type, reset to default. Raw value: {data.get('warmth_level')}")
+            data["warmth_level"] = 3  # 默认中厚等级
+        
+        # 5.3 数组类型属性校验
+        array_fields = ["materials", "seasons", "styles", "occasions"]
+        for field in array_fields:
+            if not isinstance(data.get(field), list):
+                logger.warning(f"Field {field} is not list type, reset to empty list")
+                data[field] = []
+        
+        logger.info(f"Clothing analysis completed successfully, result: {data}")
+        return data
+        
+    except httpx.HTTPError as e:
+        logger.error(f"API request failed: {str(e)}")
+        return {"error": f"API请求失败: {str(e)}"}
+    except json.JSONDecodeError as e:
+        logger.error(f"JSON parsing failed: {str(e)} | Raw content: {content}")
+        return {"error": f"AI返回格式错误，无法解析JSON: {str(e)}"}
+    except KeyError as e:
+        logger.error(f"Missing key in AI response: {str(e)} | Raw result: {result}")
+        return {"error": f"AI返回数据缺失关键字段: {str(e)}"}
+    except Exception as e:
+        logger.error(f"Clothing analysis process failed: {str(e)}", exc_info=True)
+        return {"error": f"分析过程异常: {str(e)}"}
 
 async def generate_outfit_comment(weather_summary, outfit_names):
     """
@@ -266,7 +322,7 @@ async def generate_outfit_comment(weather_summary, outfit_names):
         logger.error("Weather summary or outfit names is empty")
         return {"error": "天气信息和穿搭信息不能为空"}
 
-    if not DEEPSEEK_API_KEY or "sk-" not in DEEPSEEK_API_KEY:
+    if upstream.requires_credentials() and (not DEEPSEEK_API_KEY or "sk-" not in DEEPSEEK_API_KEY):
         logger.error("DeepSeek API Key not found or invalid")
         return {"error": "DeepSeek API Key 未配置"}
     
@@ -306,26 +362,28 @@ async def generate_outfit_comment(weather_summary, outfit_names):
     }
     
     # 4. 发送请求并处理响应
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            response = await client.post(DEEPSEEK_API_URL, json=payload, headers=headers)
-            
+    try:
+        with metrics_service.track_upstream("deepseek") as call:
+            response = await upstream.post("deepseek", DEEPSEEK_API_URL, timeout=30.0, json=payload, headers=headers)
             if response.status_code != 200:
-                logger.error(f"DeepSeek API Error: {response.text}")
-                return {"error": f"DeepSeek 服务异常: {response.status_code}"}
-
-            result = response.json()
-            comment = result['choices'][0]['message']['content'].strip()
-            
-            # 去除可能存在的引号（DeepSeek有时会输出引号）
-            comment = comment.strip('"').strip("'")
-            
-            logger.info(f"DeepSeek comment generated: {comment}")
-            return comment
-
-        except httpx.TimeoutException:
-            logger.error("DeepSeek API request timed out")
-            return {"error": "点评生成超时，DeepSeek 正在思考人生"}
-        except Exception as e:
-            logger.error(f"Failed to generate outfit comment via DeepSeek: {str(e)}")
-            return {"error": f"穿搭点评生成失败: {str(e)}"}
\ No newline at end of file
+                call.error()
+        
+        if response.status_code != 200:
+            logger.error(f"DeepSeek API Error: {response.text}")
+            return {"error": f"DeepSeek 服务异常: {response.status_code}"}
+
+        result = response.json()
+        comment = result['choices'][0]['message']['content'].strip()
+        
+        # 去除可能存在的引号（DeepSeek有时会输出引号）
+        comment = comment.strip('"').strip("'")
+        
+        logger.info(f"DeepSeek comment generated: {comment}")
+        return comment
+
+    except httpx.TimeoutException:
+        logger.error("DeepSeek API request timed out")
+        return {"error": "点评生成超时，DeepSeek 正在思考人生"}
+    except Exception as e:
+        logger.error(f"Failed to generate outfit comment via DeepSeek: {str(e)}")
+        return {"error": f"穿搭点评生成失败: {str(e)}"}
\ No newline at end of file
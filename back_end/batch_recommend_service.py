@@ -0,0 +1,239 @@
+"""
+每日批量推荐：按常驻城市分组，每组只解析一次地址、获取一次天气，
+再用有界并发为组内每个用户计算推荐，结果写入 daily_recommendations 表供 App 直接读取。
+
+性别取自用户画像 (推荐页切换性别时同步)；画像未设置时使用请求中的 gender，
+两者都为空则按 "中性" 处理，不按性别过滤衣物 (女款/男款都可能被推荐)。
+
+命令行用法 (在 back_end 目录下，可配合 cron 每天早上运行):
+    python batch_recommend_service.py
+    python batch_recommend_service.py --concurrency 16 --user-ids 1,2,3
+"""
+import os
+import time
+import asyncio
+import logging
+import argparse
+import datetime
+from sqlalchemy import select, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+import database
+import metrics_service
+import models
+import schemas
+from models import ClothingItem, UserProfile, DailyRecommendation
+from weather_service import get_weather_info, resolve_coordinates
+from recommendation_service import ProfessionalRecommender, format_outfit_item
+
+logger = logging.getLogger("SmartWardrobe.BatchRecommend")
+
+# 同时计算推荐的用户数
+BATCH_RECOMMEND_CONCURRENCY = int(os.getenv("BATCH_RECOMMEND_CONCURRENCY", "8"))
+# 未设置常驻城市的用户使用的默认城市 (与 RecommendationRequest 默认值一致)
+DEFAULT_LOCATION = "厦门市"
+# 结果分批写入，每批行数
+WRITE_BATCH_SIZE = 500
+
+
+async def load_active_users(db, user_ids=None):
+    """活跃用户：衣橱中有可穿衣物的用户，返回 [(user_id, 常驻城市, 偏好风格, 性别), ...]"""
+    query = (
+        select(ClothingItem.user_id, UserProfile.location, UserProfile.preferred_styles, UserProfile.gender)
+        .join(UserProfile, UserProfile.user_id == ClothingItem.user_id, isouter=True)
+        .where(ClothingItem.status == "正常")
+        .distinct()
+    )
+    if user_ids:
+        query = query.where(ClothingItem.user_id.in_(user_ids))
+    rows = (await db.execute(query)).all()
+    # 同一用户只保留一行 (preferred_styles 为 JSON 列，distinct 按文本去重)
+    users = {}
+    for user_id, location, preferred_styles, gender in rows:
+        users.setdefault(user_id, (user_id, location or DEFAULT_LOCATION, preferred_styles or [], gender))
+    return list(users.values())
+
+
+async def group_users_by_location(users):
+    """
+    按解析后的经纬度分组：不同写法的同一城市 (如 "厦门" 与 "厦门市") 归为一组
+    返回 ({经纬度: [用户, ...]}, [无法解析地址的用户, ...])
+    """
+    by_location = {}
+    for user in users:
+        by_location.setdefault(user[1], []).append(user)
+
+    groups, unresolved = {}, []
+    # Nominatim 有调用频率限制，城市数量通常很少，逐个解析
+    for location, members in by_location.items():
+        coords = await resolve_coordinates(location)
+        if coords:
+            groups.setdefault(coords, []).extend(members)
+        else:
+            logger.warning(f"无法解析地址 {location}，跳过 {len(members)} 个用户")
+            unresolved.extend(members)
+    return groups, unresolved
+
+
+def _failed_row(user_id, date, location, message, weather_summary=""):
+    return {
+        "user_id": user_id, "date": date, "location": location, "status": "failed",
+        "weather_summary": weather_summary, "outfit": {}, "score": 0, "reasoning": "", "message": message,
+    }
+
+
+async def _recommend_for_user(user, coords, weather_ctx, date, options, semaphore):
+    user_id, location, preferred_styles, gender = user
+    req = schemas.RecommendationRequest(
+        user_id=user_id,
+        scenario=options.scenario,
+        # 优先使用用户画像中的首选风格
+        style=preferred_styles[0] if preferred_styles else options.style,
+        location=location,
+        # 画像与请求都没有性别时不按性别过滤
+        gender=gender or options.gender or "中性",
+        target_categories=options.target_categories,
+    )
+    weather_summary = weather_ctx.get("summary_text", "")
+    async with semaphore:
+        try:
+            async with database.AsyncSessionLocal() as db:
+                recommender = await ProfessionalRecommender.create(db, user_id, weather_ctx, req)
+                # 批量场景不调用 AI 生成缺失单品
+                result = await recommender.recommend(auto_generate=False)
+        except Exception as e:
+            logger.error(f"用户 {user_id} 批量推荐失败: {e}", exc_info=True)
+            return _failed_row(user_id, date, coords, "推荐计算过程中发生错误", weather_summary)
+
+    outfit_items = result.get("outfit_items") if result else None
+    if not outfit_items:
+        message = result.get("error") if result and result.get("error") else "衣橱中没有可推荐的衣物"
+        return _failed_row(user_id, date, coords, message, weather_summary)
+
+    return {
+        "user_id": user_id,
+        "date": date,
+        "location": coords,
+        "status": "success",
+        "weather_summary": weather_summary,
+        "outfit": {key: format_outfit_item(item) for key, item in outfit_items.items()},
+        "score": result.get("score", 0),
+        "reasoning": result.get("reasoning", ""),
+        "message": None,
+    }
+
+
+async def _write_results(rows):
+    """按 (user_id, date) 覆盖写入，同一天重复运行只保留最新结果"""
+    async with database.AsyncSessionLocal() as db:
+        for start in range(0, len(rows), WRITE_BATCH_SIZE):
+            chunk = rows[start:start + WRITE_BATCH_SIZE]
+            stmt = sqlite_insert(DailyRecommendation).values(chunk)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[DailyRecommendation.user_id, DailyRecommendation.date],
+                set_={
+                    **{
+                        name: stmt.excluded[name]
+                        for name in ("location", "status", "weather_summary", "outfit", "score", "reasoning", "message")
+                    },
+                    "created_at": func.now(),
+                },
+            )
+            await db.execute(stmt)
+        await db.commit()
+
+
+async def run_batch(options: schemas.BatchRecommendRequest):
+    """执行一次批量推荐，返回运行摘要"""
+    start = time.perf_counter()
+    date = options.date or datetime.date.today().isoformat()
+
+    async with database.AsyncSessionLocal() as db:
+        users = await load_active_users(db, options.user_ids)
+    logger.info(f"批量推荐开始: {date}, {len(users)} 个活跃用户")
+
+    # 1. 按城市分组，每组只获取一次天气
+    with metrics_service.stage_timer("batch_recommend_weather"):
+        groups, unresolved = await group_users_by_location(users)
+        coords_list = list(groups)
+        weathers = await asyncio.gather(*(get_weather_info(coords) for coords in coords_list))
+
+    rows = [_failed_row(user[0], date, None, f"无法识别该地址: {user[1]}") for user in unresolved]
+
+    # 2. 有界并发计算推荐
+    semaphore = asyncio.Semaphore(options.concurrency or BATCH_RECOMMEND_CONCURRENCY)
+    tasks = []
+    for coords, weather_ctx in zip(coords_list, weathers):
+        members = groups[coords]
+        if "error" in weather_ctx:
+            rows.extend(_failed_row(user[0], date, coords, weather_ctx["error"]) for user in members)
+            continue
+        tasks.extend(
+            _recommend_for_user(user, coords, weather_ctx, date, options, semaphore) for user in members
+        )
+    with metrics_service.stage_timer("batch_recommend_compute"):
+        rows.extend(await asyncio.gather(*tasks))
+
+    # 3. 写入结果表
+    if rows:
+        await _write_results(rows)
+
+    succeeded = sum(1 for row in rows if row["status"] == "success")
+    summary = {
+        "date": date,
+        "users": len(users),
+        "location_groups": len(groups),
+        "weather_fetches": len(coords_list),
+        "succeeded": succeeded,
+        "failed": len(rows) - succeeded,
+        "elapsed_seconds": round(time.perf_counter() - start, 2),
+    }
+    logger.info(f"批量推荐完成: {summary}")
+    return summary
+
+
+async def get_daily_recommendation(db, user_id: str, date: str = None):
+    """读取用户某天 (默认今天) 的批量推荐结果，不存在返回 None"""
+    date = date or datetime.date.today().isoformat()
+    result = await db.execute(
+        select(DailyRecommendation).where(
+            DailyRecommendation.user_id == user_id, DailyRecommendation.date == date
+        )
+    )
+    return result.scalars().first()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="每日批量推荐")
+    parser.add_argument("--date", default=None, help="结果日期 YYYY-MM-DD，默认今天")
+    parser.add_argument("--user-ids", default=None, help="只为这些用户计算，逗号分隔")
+    parser.add_argument("--concurrency", type=int, default=BATCH_RECOMMEND_CONCURRENCY)
+    parser.add_argument("--scenario", default="通勤")
+    parser.add_argument("--style", default="休闲")
+    parser.add_argument("--gender", default=None, help="用户画像未设置性别时使用 (男士/女士)，默认不按性别过滤")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    models.Base.metadata.create_all(bind=database.engine)
+    database.run_migrations()
+
+    options = schemas.BatchRecommendRequest(
+        date=args.date,
+        user_ids=[u.strip() for u in args.user_ids.split(",") if u.strip()] if args.user_ids else None,
+        concurrency=args.concurrency,
+        scenario=args.scenario,
+        style=args.style,
+        gender=args.gender,
+    )
+
+    async def run():
+        try:
+            return await run_batch(options)
+        finally:
+            await database.async_engine.dispose()
+
+    print(asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    main()
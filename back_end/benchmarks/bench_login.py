@@ -0,0 +1,143 @@
+"""
+登录突发负载测试
+
+模拟早高峰：先注册一批测试用户，然后在同一时刻并发发起大量 /token 登录请求，
+同时持续探测一个同步接口 (/user/profile)，输出登录与探测请求的 p50/p95/p99 延迟和状态码分布。
+用于验证 bcrypt 移入独立进程池后，登录高峰不再拖慢其他同步接口。
+
+需要先启动后端服务 (在 back_end 目录下):
+    uvicorn main:app --port 8000
+    python benchmarks/bench_login.py --url http://127.0.0.1:8000 --users 50 --burst 400
+    BCRYPT_ROUNDS=10 uvicorn main:app ...   # 对比不同成本因子
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from uuid import uuid4
+
+import httpx
+import numpy as np
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def summarize(latencies, statuses):
+    return {
+        "requests": len(latencies),
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies) if latencies else 0.0,
+        "status": dict(Counter(statuses)),
+    }
+
+
+async def register_users(client, n_users, password):
+    usernames = []
+    prefix = f"bench_{uuid4().hex[:6]}"
+    for i in range(n_users):
+        username = f"{prefix}_{i}"
+        resp = await client.post("/register", json={"username": username, "password": password})
+        resp.raise_for_status()
+        usernames.append(username)
+    return usernames
+
+
+async def login(client, username, password, latencies, statuses):
+    start = time.perf_counter()
+    try:
+        resp = await client.post("/token", data={"username": username, "password": password})
+        statuses.append(resp.status_code)
+    except httpx.HTTPError as e:
+        statuses.append(type(e).__name__)
+    latencies.append((time.perf_counter() - start) * 1000)
+
+
+async def probe(client, stop, interval, latencies, statuses):
+    """在登录高峰期间持续请求同步接口，观察线程池是否被占满"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            resp = await client.get("/user/profile", params={"user_id": "bench_probe"})
+            statuses.append(resp.status_code)
+        except httpx.HTTPError as e:
+            statuses.append(type(e).__name__)
+        latencies.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(interval)
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        print(f"注册 {args.users} 个测试用户...")
+        usernames = await register_users(client, args.users, args.password)
+
+        # 基线：空闲时的探测延迟
+        idle_lat, idle_status = [], []
+        idle_stop = asyncio.Event()
+        idle_task = asyncio.create_task(probe(client, idle_stop, args.probe_interval, idle_lat, idle_status))
+        await asyncio.sleep(2)
+        idle_stop.set()
+        await idle_task
+
+        # 突发：burst 个登录请求同时发出 (按用户轮询，部分用户会有并发登录)
+        login_lat, login_status = [], []
+        probe_lat, probe_status = [], []
+        stop = asyncio.Event()
+        probe_task = asyncio.create_task(probe(client, stop, args.probe_interval, probe_lat, probe_status))
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            login(client, usernames[i % len(usernames)], args.password, login_lat, login_status)
+            for i in range(args.burst)
+        ))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe_task
+
+    return {
+        "burst": args.burst,
+        "users": args.users,
+        "wall_seconds": elapsed,
+        "logins_per_sec": args.burst / elapsed if elapsed else 0.0,
+        "login": summarize(login_lat, login_status),
+        "probe_idle": summarize(idle_lat, idle_status),
+        "probe_during_burst": summarize(probe_lat, probe_status),
+    }
+
+
+def print_report(report):
+    print(f"\n=== 登录突发: {report['burst']} 次 / {report['users']} 个用户, "
+          f"耗时 {report['wall_seconds']:.2f}s ({report['logins_per_sec']:.1f} 次/秒) ===")
+    print(f"{'':<20}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  status")
+    for name in ("login", "probe_idle", "probe_during_burst"):
+        r = report[name]
+        print(f"{name:<20}{r['requests']:>6}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+              f"{r['p99_ms']:>10.1f}{r['max_ms']:>10.1f}  {r['status']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="登录突发负载测试")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=50, help="注册的测试用户数")
+    parser.add_argument("--burst", type=int, default=400, help="同时发起的登录请求数")
+    parser.add_argument("--concurrency", type=int, default=200, help="客户端最大连接数")
+    parser.add_argument("--password", default="bench-password-123")
+    parser.add_argument("--probe-interval", type=float, default=0.05, help="同步接口探测间隔 (秒)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--json", default=None, help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+ProfessionalRecommender 基准测试
+
+为不同衣橱规模 (默认 50 ~ 50,000 件) 生成合成用户，在固定天气上下文下反复调用
+recommend()，输出 p50/p95/p99 延迟、每阶段 SQL 次数与峰值内存。
+
+用法 (在 back_end 目录下):
+    python benchmarks/bench_recommender.py --sizes 50,500,5000 --runs 30
+    python benchmarks/bench_recommender.py --json bench_recommender.json
+    python benchmarks/bench_recommender.py --cold   # 每次运行前清空快照缓存，测量未命中路径
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+import database
+import models
+import recommendation_service
+import wardrobe_cache
+from recommendation_service import ProfessionalRecommender
+from benchmarks.synthetic_data import WEATHER_FIXTURES, populate_user
+
+# 需要计时的阶段: 阶段名 -> 推荐器方法名
+STAGES = {
+    "history": "_load_history_weights",
+    "recall": "_get_candidates",
+    "scoring": "_calc_weather_score",
+    "outer": "_select_outer",
+}
+
+
+class StageRecorder:
+    """统计每个阶段的耗时、SQL 次数与峰值内存 (阶段可嵌套，数值为包含子阶段的总量)"""
+
+    def __init__(self, engine):
+        self.query_count = 0
+        self.trace_memory = False
+        self._stack = []
+        self.reset()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.query_count += 1
+
+    def reset(self):
+        self.seconds = {name: 0.0 for name in STAGES}
+        self.queries = {name: 0 for name in STAGES}
+        self.peak_bytes = {name: 0 for name in STAGES}
+
+    @contextmanager
+    def stage(self, name):
+        # 同名阶段递归调用时只统计最外层
+        if any(frame["name"] == name for frame in self._stack):
+            yield
+            return
+        frame = {"name": name, "queries": self.query_count, "start": time.perf_counter()}
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+            frame["mem_start"] = frame["peak"] = current
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            self.seconds[name] += time.perf_counter() - frame["start"]
+            self.queries[name] += self.query_count - frame["queries"]
+            if self.trace_memory:
+                frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                self.peak_bytes[name] = max(self.peak_bytes[name], frame["peak"] - frame["mem_start"])
+                if self._stack:
+                    self._stack[-1]["peak"] = max(self._stack[-1]["peak"], frame["peak"])
+                tracemalloc.reset_peak()
+
+
+def _wrap_stage(recorder, name, fn):
+    if asyncio.iscoroutinefunction(fn):
+        async def wrapper(*args, **kwargs):
+            with recorder.stage(name):
+                return await fn(*args, **kwargs)
+    else:
+        def wrapper(*args, **kwargs):
+            with recorder.stage(name):
+                return fn(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def instrument_recommender(recorder):
+    """临时给 ProfessionalRecommender 的各阶段方法套上计时器"""
+    originals = {attr: getattr(ProfessionalRecommender, attr) for attr in STAGES.values()}
+    try:
+        for name, attr in STAGES.items():
+            setattr(ProfessionalRecommender, attr, _wrap_stage(recorder, name, originals[attr]))
+        yield
+    finally:
+        for attr, fn in originals.items():
+            setattr(ProfessionalRecommender, attr, fn)
+
+
+async def _offline_auto_generate(self, category_main, warmth_target, gender_target):
+    # 基准测试不访问外部 API，缺失品类时返回一个未入库的占位单品
+    return models.ClothingItem(
+        id=-1, user_id=self.user_id, category_main=category_main, category_sub="其他",
+        main_color="黑", warmth_level=warmth_target, gender=gender_target, status="未拥有",
+        styles=[], materials=[], embedding_vector=[],
+    )
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+async def run_once(Session, user_id, weather_ctx, req, recorder, cold=False):
+    if cold:
+        wardrobe_cache.clear()
+    async with Session() as db:
+        start_queries = recorder.query_count
+        start = time.perf_counter()
+        recommender = await ProfessionalRecommender.create(db, user_id, weather_ctx, req)
+        result = await recommender.recommend()
+        elapsed = time.perf_counter() - start
+        return elapsed, recorder.query_count - start_queries, result
+
+
+async def bench_size(Session, recorder, user_id, n_items, runs, warmup, cold=False):
+    report = {"items": n_items, "weather": {}}
+    for weather_name, weather_ctx in WEATHER_FIXTURES.items():
+        req = SimpleNamespace(
+            scenario="通勤", style="休闲", gender="男士",
+            target_categories=["上衣", "裤子", "鞋"],
+        )
+
+        for _ in range(warmup):
+            await run_once(Session, user_id, weather_ctx, req, recorder, cold)
+
+        # 1. 延迟 (不开 tracemalloc，避免干扰计时)
+        latencies, queries = [], []
+        stage_seconds = {name: [] for name in STAGES}
+        stage_queries = {name: [] for name in STAGES}
+        for _ in range(runs):
+            recorder.reset()
+            elapsed, n_queries, _ = await run_once(Session, user_id, weather_ctx, req, recorder, cold)
+            latencies.append(elapsed * 1000)
+            queries.append(n_queries)
+            for name in STAGES:
+                stage_seconds[name].append(recorder.seconds[name] * 1000)
+                stage_queries[name].append(recorder.queries[name])
+
+        # 2. 峰值内存 (单独跑一次)
+        recorder.reset()
+        recorder.trace_memory = True
+        tracemalloc.start()
+        try:
+            await run_once(Session, user_id, weather_ctx, req, recorder, cold)
+            total_peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            recorder.trace_memory = False
+
+        report["weather"][weather_name] = {
+            "latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "mean": float(np.mean(latencies)),
+            },
+            "sql_queries": float(np.mean(queries)),
+            "peak_memory_kb": total_peak / 1024,
+            "stages": {
+                name: {
+                    "p50_ms": percentile(stage_seconds[name], 50),
+                    "p95_ms": percentile(stage_seconds[name], 95),
+                    "sql_queries": float(np.mean(stage_queries[name])),
+                    "peak_memory_kb": recorder.peak_bytes[name] / 1024,
+                }
+                for name in STAGES
+            },
+        }
+    return report
+
+
+def print_report(report):
+    print(f"\n=== 衣橱规模: {report['items']} 件 ===")
+    header = f"{'weather':<12}{'p50':>9}{'p95':>9}{'p99':>9}{'sql':>6}{'peak KB':>10}  stages (p50 ms / sql / peak KB)"
+    print(header)
+    for weather_name, r in report["weather"].items():
+        lat = r["latency_ms"]
+        stages = "  ".join(
+            f"{name}={s['p50_ms']:.2f}/{s['sql_queries']:.0f}/{s['peak_memory_kb']:.0f}"
+            for name, s in r["stages"].items()
+        )
+        print(f"{weather_name:<12}{lat['p50']:>9.2f}{lat['p95']:>9.2f}{lat['p99']:>9.2f}"
+              f"{r['sql_queries']:>6.0f}{r['peak_memory_kb']:>10.0f}  {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ProfessionalRecommender 基准测试")
+    parser.add_argument("--sizes", default="50,500,5000,50000", help="衣橱规模列表，逗号分隔")
+    parser.add_argument("--history", type=int, default=3000, help="每个用户的历史反馈条数")
+    parser.add_argument("--runs", type=int, default=30, help="每种天气的计时次数")
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", default=None, help="SQLite 文件路径 (默认使用临时文件)")
+    parser.add_argument("--json", default=None, help="把结果写入 JSON 文件")
+    parser.add_argument("--cold", action="store_true", help="每次运行前清空用户快照缓存")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    tmp_dir = tempfile.mkdtemp(prefix="bench_recommender_")
+    db_path = args.db or os.path.join(tmp_dir, "bench.db")
+
+    # 同步引擎只用于建表与写入合成数据，推荐器走与线上一致的异步引擎
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    event.listen(engine, "connect", database.apply_sqlite_pragmas)
+    models.Base.metadata.create_all(bind=engine)
+    SyncSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    async_engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    event.listen(async_engine.sync_engine, "connect", database.apply_sqlite_pragmas)
+    Session = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    recorder = StageRecorder(async_engine.sync_engine)
+
+    # 自动生成单品会调用 Kolors 并下载图片，基准测试中替换为离线占位
+    recommendation_service.ProfessionalRecommender._auto_generate_item = _offline_auto_generate
+
+    async def run_all():
+        reports = []
+        for idx, n_items in enumerate(sizes):
+            user_id = f"bench_user_{n_items}"
+            print(f"生成合成用户 {user_id}: {n_items} 件衣物, {args.history} 条历史...")
+            db = SyncSession()
+            try:
+                populate_user(db, user_id, n_items, args.history, seed=args.seed + idx)
+            finally:
+                db.close()
+            report = await bench_size(Session, recorder, user_id, n_items, args.runs, args.warmup, args.cold)
+            print_report(report)
+            reports.append(report)
+        # 异步连接池绑定在当前事件循环上，需在同一循环内释放
+        await async_engine.dispose()
+        return reports
+
+    with instrument_recommender(recorder):
+        reports = asyncio.run(run_all())
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"history_rows": args.history, "runs": args.runs, "cold_cache": args.cold, "results": reports}, f,
+                      ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+ClothingSegmenter.segment_and_crop 基准测试
+
+使用仓库自带的 test_images/ 真实衣物照片，统计各阶段耗时
+(decode / clahe / processor / forward / upsample / debug_map / masks / png_encode / colors)，
+并在不同线程数、输入尺寸下报告吞吐 (images/sec) 与峰值 RSS。
+每组配置在独立子进程中运行，保证峰值 RSS 互不干扰。
+
+用法 (在 back_end 目录下):
+    python benchmarks/bench_segmentation.py --threads 1,4 --sizes 1000,3000,4000
+    python benchmarks/bench_segmentation.py --json seg_new.json --compare seg_old.json
+    python benchmarks/bench_segmentation.py --decode-only --sizes 1500,3000,4032   # 只对比解码阶段，不加载模型
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+BACK_END_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_IMAGE_DIR = os.path.join(os.path.dirname(BACK_END_DIR), "test_images")
+sys.path.insert(0, BACK_END_DIR)
+
+STAGES = ["decode", "clahe", "processor", "forward", "upsample", "debug_map", "masks", "png_encode", "colors"]
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def load_inputs(image_dir, max_side):
+    """读取测试图片并缩放到指定长边 (小图会被放大，用于模拟手机原图)，统一编码为 JPEG 字节流"""
+    from PIL import Image
+
+    inputs = []
+    for name in sorted(os.listdir(image_dir)):
+        if not name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+            continue
+        img = Image.open(os.path.join(image_dir, name)).convert("RGB")
+        scale = max_side / max(img.size)
+        img = img.resize((round(img.width * scale), round(img.height * scale)), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=92)
+        inputs.append((name, buf.getvalue()))
+    return inputs
+
+
+def run_worker(config):
+    """子进程：在给定线程数与输入尺寸下跑完所有图片，返回结果字典"""
+    import cv2
+    import torch
+    import image_processing_service
+
+    torch.set_num_threads(config["threads"])
+    cv2.setNumThreads(config["threads"])
+
+    inputs = load_inputs(config["image_dir"], config["size"])
+    segmenter = image_processing_service.get_segmenter()
+
+    # 预热 (首次推理包含权重加载/内核初始化)
+    for _ in range(config["warmup"]):
+        segmenter.segment_and_crop(inputs[0][1])
+
+    timings = {}
+    per_image_ms = []
+    start = time.perf_counter()
+    for _ in range(config["repeat"]):
+        for _, data in inputs:
+            t0 = time.perf_counter()
+            segmenter.segment_and_crop(data, timings=timings)
+            per_image_ms.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - start
+
+    n = len(per_image_ms)
+    per_image_ms.sort()
+    return {
+        "threads": config["threads"],
+        "size": config["size"],
+        "images": n,
+        "images_per_sec": n / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "p50": per_image_ms[n // 2] if n else 0.0,
+            "p95": per_image_ms[min(n - 1, int(n * 0.95))] if n else 0.0,
+        },
+        "stage_ms_per_image": {name: timings.get(name, 0.0) * 1000 / n for name in STAGES} if n else {},
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def bench_decode(image_dir, sizes, repeat):
+    """对比旧解码 (整幅解码 + LANCZOS) 与 draft 模式解码在不同输入尺寸下的耗时，不加载分割模型"""
+    import image_ingest
+
+    results = []
+    for size in sizes:
+        inputs = load_inputs(image_dir, size)
+        row = {"size": size}
+        for name, decode in (("legacy", image_ingest.legacy_decode), ("draft", image_ingest.open_for_processing)):
+            kwargs = {"max_side": image_ingest.SEGMENT_MAX_SIDE}
+            decode(inputs[0][1], **kwargs)  # 预热
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for _, data in inputs:
+                    decode(data, **kwargs)
+            row[f"{name}_ms"] = (time.perf_counter() - start) * 1000 / (repeat * len(inputs))
+        row["speedup"] = row["legacy_ms"] / row["draft_ms"] if row["draft_ms"] else 0.0
+        print(f"size={size:>5}  legacy={row['legacy_ms']:7.1f}ms  draft={row['draft_ms']:7.1f}ms  x{row['speedup']:.2f}")
+        results.append(row)
+    return results
+
+
+def run_isolated(config):
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(config)],
+        capture_output=True, text=True, cwd=BACK_END_DIR,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"配置 {config} 运行失败:\n{proc.stderr[-2000:]}")
+    # 模型加载日志会写到 stdout/stderr，结果位于最后一行
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACK_END_DIR, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def print_results(results):
+    header = f"{'threads':>7}{'size':>6}{'img/s':>8}{'p50 ms':>9}{'RSS MB':>9}  " + " ".join(f"{s:>10}" for s in STAGES)
+    print(header)
+    for r in results:
+        stages = " ".join(f"{r['stage_ms_per_image'].get(s, 0):>10.1f}" for s in STAGES)
+        print(f"{r['threads']:>7}{r['size']:>6}{r['images_per_sec']:>8.2f}{r['latency_ms']['p50']:>9.1f}"
+              f"{r['peak_rss_mb']:>9.0f}  {stages}")
+
+
+def print_comparison(old_report, results):
+    """与历史报告对比，打印吞吐与各阶段耗时的变化百分比"""
+    old = {(r["threads"], r["size"]): r for r in old_report.get("results", [])}
+    print(f"\n对比基线 {old_report.get('revision', '?')} (负数表示变快):")
+    for r in results:
+        base = old.get((r["threads"], r["size"]))
+        if not base:
+            continue
+        def pct(new, prev):
+            return (new - prev) / prev * 100 if prev else 0.0
+        stage_delta = " ".join(
+            f"{s}={pct(r['stage_ms_per_image'].get(s, 0), base['stage_ms_per_image'].get(s, 0)):+.0f}%"
+            for s in STAGES
+        )
+        print(f"threads={r['threads']} size={r['size']}: "
+              f"img/s {pct(r['images_per_sec'], base['images_per_sec']):+.1f}%, "
+              f"RSS {pct(r['peak_rss_mb'], base['peak_rss_mb']):+.1f}%, {stage_delta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="衣物分割流水线基准测试")
+    parser.add_argument("--threads", default="1,4", help="torch/cv2 线程数列表，逗号分隔")
+    parser.add_argument("--sizes", default="1000,3000,4000", help="输入图片长边像素列表，逗号分隔")
+    parser.add_argument("--repeat", type=int, default=2, help="每组配置重复遍历图片集的次数")
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--image-dir", default=DEFAULT_IMAGE_DIR)
+    parser.add_argument("--json", default=None, help="把报告写入 JSON 文件")
+    parser.add_argument("--compare", default=None, help="与之前保存的 JSON 报告对比")
+    parser.add_argument("--decode-only", action="store_true", help="只对比解码阶段 (旧解码 vs draft 解码)")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(json.loads(args.worker))))
+        return
+
+    if args.decode_only:
+        sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+        results = bench_decode(args.image_dir, sizes, max(args.repeat, 5))
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({"revision": _git_revision(), "decode": results}, f, ensure_ascii=False, indent=2)
+        return
+
+    results = []
+    for threads in [int(t) for t in args.threads.split(",") if t.strip()]:
+        for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+            config = {
+                "threads": threads, "size": size, "repeat": args.repeat,
+                "warmup": args.warmup, "image_dir": args.image_dir,
+            }
+            print(f"运行配置: threads={threads}, size={size} ...", flush=True)
+            results.append(run_isolated(config))
+
+    print()
+    print_results(results)
+
+    report = {
+        "revision": _git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n报告已写入 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
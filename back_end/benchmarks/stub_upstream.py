@@ -0,0 +1,295 @@
+"""
+外部 API 桩服务
+
+在隔离机器上替代彩云天气、Nominatim、硅基流动 (视觉分析 / Kolors 生图)、DeepSeek 与生成图片下载，
+返回结构与真实接口一致的固定响应，并按上游注入可配置的延迟分布与错误率，
+用于离线压测 /recommend/outfit、/segment、/analyze-selected 等完整链路。
+
+后端以 UPSTREAM_MODE=stub 启动后，upstream.request 会把 https://host/path 改写为
+{UPSTREAM_STUB_URL}/{upstream}/path，由本服务按上游名称分发。
+
+用法 (在 back_end 目录下):
+    python benchmarks/stub_upstream.py --port 8900
+    python benchmarks/stub_upstream.py --latency caiyun=lognormal:180:0.4,deepseek=normal:900:250 \\
+        --error-rate siliconflow_vl=0.02,deepseek=0.05
+    UPSTREAM_MODE=stub UPSTREAM_STUB_URL=http://127.0.0.1:8900 uvicorn main:app
+
+延迟分布 (单位毫秒):
+    fixed:MS | uniform:LO:HI | normal:MEAN:STD | lognormal:MEDIAN:SIGMA
+上游名称: caiyun, nominatim, siliconflow_vl, siliconflow_kolors, deepseek, image_download, * (默认)
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import threading
+from datetime import date, datetime, timedelta
+from uuid import uuid4
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+UPSTREAMS = ("caiyun", "nominatim", "siliconflow_vl", "siliconflow_kolors", "deepseek", "image_download")
+
+# 未配置时各上游的默认延迟，量级参考线上 track_upstream 观测值
+DEFAULT_LATENCY = {
+    "caiyun": "lognormal:150:0.4",
+    "nominatim": "lognormal:300:0.5",
+    "siliconflow_vl": "lognormal:4000:0.35",
+    "siliconflow_kolors": "lognormal:8000:0.3",
+    "deepseek": "lognormal:1200:0.4",
+    "image_download": "lognormal:250:0.5",
+}
+
+
+# ==========================================
+# 延迟分布与错误注入
+# ==========================================
+def parse_distribution(spec: str):
+    """把 "lognormal:150:0.4" 之类的描述解析为返回秒数的采样函数"""
+    kind, *raw = spec.split(":")
+    params = [float(p) for p in raw]
+    if kind == "fixed" and len(params) == 1:
+        return lambda: params[0] / 1000
+    if kind == "uniform" and len(params) == 2:
+        return lambda: random.uniform(params[0], params[1]) / 1000
+    if kind == "normal" and len(params) == 2:
+        return lambda: max(0.0, random.gauss(params[0], params[1])) / 1000
+    if kind == "lognormal" and len(params) == 2:
+        mu = math.log(max(params[0], 1e-3))
+        return lambda: random.lognormvariate(mu, params[1]) / 1000
+    raise ValueError(f"无法解析延迟分布: {spec}")
+
+
+def parse_mapping(text: str):
+    """解析 "a=x,b=y" 形式的按上游配置"""
+    result = {}
+    for part in (text or "").split(","):
+        if not part.strip():
+            continue
+        name, _, value = part.partition("=")
+        result[name.strip()] = value.strip()
+    return result
+
+
+class StubConfig:
+    def __init__(self, latency=None, error_rate=None, error_status=503, seed=None):
+        specs = dict(DEFAULT_LATENCY)
+        specs.update(latency or {})
+        self.latency_specs = specs
+        self.samplers = {name: parse_distribution(spec) for name, spec in specs.items()}
+        self.error_rate = {name: float(rate) for name, rate in (error_rate or {}).items()}
+        self.error_status = error_status
+        self.counts = {}
+        self._lock = threading.Lock()
+        if seed is not None:
+            random.seed(seed)
+
+    def delay(self, upstream: str) -> float:
+        sampler = self.samplers.get(upstream) or self.samplers.get("*")
+        return sampler() if sampler else 0.0
+
+    def should_fail(self, upstream: str) -> bool:
+        rate = self.error_rate.get(upstream, self.error_rate.get("*", 0.0))
+        return rate > 0 and random.random() < rate
+
+    def count(self, upstream: str, outcome: str):
+        with self._lock:
+            stats = self.counts.setdefault(upstream, {"ok": 0, "error": 0})
+            stats[outcome] += 1
+
+
+# ==========================================
+# 固定响应
+# ==========================================
+SKYCONS = ["CLEAR_DAY", "PARTLY_CLOUDY_DAY", "CLOUDY", "LIGHT_RAIN", "MODERATE_RAIN", "WIND"]
+
+# 视觉分析返回的几类典型单品，按请求体哈希轮换，使入库数据覆盖多个品类
+CLOTHING_FIXTURES = [
+    {"category_main": "上衣", "category_sub": "T恤(长/短)", "warmth_level": 1, "materials": ["棉"],
+     "is_windproof": False, "waterproof_level": "无", "breathability": "高(透气)", "collar_type": "圆领",
+     "length_type": "短", "color_pattern": "纯色", "main_color": "白", "seasons": ["夏"],
+     "fit": "合身", "styles": ["休闲"], "occasions": ["逛街"], "gender": "中性", "status": "正常"},
+    {"category_main": "裤子", "category_sub": "牛仔裤", "warmth_level": 2, "materials": ["牛仔"],
+     "is_windproof": False, "waterproof_level": "无", "breathability": "中", "collar_type": "无",
+     "length_type": "长", "color_pattern": "纯色", "main_color": "深蓝", "seasons": ["春", "秋"],
+     "fit": "紧身", "styles": ["休闲"], "occasions": ["逛街", "通勤"], "gender": "中性", "status": "正常"},
+    {"category_main": "上衣", "category_sub": "夹克", "warmth_level": 3, "materials": ["涤纶/聚酯纤维"],
+     "is_windproof": True, "waterproof_level": "防泼水", "breathability": "中", "collar_type": "立领",
+     "length_type": "短", "color_pattern": "纯色", "main_color": "黑", "seasons": ["春", "秋"],
+     "fit": "宽松/Oversize", "styles": ["街头"], "occasions": ["通勤"], "gender": "男款", "status": "正常"},
+    {"category_main": "裤子", "category_sub": "半身裙", "warmth_level": 2, "materials": ["雪纺"],
+     "is_windproof": False, "waterproof_level": "无", "breathability": "高(透气)", "collar_type": "无",
+     "length_type": "中长", "color_pattern": "图案/印花", "main_color": "粉", "seasons": ["春", "夏"],
+     "fit": "合身", "styles": ["优雅"], "occasions": ["约会", "通勤"], "gender": "女款", "status": "正常"},
+    {"category_main": "鞋", "category_sub": "运动鞋", "warmth_level": 2, "materials": ["其他"],
+     "is_windproof": False, "waterproof_level": "无", "breathability": "高(透气)", "collar_type": "无",
+     "length_type": "短", "color_pattern": "拼接/撞色", "main_color": "灰", "seasons": ["春", "夏", "秋"],
+     "fit": "合身", "styles": ["运动"], "occasions": ["运动", "逛街"], "gender": "中性", "status": "正常"},
+]
+
+COMMENTS = [
+    "今天这身稳得像天气预报员的发型，出门放心浪。",
+    "风有点大，外套记得扣好，别让气质被吹跑了。",
+    "这配色和天气很搭，路人回头率预计上涨 30%。",
+]
+
+
+def caiyun_weather(seed: int):
+    rng = random.Random(seed)
+    base = rng.uniform(5, 30)
+    today = date.today()
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+
+    def daily(fn):
+        return [fn(i) for i in range(7)]
+
+    return {
+        "status": "ok",
+        "result": {
+            "forecast_keypoint": "桩服务天气：未来几小时天气平稳",
+            "realtime": {
+                "temperature": round(base, 1),
+                "apparent_temperature": round(base - 1.5, 1),
+                "humidity": round(rng.uniform(0.3, 0.9), 2),
+                "skycon": rng.choice(SKYCONS),
+                "wind": {"speed": round(rng.uniform(2, 30), 1)},
+                "life_index": {"ultraviolet": {"index": rng.randint(0, 9)}},
+                "air_quality": {"aqi": {"chn": rng.randint(20, 150)}},
+            },
+            "hourly": {
+                "temperature": [
+                    {"datetime": (now + timedelta(hours=h)).strftime("%Y-%m-%dT%H:%M+08:00"),
+                     "value": round(base + 3 * math.sin(h / 24 * 2 * math.pi), 1)}
+                    for h in range(24)
+                ],
+                "skycon": [{"value": rng.choice(SKYCONS)} for _ in range(24)],
+            },
+            "daily": {
+                "temperature": daily(lambda i: {
+                    "date": (today + timedelta(days=i)).isoformat(),
+                    "min": round(base - 4 + i * 0.5, 1), "max": round(base + 4 + i * 0.5, 1),
+                    "avg": round(base + i * 0.5, 1),
+                }),
+                "skycon": daily(lambda i: {"value": rng.choice(SKYCONS)}),
+                "humidity": daily(lambda i: {"avg": round(rng.uniform(0.3, 0.9), 2)}),
+                "wind": daily(lambda i: {"avg": {"speed": round(rng.uniform(3, 15), 1)},
+                                         "max": {"speed": round(rng.uniform(10, 35), 1)}}),
+                "precipitation": daily(lambda i: {"probability": rng.choice([0, 10, 40, 80])}),
+                "life_index": {
+                    "ultraviolet": daily(lambda i: {"index": rng.randint(0, 9)}),
+                    "comfort": daily(lambda i: {"index": rng.randint(1, 10)}),
+                },
+                "astro": daily(lambda i: {"sunrise": {"time": "06:20"}, "sunset": {"time": "18:10"}}),
+            },
+        },
+    }
+
+
+def chat_completion(content: str):
+    return {
+        "id": f"stub-{uuid4().hex[:8]}",
+        "object": "chat.completion",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+    }
+
+
+_image_cache = {}
+
+
+def render_image(size: str) -> bytes:
+    """按尺寸生成一张纯色 JPEG (按尺寸缓存，避免桩服务自身成为瓶颈)"""
+    if size not in _image_cache:
+        try:
+            width, height = (int(v) for v in size.lower().split("x"))
+        except ValueError:
+            width, height = 1024, 1024
+        buf = io.BytesIO()
+        Image.new("RGB", (width, height), (180, 160, 140)).save(buf, format="JPEG", quality=85)
+        _image_cache[size] = buf.getvalue()
+    return _image_cache[size]
+
+
+def _seed_of(body: bytes, path: str) -> int:
+    return int(hashlib.sha256(path.encode("utf-8") + body).hexdigest()[:8], 16)
+
+
+# ==========================================
+# 应用
+# ==========================================
+def create_app(config: StubConfig) -> FastAPI:
+    app = FastAPI(title="SmartWardrobe upstream stub")
+
+    @app.get("/_stub/stats")
+    def stub_stats():
+        return {"latency": config.latency_specs, "error_rate": config.error_rate, "counts": config.counts}
+
+    @app.api_route("/{upstream}/{path:path}", methods=["GET", "POST"])
+    async def handle(upstream: str, path: str, request: Request):
+        if upstream not in UPSTREAMS:
+            return JSONResponse({"error": f"unknown upstream {upstream}"}, status_code=404)
+
+        body = await request.body()
+        await asyncio.sleep(config.delay(upstream))
+        if config.should_fail(upstream):
+            config.count(upstream, "error")
+            return JSONResponse({"error": "stub injected failure"}, status_code=config.error_status)
+        config.count(upstream, "ok")
+
+        seed = _seed_of(body, str(request.url))
+        if upstream == "nominatim":
+            q = request.query_params.get("q", "")
+            rng = random.Random(seed)
+            return [{"lon": f"{rng.uniform(100, 122):.4f}", "lat": f"{rng.uniform(20, 45):.4f}", "display_name": q}]
+
+        if upstream == "caiyun":
+            return caiyun_weather(seed)
+
+        if upstream == "siliconflow_vl":
+            fixture = CLOTHING_FIXTURES[seed % len(CLOTHING_FIXTURES)]
+            return chat_completion(json.dumps(fixture, ensure_ascii=False))
+
+        if upstream == "deepseek":
+            return chat_completion(COMMENTS[seed % len(COMMENTS)])
+
+        if upstream == "siliconflow_kolors":
+            payload = json.loads(body or b"{}")
+            size = payload.get("image_size", "1024x1024")
+            url = f"{str(request.base_url).rstrip('/')}/image_download/kolors/{uuid4().hex}.jpg?size={size}"
+            return {"data": [{"url": url}], "seed": seed}
+
+        # image_download
+        return Response(render_image(request.query_params.get("size", "1024x1024")), media_type="image/jpeg")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="外部 API 桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", default=os.getenv("STUB_LATENCY", ""),
+                        help="按上游的延迟分布，如 caiyun=fixed:50,*=uniform:10:30")
+    parser.add_argument("--error-rate", default=os.getenv("STUB_ERROR_RATE", ""),
+                        help="按上游的错误率，如 deepseek=0.05,*=0.01")
+    parser.add_argument("--error-status", type=int, default=503, help="注入错误时返回的状态码")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=parse_mapping(args.latency),
+        error_rate=parse_mapping(args.error_rate),
+        error_status=args.error_status,
+        seed=args.seed,
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+基准测试用的合成数据：虚拟衣橱、穿搭历史与天气上下文
+
+属性分布参照 ai_service.SYSTEM_PROMPT 中的标准值列表，按常见衣橱的构成加权；
+这里不直接 import ai_service，避免加载 CLIP 模型。
+"""
+import datetime
+import random
+import numpy as np
+from sqlalchemy import insert
+import models
+
+EMBEDDING_DIM = 512
+
+# (大类, 权重, 子类列表)
+CATEGORY_DIST = [
+    ("上衣", 0.34, ["T恤(长/短)", "卫衣(连帽/圆领)", "毛衣/针织衫", "衬衫", "吊带/背心", "夹克", "风衣", "大衣", "羽绒服", "西装", "冲锋衣"]),
+    ("裤子", 0.24, ["牛仔裤", "休闲裤", "运动裤", "西装裤", "工装裤", "短裤", "半身裙", "百褶裙"]),
+    ("连体类", 0.05, ["连衣裙", "连体裤", "背带裤/裙"]),
+    ("鞋", 0.14, ["运动鞋", "板鞋", "帆布鞋", "皮鞋", "靴子(短/长)", "乐福鞋", "凉鞋"]),
+    ("包", 0.08, ["单肩包", "双肩包", "手提包", "斜挎包", "帆布袋"]),
+    ("帽子", 0.06, ["鸭舌帽/棒球帽", "渔夫帽", "毛线帽", "贝雷帽"]),
+    ("配饰", 0.09, ["围巾", "丝巾", "手套", "腰带/皮带", "墨镜/眼镜"]),
+]
+
+LAYER_BY_SUB = {
+    "T恤(长/短)": "Base", "吊带/背心": "Base", "衬衫": "Base",
+    "卫衣(连帽/圆领)": "Mid", "毛衣/针织衫": "Mid",
+    "西装": "Outer", "夹克": "Outer", "风衣": "Outer", "大衣": "Outer",
+    "冲锋衣": "Outer_Heavy", "羽绒服": "Outer_Heavy",
+}
+
+MATERIALS = ["棉", "涤纶/聚酯纤维", "牛仔", "羊毛/羊绒", "真丝/丝绸", "亚麻", "皮质", "羽绒", "针织", "雪纺", "尼龙"]
+COLORS = ["黑", "白", "灰", "卡其", "棕", "深蓝", "浅蓝", "红", "粉", "绿", "紫", "黄", "橙", "多色"]
+COLOR_WEIGHTS = [18, 16, 12, 8, 6, 10, 7, 4, 4, 4, 2, 3, 2, 4]
+STYLES = ["休闲", "商务", "运动", "街头", "复古", "极简", "优雅", "日系", "工装", "甜酷"]
+OCCASIONS = ["通勤", "居家", "户外", "约会", "正式宴会", "旅行", "运动", "逛街"]
+SEASONS = ["春", "夏", "秋", "冬"]
+
+# 反馈分布: 1:采纳, 0:忽略, -1:太冷, -2:太热, -3:风格不搭
+FEEDBACK_CODES = [1, 0, -1, -2, -3]
+FEEDBACK_WEIGHTS = [45, 30, 10, 10, 5]
+
+
+def _random_embedding(rng):
+    vec = rng.standard_normal(EMBEDDING_DIM).astype(np.float32)
+    vec /= np.linalg.norm(vec)
+    # 保留 6 位小数，与真实 JSON 存储体积接近
+    return [round(float(x), 6) for x in vec]
+
+
+def make_item_rows(user_id, n_items, seed=0):
+    """生成 n_items 条 ClothingItem 行 (dict)，可直接用于 executemany"""
+    rnd = random.Random(seed)
+    rng = np.random.default_rng(seed)
+    cats = [c[0] for c in CATEGORY_DIST]
+    weights = [c[1] for c in CATEGORY_DIST]
+    subs = {c[0]: c[2] for c in CATEGORY_DIST}
+
+    rows = []
+    for _ in range(n_items):
+        cat = rnd.choices(cats, weights)[0]
+        sub = rnd.choice(subs[cat])
+        if cat in ("上衣", "裤子", "连体类"):
+            warmth = rnd.choices([1, 2, 3, 4, 5], [20, 30, 25, 15, 10])[0]
+        else:
+            warmth = rnd.choices([1, 2, 3], [60, 30, 10])[0]
+        rows.append({
+            "user_id": user_id,
+            "image_url": f"uploads/{user_id}/synthetic_{rnd.getrandbits(48):012x}.png",
+            "category_main": cat,
+            "category_sub": sub,
+            "default_layer": LAYER_BY_SUB.get(sub, "Unknown") if cat == "上衣" else None,
+            "warmth_level": warmth,
+            "materials": rnd.sample(MATERIALS, rnd.choice([1, 1, 2])),
+            "is_windproof": rnd.random() < 0.2,
+            "waterproof_level": rnd.choices(["无", "防泼水", "完全防水"], [80, 15, 5])[0],
+            "breathability": rnd.choices(["低(闷)", "中", "高(透气)"], [15, 55, 30])[0],
+            "color_pattern": rnd.choices(["纯色", "图案/印花", "格纹/条纹", "拼接/撞色"], [60, 20, 12, 8])[0],
+            "main_color": rnd.choices(COLORS, COLOR_WEIGHTS)[0],
+            "status": rnd.choices(["正常", "清洗中", "闲置"], [90, 5, 5])[0],
+            "seasons": rnd.sample(SEASONS, rnd.randint(1, 4)),
+            "fit": rnd.choices(["紧身", "合身", "宽松/Oversize"], [15, 55, 30])[0],
+            "gender": rnd.choices(["中性", "男款", "女款"], [50, 25, 25])[0],
+            "styles": rnd.sample(STYLES, rnd.randint(1, 3)),
+            "occasions": rnd.sample(OCCASIONS, rnd.randint(1, 3)),
+            "embedding_vector": _random_embedding(rng),
+        })
+    return rows
+
+
+def make_history_rows(user_id, item_ids_by_cat, n_records, seed=0):
+    """生成 n_records 条 OutfitHistory 行，日期分布在过去一年内"""
+    rnd = random.Random(seed + 1)
+    now = datetime.datetime.now()
+    tops = item_ids_by_cat.get("上衣") or [None]
+    bottoms = item_ids_by_cat.get("裤子") or [None]
+    one_pieces = item_ids_by_cat.get("连体类") or [None]
+
+    rows = []
+    for _ in range(n_records):
+        use_one_piece = rnd.random() < 0.1
+        rows.append({
+            "user_id": user_id,
+            "date": now - datetime.timedelta(days=rnd.uniform(0, 365)),
+            "weather_temp": rnd.randint(-5, 36),
+            "weather_desc": rnd.choice(["晴", "多云", "阴", "小雨"]),
+            "scenario": "user_feedback",
+            "top_id": None if use_one_piece else rnd.choice(tops),
+            "bottom_id": None if use_one_piece else rnd.choice(bottoms),
+            "outer_id": rnd.choice(tops) if rnd.random() < 0.3 else None,
+            "one_piece_id": rnd.choice(one_pieces) if use_one_piece else None,
+            "feedback_score": rnd.choices(FEEDBACK_CODES, FEEDBACK_WEIGHTS)[0],
+        })
+    return rows
+
+
+def populate_user(db, user_id, n_items, n_history, seed=0, profile_overrides=None, chunk_size=2000):
+    """向 db 写入一个合成用户 (画像 + 衣橱 + 历史)，返回 {大类: [item_id]}"""
+    profile = models.UserProfile(user_id=user_id, **(profile_overrides or {}))
+    db.add(profile)
+
+    rows = make_item_rows(user_id, n_items, seed=seed)
+    for i in range(0, len(rows), chunk_size):
+        db.execute(insert(models.ClothingItem), rows[i:i + chunk_size])
+    db.flush()
+
+    ids_by_cat = {}
+    for item_id, cat in db.query(models.ClothingItem.id, models.ClothingItem.category_main).filter(
+        models.ClothingItem.user_id == user_id
+    ):
+        ids_by_cat.setdefault(cat, []).append(item_id)
+
+    history = make_history_rows(user_id, ids_by_cat, n_history, seed=seed)
+    for i in range(0, len(history), chunk_size):
+        db.execute(insert(models.OutfitHistory), history[i:i + chunk_size])
+    db.commit()
+    return ids_by_cat
+
+
+def _weather(temp_real, temp_feel, humidity, wind_speed, skycon, t_max, t_min, rain_prob, summary):
+    return {
+        "location": "118.08,24.48",
+        "summary_text": summary,
+        "current": {
+            "temp_real": temp_real, "temp_feel": temp_feel, "humidity": humidity,
+            "skycon": skycon, "wind_speed": wind_speed, "uv_index": 3.0, "aqi": 40.0,
+        },
+        "today_stat": {
+            "temp_max": t_max, "temp_min": t_min, "rain_prob": rain_prob,
+            "wind_max": wind_speed * 1.5, "uv_max": 5.0, "comfort_index": 4.0,
+            "sunrise": "06:30", "sunset": "18:10",
+        },
+        "hourly_trend": [],
+        "daily_forecast": [],
+        "signals": {
+            "need_umbrella": rain_prob >= 30,
+            "need_windbreaker": wind_speed * 1.5 > 20,
+            "need_sun_protection": False,
+            "high_humidity": humidity > 0.7,
+            "temp_diff_alert": (t_max - t_min) > 10,
+        },
+    }
+
+
+# 典型天气上下文，结构与 weather_service.get_weather_info 的返回一致
+WEATHER_FIXTURES = {
+    "hot_humid": _weather(33, 37, 0.85, 3, "晴", 35, 27, 10, "闷热，午后注意防晒"),
+    "mild": _weather(21, 21, 0.55, 4, "多云", 25, 17, 20, "多云，体感舒适"),
+    "cold_windy": _weather(4, -1, 0.40, 18, "阴", 7, -2, 5, "大风降温，注意保暖"),
+    "rainy": _weather(14, 12, 0.92, 8, "中雨", 16, 11, 90, "全天有雨，出门带伞"),
+}
@@ -0,0 +1,131 @@
+import colorsys
+import numpy as np
+
+
+class ColorHarmonyAnalyzer:
+    """色彩分析工具类"""
+    
+    @staticmethod
+    def rgb_to_hsv_standardized(rgb_tuple):
+        """将 RGB (0-255) 转换为标准化 HSV (H:0-360, S:0-1, V:0-1)"""
+        r, g, b = [x/255.0 for x in rgb_tuple]
+        h, s, v = colorsys.rgb_to_hsv(r, g, b)
+        return h * 360, s, v
+
+    @staticmethod
+    def calculate_score(rgb1, rgb2):
+        """
+        计算两个 RGB 颜色的和谐度
+        :param rgb1: tuple (r, g, b)
+        :param rgb2: tuple (r, g, b)
+        :return: score (0-100), description
+        """
+        h1, s1, v1 = ColorHarmonyAnalyzer.rgb_to_hsv_standardized(rgb1)
+        h2, s2, v2 = ColorHarmonyAnalyzer.rgb_to_hsv_standardized(rgb2)
+        
+        # 计算色相环上的最短距离
+        diff_h = abs(h1 - h2)
+        if diff_h > 180:
+            diff_h = 360 - diff_h
+            
+        # 1. 无彩色逻辑 (黑白灰)
+        is_neutral_1 = s1 < 0.15 or v1 < 0.15 or (v1 > 0.9 and s1 < 0.1)
+        is_neutral_2 = s2 < 0.15 or v2 < 0.15 or (v2 > 0.9 and s2 < 0.1)
+        
+        if is_neutral_1 or is_neutral_2:
+            return 85, "百搭基础色"
+            
+        # 2. 同色系 (色相差 < 15)
+        if diff_h < 15:
+            return 90, "同色系高级感"
+            
+        # 3. 邻近色 (15 < 色相差 < 45)
+        if 15 <= diff_h < 45:
+            return 80, "邻近色柔和"
+            
+        # 4. 互补色/撞色 (150 < 色相差 < 210)
+        if 150 < diff_h < 210:
+            return 95, "吸睛撞色"
+        
+        # 5. 对比色 (110 < 色相差 < 150)
+        if 110 < diff_h <= 150:
+            return 75, "对比强烈"
+
+        return 50, "常规搭配"
+
+
+# ==========================================
+# 和谐度查找表
+# ==========================================
+# HSV 量化：色相每 5 度一格；饱和度/明度的分界与 calculate_score 的无彩色阈值对齐，
+# 保证同一格内的颜色判定结果一致
+HUE_BIN_DEGREES = 5
+N_HUE_BINS = 360 // HUE_BIN_DEGREES
+S_EDGES = np.array([0.0, 0.1, 0.15, 0.4, 0.7, 1.0])
+V_EDGES = np.array([0.0, 0.15, 0.4, 0.7, 0.9, 1.0])
+N_S_BINS = len(S_EDGES) - 1
+N_V_BINS = len(V_EDGES) - 1
+N_BINS = N_HUE_BINS * N_S_BINS * N_V_BINS
+
+_lut = None
+
+# 颜色缺失 (旧数据没有本地主色) 时使用的和谐度：按 "百搭基础色" 计分，
+# 使所有搭配都走同一个打分公式，有无主色的搭配之间排序可比
+NEUTRAL_HARMONY_SCORE = 85
+
+
+def _bin_centers():
+    h = (np.arange(N_HUE_BINS) + 0.5) * HUE_BIN_DEGREES
+    s = (S_EDGES[:-1] + S_EDGES[1:]) / 2
+    v = (V_EDGES[:-1] + V_EDGES[1:]) / 2
+    hh, ss, vv = np.meshgrid(h, s, v, indexing="ij")
+    return hh.ravel(), ss.ravel(), vv.ravel()
+
+
+def _build_lut():
+    """按 calculate_score 的规则对所有格子两两打分 (向量化)，结果为 N_BINS x N_BINS 的 uint8 矩阵"""
+    h, s, v = _bin_centers()
+    diff_h = np.abs(h[:, None] - h[None, :])
+    diff_h = np.where(diff_h > 180, 360 - diff_h, diff_h)
+
+    neutral = (s < 0.15) | (v < 0.15) | ((v > 0.9) & (s < 0.1))
+    any_neutral = neutral[:, None] | neutral[None, :]
+
+    scores = np.select(
+        [
+            any_neutral,
+            diff_h < 15,
+            (diff_h >= 15) & (diff_h < 45),
+            (diff_h > 150) & (diff_h < 210),
+            (diff_h > 110) & (diff_h <= 150),
+        ],
+        [85, 90, 80, 95, 75],
+        default=50,
+    )
+    return scores.astype(np.uint8)
+
+
+def get_lut():
+    global _lut
+    if _lut is None:
+        _lut = _build_lut()
+    return _lut
+
+
+def color_bin(hsv):
+    """HSV (H:0-360, S:0-1, V:0-1) -> 查找表格子下标；hsv 缺失时返回 None"""
+    if not hsv or len(hsv) != 3:
+        return None
+    h, s, v = hsv
+    h_bin = int(h // HUE_BIN_DEGREES) % N_HUE_BINS
+    s_bin = min(int(np.searchsorted(S_EDGES, s, side="right")) - 1, N_S_BINS - 1)
+    v_bin = min(int(np.searchsorted(V_EDGES, v, side="right")) - 1, N_V_BINS - 1)
+    return (h_bin * N_S_BINS + max(s_bin, 0)) * N_V_BINS + max(v_bin, 0)
+
+
+def harmony_score(hsv1, hsv2):
+    """两种颜色的和谐度 (0-100)，查表 O(1)；任一颜色缺失返回 None"""
+    b1, b2 = color_bin(hsv1), color_bin(hsv2)
+    if b1 is None or b2 is None:
+        return None
+    return int(get_lut()[b1, b2])
@@ -1,13 +1,49 @@
-from sqlalchemy import create_engine
+import os
+import logging
+from sqlalchemy import create_engine, event, inspect
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+logger = logging.getLogger("SmartWardrobe.DB")
 
 # 使用 SQLite 数据库，文件名为 wardrobe.db
 SQLALCHEMY_DATABASE_URL = "sqlite:///./wardrobe.db"
+# 异步驱动 (aiosqlite) 访问同一个数据库文件，供 async def 接口使用
+ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./wardrobe.db"
+
+# SQLite 连接级调优参数 (可通过环境变量调整)
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))      # 页缓存 64MB
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # 内存映射 256MB
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
+
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record=None):
+    """
+    每个新连接建立时设置 PRAGMA:
+    - WAL: 读写不互相阻塞，并发请求下读不会被写锁住
+    - synchronous=NORMAL: WAL 模式下仍保证一致性，省去每次提交的 fsync
+    - cache_size / mmap_size: 扩大页缓存并用内存映射读取，减少系统调用
+    - temp_store=MEMORY: 排序/临时表放内存
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    finally:
+        cursor.close()
+
+
+event.listen(engine, "connect", apply_sqlite_pragmas)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
@@ -18,4 +54,61 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# 异步引擎与会话：async def 接口中的查询不再阻塞事件循环
+async_engine = create_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+
+# expire_on_commit=False：提交后对象属性仍可直接读取，避免在异步上下文中触发隐式懒加载
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+# 获取异步数据库会话的依赖函数
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def _add_missing_columns(bind, inspector, table):
+    """为已存在的表补加模型中新增的列 (SQLite 只支持 ADD COLUMN，新列需可为空或带常量默认值)"""
+    existing = {col["name"] for col in inspector.get_columns(table.name)}
+    added = []
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(dialect=bind.dialect)}'
+        if column.server_default is not None:
+            default = str(column.server_default.arg).replace("'", "''")
+            ddl += f" DEFAULT '{default}'"
+        with bind.begin() as conn:
+            conn.exec_driver_sql(ddl)
+        added.append(f"{table.name}.{column.name}")
+    return added
+
+
+def run_migrations(bind=engine):
+    """
+    启动迁移：建表之后为已有的 wardrobe.db 补加模型中新增的列和索引
+    (create_all 只会创建缺失的表，已存在的表需要单独补建)
+    """
+    inspector = inspect(bind)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        added_columns = _add_missing_columns(bind, inspector, table)
+        if added_columns:
+            logger.info(f"数据库迁移：已补加列 {added_columns}")
+        existing = {idx["name"] for idx in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=bind, checkfirst=True)
+                created.append(index.name)
+
+    if created:
+        logger.info(f"数据库迁移：已补建索引 {created}")
+        # 更新查询规划器的统计信息，让新索引立即被选用
+        with bind.begin() as conn:
+            conn.exec_driver_sql("ANALYZE")
+    return created
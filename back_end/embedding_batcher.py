@@ -0,0 +1,106 @@
+import asyncio
+import os
+import time
+import logging
+import ai_service
+
+logger = logging.getLogger("SmartWardrobe.EmbeddingBatcher")
+
+# 微批参数 (可通过环境变量调整)
+# 最长等待时间：第一张图片入队后最多再等多少毫秒凑批
+CLIP_BATCH_MAX_WAIT_MS = float(os.getenv("CLIP_BATCH_MAX_WAIT_MS", "20"))
+# 单批最大图片数
+CLIP_BATCH_MAX_SIZE = int(os.getenv("CLIP_BATCH_MAX_SIZE", "16"))
+
+
+class EmbeddingBatcher:
+    """
+    CLIP 向量提取的异步微批调度器
+    并发的 /analyze-selected 请求各自提交一张图片，调度器在 max_wait_ms 或 max_batch_size
+    先到者触发时合并为一次批量前向计算，再把结果分发回每个调用方的 future
+    """
+
+    def __init__(self, encode_fn, max_wait_ms=CLIP_BATCH_MAX_WAIT_MS, max_batch_size=CLIP_BATCH_MAX_SIZE):
+        self.encode_fn = encode_fn
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+
+        self._queue = None
+        self._worker = None
+
+        # 运行统计 (批次数 / 图片数 / 填充率)
+        self.batches_total = 0
+        self.items_total = 0
+        self.last_batch_size = 0
+        self.encode_seconds_total = 0.0
+
+    def _ensure_worker(self):
+        # 队列与后台任务需绑定到当前事件循环，首次提交时再创建
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def submit(self, image_path: str):
+        """提交单张图片，等待所在批次完成后返回向量 (失败返回 None)"""
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image_path, future))
+        return await future
+
+    async def _collect_batch(self):
+        # 阻塞等待第一张图片，之后在截止时间内尽量凑满一批
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+            paths = [path for path, _ in batch]
+
+            start = time.perf_counter()
+            try:
+                # 前向计算放到线程池，避免阻塞事件循环
+                vectors = await loop.run_in_executor(None, self.encode_fn, paths)
+            except Exception as e:
+                logger.error(f"Batch embedding failed: {e}", exc_info=True)
+                vectors = [None] * len(batch)
+            elapsed = time.perf_counter() - start
+
+            self.batches_total += 1
+            self.items_total += len(batch)
+            self.last_batch_size = len(batch)
+            self.encode_seconds_total += elapsed
+            logger.debug(f"CLIP batch size={len(batch)}/{self.max_batch_size}, cost={elapsed * 1000:.1f}ms")
+
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():  # 调用方可能已取消
+                    future.set_result(vector)
+
+    def stats(self):
+        """返回批处理统计：平均批大小与填充率 (平均批大小 / 最大批大小)"""
+        avg_batch = self.items_total / self.batches_total if self.batches_total else 0.0
+        return {
+            "max_wait_ms": self.max_wait * 1000,
+            "max_batch_size": self.max_batch_size,
+            "batches_total": self.batches_total,
+            "items_total": self.items_total,
+            "avg_batch_size": avg_batch,
+            "fill_rate": avg_batch / self.max_batch_size,
+            "last_batch_size": self.last_batch_size,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "encode_seconds_total": self.encode_seconds_total,
+        }
+
+
+# 全局实例，供 main.py 使用
+clip_batcher = EmbeddingBatcher(ai_service.get_image_embeddings_batch)
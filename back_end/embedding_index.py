@@ -0,0 +1,281 @@
+import os
+import copy
+import time
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import select
+
+import metrics_service
+from models import ClothingItem
+
+logger = logging.getLogger("SmartWardrobe.EmbeddingIndex")
+
+# ==========================================
+# 配置
+# ==========================================
+# 衣物数达到该值后改用 IVF 倒排索引，否则直接矩阵乘法暴力检索
+EMBEDDING_IVF_THRESHOLD = int(os.getenv("EMBEDDING_IVF_THRESHOLD", "4000"))
+# IVF 查询时探查的聚类数
+EMBEDDING_IVF_NPROBE = int(os.getenv("EMBEDDING_IVF_NPROBE", "8"))
+EMBEDDING_KMEANS_ITERS = 10
+# 增量写入后衣物数比上次聚类时增长超过该比例才重新聚类，其余时间新向量直接归入最近的聚类
+EMBEDDING_IVF_RECLUSTER_GROWTH = float(os.getenv("EMBEDDING_IVF_RECLUSTER_GROWTH", "0.25"))
+# 缓存索引的用户数上限
+EMBEDDING_INDEX_MAX_USERS = int(os.getenv("EMBEDDING_INDEX_MAX_USERS", "64"))
+# 新增衣物时，与已有衣物余弦相似度超过该值视为疑似重复
+DUPLICATE_SIMILARITY_THRESHOLD = float(os.getenv("DUPLICATE_SIMILARITY_THRESHOLD", "0.95"))
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class EmbeddingIndex:
+    """
+    单个用户衣橱的 CLIP 向量索引 (向量已归一化，内积即余弦相似度)
+    - 小衣橱：float32 矩阵与查询向量做一次矩阵乘法 (BLAS)
+    - 大衣橱：球面 k-means 划分为 sqrt(n) 个倒排列表 (IVF)，只在最近的 nprobe 个列表中检索
+    衣物增删改通过 with_vector / without 生成新索引 (写时复制)，进行中的查询始终看到一致的旧索引
+    """
+
+    def __init__(self, ids, vectors, version):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.vectors = _normalize(np.asarray(vectors, dtype=np.float32)) if len(ids) else np.zeros((0, 0), np.float32)
+        self.version = version
+        self.centroids = None
+        self.lists = None
+        # 每行所属的倒排列表，增量更新时用于定位
+        self.assign = None
+        # 上次聚类时的衣物数
+        self.clustered_size = 0
+        if len(self.ids) >= EMBEDDING_IVF_THRESHOLD:
+            self._build_ivf()
+
+    @property
+    def kind(self):
+        return "ivf" if self.centroids is not None else "flat"
+
+    def _build_ivf(self):
+        n = len(self.ids)
+        n_lists = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(0)
+        centroids = self.vectors[rng.choice(n, n_lists, replace=False)].copy()
+        for _ in range(EMBEDDING_KMEANS_ITERS):
+            assign = np.argmax(self.vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, self.vectors)
+            counts = np.bincount(assign, minlength=n_lists)
+            # 空聚类保留原中心
+            nonempty = counts > 0
+            centroids[nonempty] = _normalize(sums[nonempty])
+        assign = np.argmax(self.vectors @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.cumsum(np.bincount(assign, minlength=n_lists))[:-1]
+        self.centroids = centroids
+        self.lists = np.split(order, bounds)
+        self.assign = assign
+        self.clustered_size = n
+
+    def _maybe_recluster(self):
+        """增量更新后按需切换 flat/IVF，衣物数相对上次聚类增长足够多时才重新聚类"""
+        n = len(self.ids)
+        if n < EMBEDDING_IVF_THRESHOLD:
+            self.centroids = self.lists = self.assign = None
+            self.clustered_size = 0
+        elif self.centroids is None or n > self.clustered_size * (1 + EMBEDDING_IVF_RECLUSTER_GROWTH):
+            start = time.perf_counter()
+            self._build_ivf()
+            metrics_service.observe_stage("embedding_index_recluster", time.perf_counter() - start)
+
+    def _row_of(self, item_id):
+        rows = np.nonzero(self.ids == item_id)[0]
+        return int(rows[0]) if len(rows) else None
+
+    def _derive(self, version):
+        # 浅拷贝后只替换被修改的数组/列表项，不改动原索引
+        index = copy.copy(self)
+        index.version = version
+        if self.lists is not None:
+            index.lists = list(self.lists)
+            index.assign = self.assign.copy()
+        return index
+
+    def _list_remove(self, row):
+        c = self.assign[row]
+        self.lists[c] = self.lists[c][self.lists[c] != row]
+
+    def _list_add(self, row, vector):
+        c = int(np.argmax(self.centroids @ vector))
+        self.lists[c] = np.append(self.lists[c], row)
+        self.assign[row] = c
+
+    def with_vector(self, item_id, vector, version):
+        """返回写入 (新增或替换) 一件衣物向量后的新索引；维度与索引不一致的向量视为无向量"""
+        if not vector or (len(self.ids) and len(vector) != self.vectors.shape[1]):
+            return self.without(item_id, version)
+        vec = _normalize(np.asarray(vector, dtype=np.float32))
+        index = self._derive(version)
+        row = self._row_of(item_id)
+        if row is None:
+            row = len(self.ids)
+            index.ids = np.append(self.ids, item_id)
+            index.vectors = vec[None, :].copy() if row == 0 else np.vstack([self.vectors, vec])
+            if index.lists is not None:
+                index.assign = np.append(index.assign, 0)
+                index._list_add(row, vec)
+        else:
+            index.vectors = self.vectors.copy()
+            index.vectors[row] = vec
+            if index.lists is not None:
+                index._list_remove(row)
+                index._list_add(row, vec)
+        index._maybe_recluster()
+        return index
+
+    def without(self, item_id, version):
+        """返回删除一件衣物后的新索引：最后一行移到被删除的位置，其他行号不变"""
+        index = self._derive(version)
+        row = self._row_of(item_id)
+        if row is None:
+            return index
+        last = len(self.ids) - 1
+        ids, vectors = self.ids.copy(), self.vectors.copy()
+        if index.lists is not None:
+            index._list_remove(row)
+        if row != last:
+            ids[row], vectors[row] = ids[last], vectors[last]
+            if index.lists is not None:
+                c = index.assign[last]
+                index.lists[c] = np.where(index.lists[c] == last, row, index.lists[c])
+                index.assign[row] = c
+        index.ids, index.vectors = ids[:last], vectors[:last]
+        if index.assign is not None:
+            index.assign = index.assign[:last]
+        index._maybe_recluster()
+        return index
+
+    def _candidate_rows(self, query):
+        if self.centroids is None:
+            return None
+        nprobe = min(EMBEDDING_IVF_NPROBE, len(self.centroids))
+        probe = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[c] for c in probe])
+
+    def search(self, vector, k=10, exclude_id=None, min_similarity=None):
+        """返回与 vector 最相似的 k 件衣物 [(id, 相似度), ...]，按相似度降序"""
+        if not len(self.ids) or vector is None or len(vector) != self.vectors.shape[1]:
+            return []
+        query = _normalize(np.asarray(vector, dtype=np.float32))
+        rows = self._candidate_rows(query)
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        ids = self.ids if rows is None else self.ids[rows]
+
+        scores = vectors @ query
+        if exclude_id is not None:
+            scores = np.where(ids == exclude_id, -np.inf, scores)
+        if min_similarity is not None:
+            scores = np.where(scores >= min_similarity, scores, -np.inf)
+
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def vector_of(self, item_id):
+        rows = np.nonzero(self.ids == item_id)[0]
+        return self.vectors[rows[0]] if len(rows) else None
+
+
+_lock = threading.Lock()
+_indexes = OrderedDict()
+# 每个用户向量数据的代数：衣物写入时递增。索引记录构建时的代数，
+# 构建期间若有写入 (代数变化)，构建结果不写入缓存，避免缓存缺少刚提交的衣物
+_generations = {}
+
+
+def _load(db, user_id, version):
+    rows = db.execute(
+        select(ClothingItem.id, ClothingItem.embedding_vector)
+        .where(ClothingItem.user_id == user_id, ClothingItem.embedding_vector.isnot(None))
+    ).all()
+    # 虚拟衣物的向量为空列表；维度不一致的旧数据同样跳过
+    dim = max((len(vec) for _, vec in rows if vec), default=0)
+    pairs = [(item_id, vec) for item_id, vec in rows if vec and len(vec) == dim]
+    start = time.perf_counter()
+    index = EmbeddingIndex([p[0] for p in pairs], [p[1] for p in pairs], version)
+    metrics_service.observe_stage("embedding_index_build", time.perf_counter() - start)
+    return index
+
+
+def get_index(db, user_id: str) -> EmbeddingIndex:
+    """
+    获取用户向量索引 (同步会话)；首次访问或被 invalidate 后从数据库构建，
+    单件衣物的增删改通过 upsert / remove 增量更新已缓存的索引
+    """
+    with _lock:
+        version = _generations.get(user_id, 0)
+        index = _indexes.get(user_id)
+        if index is not None and index.version == version:
+            _indexes.move_to_end(user_id)
+            metrics_service.record_cache("embedding_index", True)
+            return index
+    metrics_service.record_cache("embedding_index", False)
+
+    index = _load(db, user_id, version)
+    with _lock:
+        if _generations.get(user_id, 0) == version:
+            _indexes[user_id] = index
+            _indexes.move_to_end(user_id)
+            while len(_indexes) > EMBEDDING_INDEX_MAX_USERS:
+                _indexes.popitem(last=False)
+    logger.info(f"用户{user_id}向量索引已构建: {len(index.ids)} 件, 类型 {index.kind}")
+    return index
+
+
+def _apply(user_id: str, update):
+    """递增代数并把增量更新应用到已缓存的索引；并发写入时放弃缓存，下次访问重建"""
+    with _lock:
+        version = _generations.get(user_id, 0) + 1
+        _generations[user_id] = version
+        index = _indexes.get(user_id)
+    if index is None:
+        return
+    try:
+        updated = update(index, version)
+    except Exception as e:
+        logger.warning(f"用户{user_id}向量索引增量更新失败，下次访问时重建: {e}")
+        updated = None
+    with _lock:
+        if updated is not None and _generations.get(user_id) == version and _indexes.get(user_id) is index:
+            _indexes[user_id] = updated
+        elif _indexes.get(user_id) is index:
+            _indexes.pop(user_id)
+
+
+def upsert(user_id: str, item_id: int, vector):
+    """衣物新增/修改提交后调用"""
+    _apply(user_id, lambda index, version: index.with_vector(item_id, vector, version))
+
+
+def remove(user_id: str, item_id: int):
+    """衣物删除提交后调用"""
+    _apply(user_id, lambda index, version: index.without(item_id, version))
+
+
+def invalidate(user_id: str):
+    """批量写入提交后调用：丢弃缓存的索引，下次访问时重建"""
+    with _lock:
+        _generations[user_id] = _generations.get(user_id, 0) + 1
+        _indexes.pop(user_id, None)
+
+
+def find_duplicates(db, user_id: str, vector, k=3):
+    """新增衣物前检查衣橱中是否已有几乎相同的衣物，返回 [(id, 相似度), ...]"""
+    if not vector:
+        return []
+    return get_index(db, user_id).search(vector, k=k, min_similarity=DUPLICATE_SIMILARITY_THRESHOLD)
@@ -0,0 +1,138 @@
+import os
+import hashlib
+import logging
+from PIL import Image
+from starlette.staticfiles import StaticFiles
+
+import metrics_service
+import image_ingest
+
+logger = logging.getLogger("SmartWardrobe.Derivatives")
+
+# ==========================================
+# 图片派生尺寸
+# 写入原图/抠图时同步生成缩略图与中图 (WebP，抠图保留透明通道)，
+# 文件名为原图内容哈希，内容不变则地址不变，可被浏览器/CDN 永久缓存
+# ==========================================
+UPLOAD_DIR = "uploads"
+DERIVED_SUBDIR = "derived"
+DERIVED_DIR = os.path.join(UPLOAD_DIR, DERIVED_SUBDIR)
+
+# 名称 -> 最长边像素
+DERIVATIVE_SIZES = {
+    "thumb": int(os.getenv("IMAGE_THUMB_SIZE", "256")),
+    "medium": int(os.getenv("IMAGE_MEDIUM_SIZE", "800")),
+}
+IMAGE_WEBP_QUALITY = int(os.getenv("IMAGE_WEBP_QUALITY", "80"))
+# 派生图 (内容寻址) 之外的上传文件缓存时长 (秒)，原图文件名不含内容哈希，只短期缓存
+UPLOADS_CACHE_MAX_AGE = int(os.getenv("UPLOADS_CACHE_MAX_AGE", "3600"))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def derivative_path(content_hash: str, name: str) -> str:
+    # 按哈希前两位分目录，避免单个目录文件过多
+    return os.path.join(DERIVED_DIR, content_hash[:2], f"{content_hash[:32]}_{name}.webp").replace("\\", "/")
+
+
+def generate_derivatives(image_path: str):
+    """
+    为一张上传图片生成全部派生尺寸，已存在的直接复用 (内容寻址，重复调用只需计算一次哈希)
+    :return: {"thumb": 路径, "medium": 路径}，原图不存在或无法解码时返回 None
+    """
+    # 只处理上传目录内的文件 (image_url 来自客户端回传)
+    if not image_path or not os.path.normpath(image_path).replace("\\", "/").startswith(f"{UPLOAD_DIR}/"):
+        return None
+    if not os.path.isfile(image_path):
+        return None
+
+    with metrics_service.stage_timer("image_derivatives"):
+        try:
+            content_hash = _content_hash(image_path)
+            variants = {name: derivative_path(content_hash, name) for name in DERIVATIVE_SIZES}
+            missing = [name for name, path in variants.items() if not os.path.exists(path)]
+            if not missing:
+                return variants
+
+            with Image.open(image_path) as img:
+                img = img.convert("RGBA" if image_ingest.has_alpha(img) else "RGB")
+                # 从大到小依次缩放，小图复用上一级结果
+                current = img
+                for name in sorted(missing, key=lambda n: -DERIVATIVE_SIZES[n]):
+                    size = DERIVATIVE_SIZES[name]
+                    current = current.copy()
+                    current.thumbnail((size, size), Image.LANCZOS)
+                    path = variants[name]
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    # 先写临时文件再改名，并发请求不会读到写了一半的图片
+                    tmp_path = f"{path}.{os.getpid()}.tmp"
+                    current.save(tmp_path, format="WEBP", quality=IMAGE_WEBP_QUALITY, method=4)
+                    os.replace(tmp_path, path)
+            return variants
+        except Exception as e:
+            logger.warning(f"生成派生图失败 {image_path}: {e}")
+            return None
+
+
+class UploadStaticFiles(StaticFiles):
+    """/uploads 静态目录：派生图按内容寻址，返回 immutable 长缓存；其余文件短期缓存并依赖 ETag 校验"""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        rel_path = os.path.relpath(str(full_path), str(self.directory)).replace("\\", "/")
+        if rel_path.startswith(f"{DERIVED_SUBDIR}/"):
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers["Cache-Control"] = f"public, max-age={UPLOADS_CACHE_MAX_AGE}"
+        return response
+
+
+def backfill(db, batch_size=200):
+    """为尚未生成派生图的已有衣物补生成 (python image_derivatives.py)"""
+    import models
+    import version_service
+
+    updated = 0
+    last_id = 0
+    while True:
+        items = (
+            db.query(models.ClothingItem)
+            .filter(models.ClothingItem.id > last_id, models.ClothingItem.image_variants.is_(None))
+            .order_by(models.ClothingItem.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not items:
+            break
+        users = set()
+        for item in items:
+            variants = generate_derivatives(item.image_url)
+            if variants:
+                item.image_variants = variants
+                users.add(item.user_id)
+                updated += 1
+        # 列表接口的 ETag 随版本号变化，客户端才能拿到新增的派生图地址
+        for user_id in users:
+            version_service.bump_version(db, user_id)
+        last_id = items[-1].id
+        db.commit()
+    return updated
+
+
+if __name__ == "__main__":
+    import database
+    import models
+
+    logging.basicConfig(level=logging.INFO)
+    models.Base.metadata.create_all(bind=database.engine)
+    database.run_migrations()
+    with database.SessionLocal() as session:
+        print(f"已为 {backfill(session)} 件衣物生成派生图")
@@ -1,6 +1,7 @@
 # image_gen_service.py
-import httpx
 import logging
+import metrics_service
+import upstream
 
 logger = logging.getLogger("SmartWardrobe.GenAI")
 
@@ -99,22 +100,24 @@ async def generate_outfit_image(outfit_items: dict, user_profile: dict, weather_
     }
     
     logger.info("Calling Kolors API...")
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            resp = await client.post(API_URL, json=payload, headers=headers)
-            
+    try:
+        with metrics_service.track_upstream("siliconflow_kolors") as call:
+            resp = await upstream.post("siliconflow_kolors", API_URL, timeout=60.0, json=payload, headers=headers)
             if resp.status_code != 200:
-                logger.error(f"Kolors API Error: {resp.text}")
-                return None
-                
-            result = resp.json()
-            image_url = result.get('data', [{}])[0].get('url')
-            logger.info("Image generation successful")
-            return image_url
-            
-        except Exception as e:
-            logger.error(f"Kolors generation failed: {e}")
+                call.error()
+        
+        if resp.status_code != 200:
+            logger.error(f"Kolors API Error: {resp.text}")
             return None
+            
+        result = resp.json()
+        image_url = result.get('data', [{}])[0].get('url')
+        logger.info("Image generation successful")
+        return image_url
+        
+    except Exception as e:
+        logger.error(f"Kolors generation failed: {e}")
+        return None
 def build_single_item_prompt(attrs: dict) -> str:
     """
     构建单品生成的提示词 (Product Photography)
@@ -164,15 +167,17 @@ async def generate_virtual_item_image(attrs: dict):
     }
 
     logger.info(f"Generating virtual item with prompt: {prompt}")
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            resp = await client.post(API_URL, json=payload, headers=headers)
+    try:
+        with metrics_service.track_upstream("siliconflow_kolors") as call:
+            resp = await upstream.post("siliconflow_kolors", API_URL, timeout=60.0, json=payload, headers=headers)
             if resp.status_code != 200:
-                logger.error(f"Kolors API Error: {resp.text}")
-                return None
-            
-            result = resp.json()
-            return result.get('data', [{}])[0].get('url')
-        except Exception as e:
-            logger.error(f"Virtual item generation failed: {e}")
-            return None
\ No newline at end of file
+                call.error()
+        if resp.status_code != 200:
+            logger.error(f"Kolors API Error: {resp.text}")
+            return None
+        
+        result = resp.json()
+        return result.get('data', [{}])[0].get('url')
+    except Exception as e:
+        logger.error(f"Virtual item generation failed: {e}")
+        return None
\ No newline at end of file
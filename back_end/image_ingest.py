@@ -0,0 +1,239 @@
+import io
+import os
+import asyncio
+import hashlib
+import logging
+import tempfile
+from dataclasses import dataclass
+
+import aiofiles
+from PIL import Image, ImageOps
+from starlette.responses import JSONResponse
+
+logger = logging.getLogger("SmartWardrobe.Ingest")
+
+# 分割前的最大边长 (与原先 thumbnail 的 1500 一致)
+SEGMENT_MAX_SIDE = int(os.getenv("SEGMENT_MAX_SIDE", "1500"))
+
+# 发送给视觉大模型的图片：属性识别不需要原图分辨率，缩到该长边并压到体积上限以内
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "768"))
+VISION_MAX_BYTES = int(os.getenv("VISION_MAX_BYTES", str(200 * 1024)))
+VISION_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "jpeg").lower()  # jpeg | webp
+# 抠图透明区域铺底色：中性浅灰，白色/黑色衣物都能与背景区分
+VISION_BACKGROUND = tuple(int(c) for c in os.getenv("VISION_BACKGROUND", "200,200,200").split(","))
+VISION_QUALITIES = (85, 75, 65, 55)
+VISION_MIN_SIDE = 256
+
+# 上传限制：单个文件字节数、解码后像素数 (防解压炸弹)
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_MAX_PIXELS = int(os.getenv("UPLOAD_MAX_PIXELS", str(50_000_000)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# multipart 边界与表单头的余量
+MULTIPART_OVERHEAD = 64 * 1024
+# 允许的上传格式 -> 保存的扩展名
+UPLOAD_FORMATS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+
+EXIF_ORIENTATION = 0x0112
+
+
+class UploadRejected(Exception):
+    """上传文件不合法 (大小/格式/像素)，status_code 直接作为 HTTP 状态码返回"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class IngestedUpload:
+    """已落盘的上传文件 (path 为同目录下的临时文件，由调用方改名为正式文件名)"""
+    path: str
+    sha256: str
+    size: int
+    format: str
+    width: int
+    height: int
+
+    @property
+    def extension(self) -> str:
+        return UPLOAD_FORMATS[self.format]
+
+
+class UploadSizeLimitMiddleware:
+    """
+    纯 ASGI 中间件：按 Content-Length 在解析 multipart 之前拒绝超大上传
+    (FastAPI 会先把整个表单读入临时文件再调用接口，接口内的检查来不及阻止落盘)
+    未带 Content-Length 的分块上传仍由 stream_upload 的累计大小检查兜底
+    """
+
+    def __init__(self, app, paths, max_bytes: int = UPLOAD_MAX_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.limit = max_bytes + MULTIPART_OVERHEAD
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.paths:
+            for name, value in scope["headers"]:
+                if name == b"content-length" and value.isdigit() and int(value) > self.limit:
+                    response = JSONResponse(
+                        {"detail": f"图片超过 {self.max_bytes // 1024 // 1024}MB 上限"}, status_code=413
+                    )
+                    await response(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+
+def sniff_format(head: bytes):
+    """按文件头魔数判断格式，不信任客户端提供的文件名与 Content-Type"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+def _check_dimensions(path: str, expected_format: str):
+    """只解析文件头读取宽高，拒绝像素数超限的图片 (解压炸弹)"""
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            actual_format = img.format
+    except Image.DecompressionBombError:
+        raise UploadRejected(413, "图片像素过大")
+    except Exception:
+        raise UploadRejected(415, "无法识别的图片文件")
+    if actual_format != expected_format:
+        raise UploadRejected(415, "图片内容与格式不符")
+    if width * height > UPLOAD_MAX_PIXELS:
+        raise UploadRejected(413, f"图片像素过大 ({width}x{height})，上限 {UPLOAD_MAX_PIXELS // 1_000_000}MP")
+    return width, height
+
+
+async def stream_upload(upload, dest_dir: str, max_bytes: int = UPLOAD_MAX_BYTES) -> IngestedUpload:
+    """
+    分块读取上传文件写入 dest_dir 下的临时文件，同时计算 SHA-256 与大小：
+    首块校验格式魔数，累计超过 max_bytes 立即中止，落盘后只读文件头检查像素数
+    任一检查失败抛出 UploadRejected 并删除临时文件
+    :param upload: FastAPI UploadFile
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dest_dir, suffix=".part")
+    os.close(fd)
+    digest = hashlib.sha256()
+    size = 0
+    fmt = None
+    try:
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                if fmt is None:
+                    fmt = sniff_format(chunk[:16])
+                    if fmt is None:
+                        raise UploadRejected(415, "仅支持 JPEG / PNG / WebP 图片")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(413, f"图片超过 {max_bytes // 1024 // 1024}MB 上限")
+                digest.update(chunk)
+                await out.write(chunk)
+        if size == 0:
+            raise UploadRejected(400, "上传文件为空")
+        width, height = await asyncio.to_thread(_check_dimensions, tmp_path, fmt)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return IngestedUpload(tmp_path, digest.hexdigest(), size, fmt, width, height)
+
+
+def _open(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+
+def has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def open_for_processing(source, max_side=None, mode="RGB"):
+    """
+    解码上传图片并缩放到最长边不超过 max_side
+    - JPEG 使用 draft 模式，由 libjpeg 按 1/2、1/4、1/8 的 DCT 缩放直接解码到接近目标的尺寸，
+      12MP 手机原图不再整幅解码
+    - 按 EXIF Orientation 旋正 (手机竖拍照片像素是横向存储的)
+    - 已是目标模式/尺寸时跳过 convert 与 resize
+    :param source: 字节流、文件路径或文件对象 (含 mmap)
+    :return: 已加载的 PIL.Image
+    """
+    img = _open(source)
+    if max_side and img.format == "JPEG":
+        # draft 以不小于请求尺寸为准选择缩放比例，请求尺寸取等比缩放后的目标尺寸
+        scale = max(img.size) / max_side
+        if scale > 1:
+            img.draft(mode if mode in ("RGB", "L") else None, (int(img.width / scale), int(img.height / scale)))
+
+    orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+    if orientation != 1:
+        img = ImageOps.exif_transpose(img)
+
+    if img.mode != mode:
+        img = img.convert(mode)
+    if max_side and max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    img.load()
+    return img
+
+
+def legacy_decode(source, max_side=SEGMENT_MAX_SIDE):
+    """旧的解码方式 (整幅解码 + LANCZOS 缩放，不处理 EXIF)，仅供基准测试对比"""
+    img = _open(source).convert("RGB")
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    return img
+
+
+def prepare_vision_image(image_bytes: bytes):
+    """
+    把待识别图片转换为视觉模型的输入：缩放到 VISION_MAX_SIDE，透明通道铺到中性底色上，
+    重新编码为不超过 VISION_MAX_BYTES 的 JPEG/WebP (逐级降低质量，仍超限时再缩小尺寸)
+    :return: (编码后的字节流, MIME 类型)
+    """
+    probe = _open(image_bytes)
+    alpha = has_alpha(probe)
+    # 已经是尺寸、体积都达标且无需旋转的 JPEG：原样发送，避免重复有损编码
+    if (
+        not alpha and probe.format == "JPEG" and VISION_IMAGE_FORMAT == "jpeg"
+        and max(probe.size) <= VISION_MAX_SIDE and len(image_bytes) <= VISION_MAX_BYTES
+        and probe.getexif().get(EXIF_ORIENTATION, 1) == 1
+    ):
+        return bytes(image_bytes), "image/jpeg"
+
+    img = open_for_processing(image_bytes, VISION_MAX_SIDE, mode="RGBA" if alpha else "RGB")
+    if alpha:
+        background = Image.new("RGB", img.size, VISION_BACKGROUND)
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+
+    if VISION_IMAGE_FORMAT == "webp":
+        fmt, mime, options = "WEBP", "image/webp", {"method": 4}
+    else:
+        fmt, mime, options = "JPEG", "image/jpeg", {"optimize": True}
+
+    while True:
+        for quality in VISION_QUALITIES:
+            buf = io.BytesIO()
+            img.save(buf, format=fmt, quality=quality, **options)
+            if buf.tell() <= VISION_MAX_BYTES:
+                return buf.getvalue(), mime
+        if max(img.size) * 3 // 4 < VISION_MIN_SIDE:
+            # 已经很小仍超限 (噪点极多的图片)，返回最低质量的结果
+            return buf.getvalue(), mime
+        img = img.resize((img.width * 3 // 4, img.height * 3 // 4), Image.Resampling.LANCZOS)
@@ -1,4 +1,6 @@
 import io
+import mmap
+import time
 import cv2
 import torch
 import numpy as np
@@ -6,12 +8,93 @@ import logging
 import torch.nn as nn
 from PIL import Image
 from transformers import SegformerImageProcessor, AutoModelForSemanticSegmentation
-import colorsys
+from contextlib import contextmanager
+import metrics_service
+from color_harmony import ColorHarmonyAnalyzer
+import image_ingest
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+@contextmanager
+def _stage_timer(timings, name):
+    """累计记录某个处理阶段的耗时 (秒)，timings 为 None 时不计时"""
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + (time.perf_counter() - start)
+
+# 主色提取参数
+DOMINANT_COLOR_K = 3
+DOMINANT_COLOR_MAX_PIXELS = 20000  # 超过则随机采样，控制 k-means 耗时
+ALPHA_THRESHOLD = 128              # 透明度低于该值的像素 (背景/羽化边缘) 不参与统计
+
+def extract_dominant_colors(image_np, k=DOMINANT_COLOR_K, iters=10):
+    """
+    对图像中不透明像素做向量化 k-means (k-means++ 初始化)，返回按占比降序的主色：
+    [{"rgb": [r, g, b], "hsv": [h, s, v], "ratio": 0.62}, ...]
+    image_np 为 HxWx4 (RGBA，按 alpha 过滤) 或 HxWx3 (全部像素)
+    """
+    arr = np.asarray(image_np)
+    if arr.ndim == 3 and arr.shape[2] == 4:
+        pixels = arr[arr[..., 3] >= ALPHA_THRESHOLD][:, :3]
+    else:
+        pixels = arr.reshape(-1, arr.shape[-1])[:, :3]
+    if len(pixels) == 0:
+        return []
+
+    pixels = pixels.astype(np.float32)
+    rng = np.random.default_rng(0)
+    if len(pixels) > DOMINANT_COLOR_MAX_PIXELS:
+        pixels = pixels[rng.choice(len(pixels), DOMINANT_COLOR_MAX_PIXELS, replace=False)]
+
+    # k-means++ 初始化
+    centers = pixels[[rng.integers(len(pixels))]]
+    for _ in range(1, min(k, len(pixels))):
+        d2 = ((pixels[:, None, :] - centers[None]) ** 2).sum(-1).min(axis=1)
+        total = d2.sum()
+        if total == 0:
+            break  # 剩余像素全部与已有中心重合 (纯色)
+        centers = np.vstack([centers, pixels[rng.choice(len(pixels), p=d2 / total)]])
+
+    n_centers = len(centers)
+    for _ in range(iters):
+        labels = ((pixels[:, None, :] - centers[None]) ** 2).sum(-1).argmin(axis=1)
+        counts = np.bincount(labels, minlength=n_centers)
+        sums = np.stack([np.bincount(labels, weights=pixels[:, c], minlength=n_centers) for c in range(3)], axis=1)
+        new_centers = np.where(counts[:, None] > 0, sums / np.maximum(counts[:, None], 1), centers)
+        converged = np.abs(new_centers - centers).max() < 0.5
+        centers = new_centers.astype(np.float32)
+        if converged:
+            break
+
+    labels = ((pixels[:, None, :] - centers[None]) ** 2).sum(-1).argmin(axis=1)
+    counts = np.bincount(labels, minlength=n_centers)
+    colors = []
+    for i in np.argsort(-counts):
+        if counts[i] == 0:
+            continue
+        rgb = [int(round(float(c))) for c in centers[i]]
+        h, s_, v = ColorHarmonyAnalyzer.rgb_to_hsv_standardized(rgb)
+        colors.append({
+            "rgb": rgb,
+            "hsv": [round(h, 1), round(s_, 3), round(v, 3)],
+            "ratio": round(float(counts[i]) / len(pixels), 3),
+        })
+    return colors
+
+def dominant_colors_from_file(path: str):
+    """读取已保存的图片 (分割子图为带透明通道的 PNG) 并提取主色"""
+    with Image.open(path) as img:
+        img = img.convert("RGBA")
+        img.thumbnail((256, 256))
+        return extract_dominant_colors(np.array(img))
+
 class ClothingSegmenter:
     # Segformer B2 Clothes 模型标签映射
     # 0:Background, 1:Hat, 2:Hair, 3:Sunglasses, 4:Upper-clothes, 5:Skirt, 
@@ -37,6 +120,9 @@ class ClothingSegmenter:
             self.model = AutoModelForSemanticSegmentation.from_pretrained(model_name)
             self.model.to(self.device)
             self.model.eval()  # 切换到评估模式
+            # 模型输入尺寸 (width, height)，预处理时一次缩放到位
+            size = self.processor.size
+            self.input_size = (size["width"], size["height"])
             logger.info("模型加载完成")
         except Exception as e:
             logger.error(f"模型加载失败: {e}", exc_info=True)
@@ -148,50 +234,57 @@ class ClothingSegmenter:
             logger.warning(f"RGBA 组合失败: {e}")
             return None
 
-    def segment_and_crop(self, image_bytes: bytes, custom_category_map=None) -> dict:
+    def segment_and_crop(self, image_bytes: bytes, custom_category_map=None, timings=None) -> dict:
         """
         主处理函数
-        :param image_bytes: 图片字节流
+        :param image_bytes: 图片字节流或可读文件对象 (如 mmap)
         :param custom_category_map: 可选的自定义类别映射字典
+        :param timings: 可选字典，传入时按阶段累计耗时(秒)，供基准测试使用
+        :return: {类别: PNG 字节流, "debug_map": PNG 字节流, "colors": {类别: 主色列表}}
         """
         results = {}
+        colors = {}
         try:
             # 1. 读取与预处理
-            img_pil = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-            
-            # 限制最大尺寸以保证推理速度
-            if max(img_pil.size) > 1500:
-                img_pil.thumbnail((1500, 1500), Image.Resampling.LANCZOS)
-            
-            img_np_orig = np.array(img_pil)
+            with _stage_timer(timings, "decode"):
+                # JPEG 直接按 DCT 缩放解码到接近 1500px，并按 EXIF 旋正 (限制最大尺寸以保证推理速度)
+                img_pil = image_ingest.open_for_processing(image_bytes, image_ingest.SEGMENT_MAX_SIDE)
+                img_np_orig = np.array(img_pil)
             
             # 应用 CLAHE 增强
-            img_np_enhanced = self.apply_clahe(img_np_orig)
-            img_pil_enhanced = Image.fromarray(img_np_enhanced)
+            with _stage_timer(timings, "clahe"):
+                img_np_enhanced = self.apply_clahe(img_np_orig)
 
             # 2. 模型推理
-            inputs = self.processor(images=img_pil_enhanced, return_tensors="pt").to(self.device)
-            with torch.no_grad():  # 禁用梯度计算，节省显存
-                outputs = self.model(**inputs)
+            with _stage_timer(timings, "processor"):
+                # 直接在 numpy 上缩放到模型输入尺寸 (INTER_AREA 适合大比例缩小)，
+                # 处理器只做归一化，省去 ndarray -> PIL -> ndarray 的往返与二次缩放
+                model_input = cv2.resize(img_np_enhanced, self.input_size, interpolation=cv2.INTER_AREA)
+                inputs = self.processor(images=model_input, do_resize=False, return_tensors="pt").to(self.device)
+            with _stage_timer(timings, "forward"):
+                with torch.no_grad():  # 禁用梯度计算，节省显存
+                    outputs = self.model(**inputs)
             
             # 插值还原分辨率
-            logits = outputs.logits
-            upsampled_logits = nn.functional.interpolate(
-                logits, 
-                size=img_pil.size[::-1],  # (height, width)
-                mode="bilinear", 
-                align_corners=False
-            )
-            pred_seg = upsampled_logits.argmax(dim=1)[0].cpu().numpy().astype(np.uint8)
+            with _stage_timer(timings, "upsample"):
+                logits = outputs.logits
+                upsampled_logits = nn.functional.interpolate(
+                    logits, 
+                    size=img_pil.size[::-1],  # (height, width)
+                    mode="bilinear", 
+                    align_corners=False
+                )
+                pred_seg = upsampled_logits.argmax(dim=1)[0].cpu().numpy().astype(np.uint8)
 
             logger.info(f"检测到的标签 ID: {np.unique(pred_seg)}")
 
             # 3. 生成调试图
-            debug_map = self.get_segmentation_map(pred_seg, img_pil.width, img_pil.height)
-            debug_pil = Image.fromarray(debug_map)
-            buf_debug = io.BytesIO()
-            debug_pil.save(buf_debug, format="PNG")
-            results["debug_map"] = buf_debug.getvalue()
+            with _stage_timer(timings, "debug_map"):
+                debug_map = self.get_segmentation_map(pred_seg, img_pil.width, img_pil.height)
+                debug_pil = Image.fromarray(debug_map)
+                buf_debug = io.BytesIO()
+                debug_pil.save(buf_debug, format="PNG")
+                results["debug_map"] = buf_debug.getvalue()
 
             # 4. 定义提取规则
             categories = custom_category_map or {
@@ -206,76 +299,31 @@ class ClothingSegmenter:
 
             # 5. 循环提取
             for cat_name, labels in categories.items():
-                rgba_data = self._process_single_category(img_np_orig, pred_seg, labels)
+                with _stage_timer(timings, "masks"):
+                    rgba_data = self._process_single_category(img_np_orig, pred_seg, labels)
                 
                 if rgba_data is not None:
-                    # 转换为 PIL RGBA 图像
-                    final_pil = Image.fromarray(rgba_data, mode="RGBA")
-                    final_pil.thumbnail((800, 800), Image.Resampling.LANCZOS)
-                    
-                    # 保存为 PNG 字节流
-                    buf = io.BytesIO()
-                    final_pil.save(buf, format="PNG", optimize=True)  # 开启优化减小体积
-                    results[cat_name] = buf.getvalue()
+                    with _stage_timer(timings, "png_encode"):
+                        # 转换为 PIL RGBA 图像
+                        final_pil = Image.fromarray(rgba_data, mode="RGBA")
+                        final_pil.thumbnail((800, 800), Image.Resampling.LANCZOS)
+                        
+                        # 保存为 PNG 字节流
+                        buf = io.BytesIO()
+                        final_pil.save(buf, format="PNG", optimize=True)  # 开启优化减小体积
+                        results[cat_name] = buf.getvalue()
+                    # 在缩略后的 RGBA 像素上按透明通道统计主色
+                    with _stage_timer(timings, "colors"):
+                        colors[cat_name] = extract_dominant_colors(np.array(final_pil))
                     logger.info(f"成功提取分类: {cat_name}")
             
+            results["colors"] = colors
             return results
 
         except Exception as e:
             logger.error(f"图像处理严重错误: {e}", exc_info=True)
             return {}
 
-class ColorHarmonyAnalyzer:
-    """色彩分析工具类"""
-    
-    @staticmethod
-    def rgb_to_hsv_standardized(rgb_tuple):
-        """将 RGB (0-255) 转换为标准化 HSV (H:0-360, S:0-1, V:0-1)"""
-        r, g, b = [x/255.0 for x in rgb_tuple]
-        h, s, v = colorsys.rgb_to_hsv(r, g, b)
-        return h * 360, s, v
-
-    @staticmethod
-    def calculate_score(rgb1, rgb2):
-        """
-        计算两个 RGB 颜色的和谐度
-        :param rgb1: tuple (r, g, b)
-        :param rgb2: tuple (r, g, b)
-        :return: score (0-100), description
-        """
-        h1, s1, v1 = ColorHarmonyAnalyzer.rgb_to_hsv_standardized(rgb1)
-        h2, s2, v2 = ColorHarmonyAnalyzer.rgb_to_hsv_standardized(rgb2)
-        
-        # 计算色相环上的最短距离
-        diff_h = abs(h1 - h2)
-        if diff_h > 180:
-            diff_h = 360 - diff_h
-            
-        # 1. 无彩色逻辑 (黑白灰)
-        is_neutral_1 = s1 < 0.15 or v1 < 0.15 or (v1 > 0.9 and s1 < 0.1)
-        is_neutral_2 = s2 < 0.15 or v2 < 0.15 or (v2 > 0.9 and s2 < 0.1)
-        
-        if is_neutral_1 or is_neutral_2:
-            return 85, "百搭基础色"
-            
-        # 2. 同色系 (色相差 < 15)
-        if diff_h < 15:
-            return 90, "同色系高级感"
-            
-        # 3. 邻近色 (15 < 色相差 < 45)
-        if 15 <= diff_h < 45:
-            return 80, "邻近色柔和"
-            
-        # 4. 互补色/撞色 (150 < 色相差 < 210)
-        if 150 < diff_h < 210:
-            return 95, "吸睛撞色"
-        
-        # 5. 对比色 (110 < 色相差 < 150)
-        if 110 < diff_h <= 150:
-            return 75, "对比强烈"
-
-        return 50, "常规搭配"
-
 # 全局初始化实例
 _segmenter_instance = None
 
@@ -290,13 +338,24 @@ def get_segmenter():
     return _segmenter_instance
 
 # 提供给 main.py 调用的顶层函数
-def remove_background_and_crop(image_bytes: bytes):
+def remove_background_and_crop(source):
     """
     main.py 调用的包装函数
+    :param source: 图片字节流，或已落盘的文件路径 (内存映射读取，不再复制一份 bytes)
     """
     try:
         segmenter = get_segmenter()
-        return segmenter.segment_and_crop(image_bytes)
+        timings = {}
+        if isinstance(source, str):
+            with open(source, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                results = segmenter.segment_and_crop(mapped, timings=timings)
+        else:
+            results = segmenter.segment_and_crop(source, timings=timings)
+        for stage, seconds in timings.items():
+            metrics_service.observe_stage(f"segment_{stage}", seconds)
+        if "forward" in timings:
+            metrics_service.observe_inference("segformer", timings["forward"])
+        return results
     except Exception as e:
         logger.error(f"抠图接口调用失败: {e}", exc_info=True)
         return {}
\ No newline at end of file
@@ -0,0 +1,176 @@
+import os
+import json
+import asyncio
+import logging
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+import schemas
+import embedding_index
+import image_derivatives
+import tag_facet_service
+import version_service
+import wardrobe_cache
+from models import ClothingItem
+
+logger = logging.getLogger("SmartWardrobe.ItemImport")
+
+# 单次批量导入的最大条数
+BULK_IMPORT_MAX_ITEMS = int(os.getenv("BULK_IMPORT_MAX_ITEMS", "2000"))
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
+
+class BulkImportError(Exception):
+    """请求整体不合法 (格式错误或超出条数上限)，status_code 对应 HTTP 状态码"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def is_ndjson(content_type: str) -> bool:
+    return (content_type or "").split(";")[0].strip().lower() in NDJSON_CONTENT_TYPES
+
+
+async def iter_ndjson(request):
+    """
+    逐块读取 NDJSON 请求体，每解析出一行产出 (记录, 错误)
+    不把整个请求体读入内存；空行跳过，不计入行号
+    """
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield _parse_line(line)
+    if buffer.strip():
+        yield _parse_line(buffer)
+
+
+def _parse_line(line: bytes):
+    try:
+        return json.loads(line), None
+    except ValueError as e:
+        return None, f"JSON 解析失败: {e}"
+
+
+async def iter_json_array(request):
+    """读取 JSON 数组请求体，逐条产出 (记录, 错误)"""
+    try:
+        data = json.loads(await request.body())
+    except ValueError as e:
+        raise BulkImportError(400, f"请求体不是合法的 JSON: {e}")
+    if not isinstance(data, list):
+        raise BulkImportError(400, "请求体必须是 ItemCreate 数组")
+    for record in data:
+        yield record, None
+
+
+def validate_record(record, user_id: str):
+    """校验单条记录，返回 (ItemCreate 或 None, 错误信息列表)"""
+    if not isinstance(record, dict):
+        return None, ["记录必须是 JSON 对象"]
+    record.setdefault("user_id", user_id)
+    try:
+        item = schemas.ItemCreate(**record)
+    except ValidationError as e:
+        return None, [
+            f"{'.'.join(str(p) for p in err['loc']) or '(root)'}: {err['msg']}" for err in e.errors()
+        ]
+    if item.user_id != user_id:
+        return None, [f"user_id 与请求参数不一致: {item.user_id}"]
+    return item, []
+
+
+def _attach_variants(rows):
+    """为每行生成派生图 (同一图片只生成一次)，与单条新增一样在写入时就带上 image_variants"""
+    generated = {}
+    for row in rows:
+        image_url = row.get("image_url")
+        if image_url not in generated:
+            generated[image_url] = image_derivatives.generate_derivatives(image_url)
+        row["image_variants"] = generated[image_url]
+
+
+def _insert_statement():
+    # sort_by_parameter_order 保证返回的 id 与参数顺序一致
+    return insert(ClothingItem).returning(ClothingItem.id, sort_by_parameter_order=True)
+
+
+async def insert_items(db, user_id: str, valid):
+    """
+    在一个事务中写入校验通过的衣物 [(行号, ItemCreate), ...]
+    正常情况下一次 executemany 写完；若数据库拒绝了其中某行，回滚后改为逐行 SAVEPOINT 写入，
+    只跳过出错的行。返回 ({行号: 衣物 id}, [(行号, 错误信息)])
+    """
+    if not valid:
+        return {}, []
+
+    rows = [item.dict() for _, item in valid]
+    # 解码/缩放图片是阻塞操作，放到线程中执行
+    await asyncio.to_thread(_attach_variants, rows)
+    ids, errors = {}, []
+    try:
+        await version_service.bump_version_async(db, user_id)
+        result = await db.execute(_insert_statement(), rows)
+        ids = dict(zip((index for index, _ in valid), result.scalars().all()))
+    except SQLAlchemyError as e:
+        await db.rollback()
+        logger.warning(f"批量写入失败，改为逐行写入定位错误行: {e}")
+        # 先执行一条写语句开启事务，后续 SAVEPOINT 嵌套在同一事务内
+        await version_service.bump_version_async(db, user_id)
+        for (index, _), row in zip(valid, rows):
+            try:
+                async with db.begin_nested():
+                    result = await db.execute(_insert_statement(), [row])
+                    ids[index] = result.scalar_one()
+            except SQLAlchemyError as row_error:
+                errors.append((index, f"写入数据库失败: {row_error.__class__.__name__}"))
+
+    inserted = [item for index, item in valid if index in ids]
+    await tag_facet_service.add_items_tags_async(
+        db, user_id, (tag_facet_service.item_tags(item.styles, item.occasions) for item in inserted)
+    )
+    await db.commit()
+    wardrobe_cache.invalidate(user_id)
+    embedding_index.invalidate(user_id)
+    return ids, errors
+
+
+async def import_items(db, user_id: str, records):
+    """
+    批量导入主流程：逐条校验 records (异步迭代的 (记录, 解析错误))，
+    合法的行统一写入，返回 BulkImportResult 所需的字典
+    """
+    valid, errors = [], []
+    received = 0
+    async for record, parse_error in records:
+        index = received
+        received += 1
+        if received > BULK_IMPORT_MAX_ITEMS:
+            raise BulkImportError(413, f"单次最多导入 {BULK_IMPORT_MAX_ITEMS} 条")
+        if parse_error:
+            errors.append({"index": index, "errors": [parse_error]})
+            continue
+        item, item_errors = validate_record(record, user_id)
+        if item_errors:
+            errors.append({"index": index, "errors": item_errors})
+        else:
+            valid.append((index, item))
+
+    ids, db_errors = await insert_items(db, user_id, valid)
+    errors.extend({"index": index, "errors": [msg]} for index, msg in db_errors)
+    errors.sort(key=lambda e: e["index"])
+
+    logger.info(f"用户 {user_id} 批量导入: 收到 {received} 条, 成功 {len(ids)} 条, 失败 {len(errors)} 条")
+    return {
+        "received": received,
+        "inserted": len(ids),
+        "failed": len(errors),
+        "ids": [ids[index] for index in sorted(ids)],
+        "errors": errors,
+    }
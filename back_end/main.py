@@ -1,28 +1,45 @@
 import models, schemas, database, ai_service
 import image_processing_service
 import os
+import hmac
 import json
 import asyncio
 import logging
 import image_gen_service 
+import metrics_service
+import profiling_service
+import version_service
+import tag_facet_service
+import item_import_service
+import password_service
+import wardrobe_cache
+import batch_recommend_service
+import recommend_session_cache
+import embedding_index
+import image_derivatives
+import image_ingest
+import upload_gc_service
+from embedding_batcher import clip_batcher
 import aiofiles
-import httpx
+import upstream
 from uuid import uuid4
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query, Body
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query, Body, Header, Response, Request
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from fastapi.staticfiles import StaticFiles
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, FileResponse
+from anyio import to_thread
 from pydantic import BaseModel
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import timedelta
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 from dotenv import load_dotenv
-from weather_service import get_weather_info
-from recommendation_service import ProfessionalRecommender 
+from weather_service import get_weather_info, build_day_context
+from recommendation_service import ProfessionalRecommender, format_outfit_item 
 
 app = FastAPI(title="智能穿搭推荐系统")
 
@@ -38,16 +55,13 @@ SECRET_KEY = "YOUR_SECRET_KEY_KEEP_IT_SAFE"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 3000 # Token过期时间
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-# --- 辅助函数 ---
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
+# 运维管理接口 (批量推荐、上传回收) 的令牌，与请求剖析的 PROFILING_ADMIN_TOKEN 相互独立；未设置时这些接口关闭
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
+# --- 辅助函数 ---
+# bcrypt 哈希/校验在 password_service 的专用进程池中执行，不占用同步接口线程池
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -58,44 +72,95 @@ def create_access_token(data: dict):
 # --- 认证接口 ---
 
 @app.post("/register", response_model=schemas.Token)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(database.get_async_db)):
     # 1. 检查是否存在
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+    db_user = (await db.execute(
+        select(models.User).where(models.User.username == user.username)
+    )).scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="用户名已存在")
     
     # 2. 创建用户
-    hashed_password = get_password_hash(user.password)
+    try:
+        hashed_password = await password_service.hash_password(user.password)
+    except password_service.PasswordServiceBusy:
+        raise HTTPException(status_code=503, detail="服务繁忙，请稍后再试")
     db_user = models.User(username=user.username, hashed_password=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     
     # 3. 自动登录返回Token
     access_token = create_access_token(data={"sub": db_user.username, "uid": str(db_user.id)})
     return {"access_token": access_token, "token_type": "bearer", "user_id": str(db_user.id), "username": db_user.username}
 
 @app.post("/token", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    # 1. 查用户
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
-        raise HTTPException(status_code=401, detail="用户名或密码错误")
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_async_db)):
+    try:
+        async with password_service.login_slot(form_data.username):
+            # 1. 查用户
+            user = (await db.execute(
+                select(models.User).where(models.User.username == form_data.username)
+            )).scalars().first()
+            if not user:
+                raise HTTPException(status_code=401, detail="用户名或密码错误")
+            verified, new_hash = await password_service.verify_and_update(form_data.password, user.hashed_password)
+            if not verified:
+                raise HTTPException(status_code=401, detail="用户名或密码错误")
+
+            # 2. 成本因子调整后透明地重算哈希
+            if new_hash:
+                user.hashed_password = new_hash
+                await db.commit()
+    except password_service.LoginThrottled:
+        raise HTTPException(status_code=429, detail="登录请求过于频繁，请稍后再试")
+    except password_service.PasswordServiceBusy:
+        raise HTTPException(status_code=503, detail="服务繁忙，请稍后再试")
     
-    # 2. 发Token
+    # 3. 发Token
     access_token = create_access_token(data={"sub": user.username, "uid": str(user.id)})
     return {"access_token": access_token, "token_type": "bearer", "user_id": str(user.id), "username": user.username}
 
+# --- 条件请求 (ETag) 辅助函数 ---
+# 浏览器每次使用前都携带 If-None-Match 重新验证，未变化时返回 304 而不重新查询/序列化
+CONDITIONAL_CACHE_CONTROL = "private, no-cache"
+
+def _check_not_modified(db, user_id, resource, variant, if_none_match, response):
+    """
+    计算当前 ETag；若与 If-None-Match 一致返回 304 响应，否则把 ETag 写入 response 并返回 None
+    只读取版本号表，不访问衣物表
+    """
+    version = version_service.get_version(db, user_id)
+    etag = version_service.make_etag(user_id, version, resource, variant)
+    headers = {"ETag": etag, "Cache-Control": CONDITIONAL_CACHE_CONTROL}
+    if version_service.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 # --- 用户资料(Profile)接口 ---
 @app.get("/user/profile", response_model=schemas.UserProfileResponse)
-def get_user_profile(user_id: str, db: Session = Depends(get_db)):
+def get_user_profile(
+    user_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    not_modified = _check_not_modified(db, user_id, "profile", "", if_none_match, response)
+    if not_modified:
+        return not_modified
+
     profile = db.query(models.UserProfile).filter(models.UserProfile.user_id == user_id).first()
     if not profile:
         # 如果不存在，创建一个默认的
         profile = models.UserProfile(user_id=user_id)
         db.add(profile)
+        version_service.bump_version(db, user_id)
         db.commit()
+        wardrobe_cache.invalidate(user_id)
         db.refresh(profile)
+        # 版本已变化，重新计算 ETag
+        _check_not_modified(db, user_id, "profile", "", None, response)
     return profile
 
 @app.put("/user/profile", response_model=schemas.UserProfileResponse)
@@ -110,7 +175,9 @@ def update_user_profile(profile: schemas.UserProfileCreate, user_id: str = Query
     for key, value in update_data.items():
         setattr(db_profile, key, value)
     
+    version_service.bump_version(db, user_id)
     db.commit()
+    wardrobe_cache.invalidate(user_id)
     db.refresh(db_profile)
     return db_profile
 
@@ -119,25 +186,38 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("SmartWardrobe")
 
-# 初始化数据库表
+# 初始化数据库表，并为已有数据库补建新增索引
 models.Base.metadata.create_all(bind=database.engine)
+database.run_migrations()
+with database.SessionLocal() as _db:
+    tag_facet_service.backfill_if_empty(_db)
 
 # 1. 配置跨域与静态文件
+# 上传大小限制：在解析 multipart 之前按 Content-Length 拒绝超大文件
+# 必须在 CORSMiddleware 之前注册 (后注册的在外层)，提前返回的 413 才会带上 CORS 响应头，前端能读到错误信息
+app.add_middleware(image_ingest.UploadSizeLimitMiddleware, paths=["/segment"])
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+# 请求剖析中间件：仅在配置了 PROFILING_ADMIN_TOKEN 时注册，关闭时没有任何额外开销
+if profiling_service.PROFILING_ENABLED:
+    app.middleware("http")(profiling_service.profile_middleware)
+
 # 确保上传目录存在
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 # 挂载静态目录，使前端可以通过 URL 访问生成的图片
 # 例如: http://localhost:8000/uploads/user123/xxx.png
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# 派生图 (uploads/derived/...) 文件名按内容哈希命名，返回 immutable 长缓存头
+app.mount("/uploads", image_derivatives.UploadStaticFiles(directory="uploads"), name="uploads")
 
 # 辅助函数：将英文标签转换为中文
 def _get_cn_label(category_en):
@@ -157,7 +237,9 @@ def _get_cn_label(category_en):
 # 核心流程 Step 1: 图片上传与分割
 # ==========================================
 @app.post("/segment", summary="步骤1：上传图片并进行分割，返回候选图列表")
+@metrics_service.timed("segment_total")
 async def segment_image(
+    request: Request,
     file: UploadFile = File(...),
     user_id: str = Query(..., description="用户ID")
 ):
@@ -168,24 +250,33 @@ async def segment_image(
     user_dir = os.path.join(UPLOAD_DIR, user_id)
     os.makedirs(user_dir, exist_ok=True)
     
-    # 1. 读取并保存原始大图
-    content = await file.read()
+    # 超出磁盘配额时拒绝 (按请求体大小预估；未被衣物引用的旧文件会在回收后释放配额)
+    try:
+        upload_gc_service.check_quota(user_id, int(request.headers.get("content-length") or 0))
+    except upload_gc_service.QuotaExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    # 1. 流式保存原始大图：分块写盘并计算哈希，超限/格式不符/像素过大时提前拒绝，不在内存中保留整张图
+    try:
+        upload = await image_ingest.stream_upload(file, user_dir)
+    except image_ingest.UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     
-    # 生成带时间戳的文件名，防止覆盖
+    # 生成带时间戳与内容哈希的文件名，防止覆盖
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename_no_ext = os.path.splitext(file.filename)[0]
-    base_name = f"{filename_no_ext}_{timestamp}"
+    filename_no_ext = os.path.splitext(os.path.basename(file.filename or "upload"))[0]
+    base_name = f"{filename_no_ext}_{timestamp}_{upload.sha256[:8]}"
     
     # 注意：路径使用 "/" 统一分隔符，避免 Windows/Linux 路径问题
-    original_path = os.path.join(user_dir, f"{base_name}_original.jpg").replace("\\", "/")
-    
-    with open(original_path, "wb") as f:
-        f.write(content)
+    original_path = os.path.join(user_dir, f"{base_name}_original.{upload.extension}").replace("\\", "/")
+    os.replace(upload.path, original_path)
     
     # 2. 调用分割服务 (只做切割，不调用 AI)
     try:
-        # 使用 run_in_threadpool 避免阻塞主线程
-        seg_results = await run_in_threadpool(image_processing_service.remove_background_and_crop, content)
+        # 使用 run_in_threadpool 避免阻塞主线程；分割器以内存映射方式读取已落盘的原图
+        seg_results = await run_in_threadpool(
+            profiling_service.wrap_thread_call(image_processing_service.remove_background_and_crop), original_path
+        )
     except Exception as e:
         logger.error(f"Segmentation failed: {e}")
         return {"error": "图像分割失败，请重试"}
@@ -194,9 +285,10 @@ async def segment_image(
     
     # 3. 处理分割结果
     if seg_results:
+        part_colors = seg_results.get("colors", {})
         for category, img_bytes in seg_results.items():
-            if category == "debug_map": 
-                continue # 调试图不返回给用户
+            if category in ("debug_map", "colors"): 
+                continue # 调试图与主色数据不作为子图返回
             
             # 保存子图
             part_filename = f"{base_name}_{category}.png"
@@ -204,12 +296,18 @@ async def segment_image(
             
             with open(part_path, "wb") as f:
                 f.write(img_bytes)
+
+            # 主色写入同名旁路文件，供 /analyze-selected 读取
+            colors = part_colors.get(category, [])
+            with open(_colors_sidecar_path(part_path), "w", encoding="utf-8") as f:
+                json.dump(colors, f)
             
             # 构建返回列表
             saved_parts.append({
                 "category_key": category,      # 英文key，用于逻辑判断
                 "label": _get_cn_label(category), # 中文标签，用于前端展示
-                "image_path": part_path        # 图片路径，前端用于 src 展示和下一步回传
+                "image_path": part_path,       # 图片路径，前端用于 src 展示和下一步回传
+                "colors": colors               # 主色 (按占比降序)
             })
     
     # 4. 兜底逻辑：如果没有切出任何东西（或者只保留了原图），把原图也作为选项返回
@@ -227,6 +325,13 @@ async def segment_image(
             "image_path": original_path
         })
 
+    # 5. 生成缩略图/中图 (候选列表直接用缩略图展示，入库时按内容哈希复用)
+    variants = await run_in_threadpool(
+        lambda: [image_derivatives.generate_derivatives(part["image_path"]) for part in saved_parts]
+    )
+    for part, part_variants in zip(saved_parts, variants):
+        part["variants"] = part_variants
+
     return {
         "status": "success",
         "user_id": user_id,
@@ -237,11 +342,23 @@ async def segment_image(
 # ==========================================
 # 核心流程 Step 2: 对选中的图片进行 AI 识别
 # ==========================================
+def _colors_sidecar_path(image_path):
+    return f"{image_path}.colors.json"
+
+def _load_dominant_colors(image_path):
+    """优先读取分割时保存的主色；原图或旧文件没有旁路文件时现场计算"""
+    try:
+        with open(_colors_sidecar_path(image_path), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return image_processing_service.dominant_colors_from_file(image_path)
+
 class AnalyzeRequest(BaseModel):
     image_path: str =  Query(..., description="从/segment接口返回的image_path")
     user_id: str
 
 @app.post("/analyze-selected", summary="步骤2：对选中的具体子图进行AI属性识别")
+@metrics_service.timed("analyze_total")
 async def analyze_selected_item(req: AnalyzeRequest):
     """
     接收用户选中的某一张图片路径，调用：
@@ -264,14 +381,17 @@ async def analyze_selected_item(req: AnalyzeRequest):
 
     # 3. 并行执行 AI 任务
     try:
-        # Task A: 提取向量 (CPU/GPU 密集型)
-        vector_task = run_in_threadpool(ai_service.get_image_embedding, req.image_path)
+        # Task A: 提取向量 (CPU/GPU 密集型，经微批调度器与并发请求合并计算)
+        vector_task = clip_batcher.submit(req.image_path)
         
         # Task B: LLM 属性分析 (IO 密集型)
         ai_task = ai_service.analyze_clothing_image(image_bytes)
+
+        # Task C: 本地主色 (一般直接读取分割时的结果)
+        colors_task = run_in_threadpool(_load_dominant_colors, req.image_path)
         
-        # 等待两者完成
-        ai_result, vector_result = await asyncio.gather(ai_task, vector_task)
+        # 等待全部完成
+        ai_result, vector_result, colors = await asyncio.gather(ai_task, vector_task, colors_task)
     except Exception as e:
         logger.error(f"AI Processing Error: {e}")
         raise HTTPException(status_code=500, detail=f"AI分析服务异常: {str(e)}")
@@ -280,6 +400,12 @@ async def analyze_selected_item(req: AnalyzeRequest):
     if "error" in ai_result:
         raise HTTPException(status_code=500, detail=ai_result["error"])
 
+    # 主色并入属性，前端保存时随其他属性一起回传给 /items/
+    if colors:
+        ai_result["dominant_colors"] = colors
+        ai_result["color_rgb"] = colors[0]["rgb"]
+        ai_result["color_hsv"] = colors[0]["hsv"]
+
     return {
         "status": "success",
         "user_id": req.user_id,
@@ -291,29 +417,143 @@ async def analyze_selected_item(req: AnalyzeRequest):
 # ==========================================
 # 核心流程 Step 3: 数据入库 (CRUD)
 # ==========================================
-@app.post("/items/", response_model=schemas.ItemResponse, summary="步骤3：确认属性并保存到衣柜")
+@app.post("/items/", response_model=schemas.ItemCreateResponse, summary="步骤3：确认属性并保存到衣柜")
 def create_item(item: schemas.ItemCreate, db: Session = Depends(get_db)):
     """
     将 AI 识别后的数据（经用户确认或修改后）存入数据库
+    若衣橱中已有视觉向量几乎相同的衣物，在 duplicates 中返回提醒 (仍正常保存)
     """
+    duplicates = embedding_index.find_duplicates(db, item.user_id, item.embedding_vector)
+
     db_item = models.ClothingItem(
         **item.dict()
     )
+    # 分割时已生成的派生图按内容哈希直接复用，只有外部图片才会在这里现场生成
+    db_item.image_variants = image_derivatives.generate_derivatives(item.image_url)
     db.add(db_item)
+    tag_facet_service.apply_tag_changes(
+        db, item.user_id, new_tags=tag_facet_service.item_tags(item.styles, item.occasions)
+    )
+    version_service.bump_version(db, item.user_id)
     db.commit()
+    wardrobe_cache.invalidate(item.user_id)
     db.refresh(db_item)
-    return db_item
+    embedding_index.upsert(item.user_id, db_item.id, db_item.embedding_vector)
 
-@app.get("/items/", response_model=List[schemas.ItemResponse])
-def read_items(user_id: str, db: Session = Depends(get_db)):
-    return db.query(models.ClothingItem).filter(models.ClothingItem.user_id == user_id).all()
+    response = schemas.ItemCreateResponse.model_validate(db_item)
+    response.duplicates = [schemas.DuplicateCandidate(id=i, similarity=round(sim, 4)) for i, sim in duplicates]
+    if duplicates:
+        logger.info(f"用户{item.user_id}新增衣物 {db_item.id} 疑似重复: {duplicates}")
+    return response
+
+@app.post("/items/bulk", response_model=schemas.BulkImportResult, summary="批量导入衣物 (JSON 数组或 NDJSON)")
+@metrics_service.timed("items_bulk_total")
+async def bulk_import_items(
+    request: Request,
+    user_id: str = Query(..., description="导入到该用户的衣橱，记录中的 user_id 可省略"),
+    db: AsyncSession = Depends(database.get_async_db),
+):
+    """
+    请求体为 ItemCreate 数组 (application/json)，或每行一条记录的 NDJSON 流 (application/x-ndjson)
+    逐条校验，合法的记录在一个事务中批量写入；不合法的行在 errors 中返回行号与原因，不影响其他行
+    """
+    if item_import_service.is_ndjson(request.headers.get("content-type")):
+        records = item_import_service.iter_ndjson(request)
+    else:
+        records = item_import_service.iter_json_array(request)
+    try:
+        return await item_import_service.import_items(db, user_id, records)
+    except item_import_service.BulkImportError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+# 列表接口可返回的字段：full 为全部列，summary 去掉体积最大的 embedding_vector (~10KB/件)
+ITEM_FULL_FIELDS = [c.name for c in models.ClothingItem.__table__.columns]
+ITEM_SUMMARY_FIELDS = [name for name in ITEM_FULL_FIELDS if name != "embedding_vector"]
+
+@app.get(
+    "/items/",
+    summary="获取衣橱列表 (支持游标分页与字段投影)",
+    responses={200: {"model": List[schemas.ItemSummary]}},
+)
+def read_items(
+    request: Request,
+    response: Response,
+    user_id: str,
+    view: str = Query("summary", pattern="^(summary|full)$", description="summary 不含向量；full 返回全部字段"),
+    fields: Optional[str] = Query(None, description="逗号分隔的字段列表，指定后覆盖 view"),
+    limit: Optional[int] = Query(None, ge=1, le=1000, description="每页条数，不传则返回全部"),
+    cursor: Optional[int] = Query(None, description="上一页响应头 X-Next-Cursor 的值"),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    # 0. 条件请求：衣橱未变化时直接返回 304 (不同分页/投影参数对应不同 ETag)
+    variant = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.items()))
+    not_modified = _check_not_modified(db, user_id, "items", variant, if_none_match, response)
+    if not_modified:
+        return not_modified
+
+    # 1. 确定需要查询的列 (只 SELECT 需要的列，id 始终返回用于分页)
+    if fields:
+        names = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in names if f not in ITEM_FULL_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"未知字段: {', '.join(unknown)}")
+        if "id" not in names:
+            names.insert(0, "id")
+    else:
+        names = ITEM_FULL_FIELDS if view == "full" else ITEM_SUMMARY_FIELDS
+    columns = [getattr(models.ClothingItem, name) for name in names]
+
+    # 2. 按 id 游标分页
+    query = db.query(*columns).filter(models.ClothingItem.user_id == user_id)
+    if cursor is not None:
+        query = query.filter(models.ClothingItem.id > cursor)
+    query = query.order_by(models.ClothingItem.id)
+    if limit is not None:
+        query = query.limit(limit + 1)  # 多取一条用于判断是否还有下一页
+    rows = query.all()
+
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+
+    return [dict(row._mapping) for row in rows]
+
+@app.get("/items/{item_id}/similar", response_model=List[schemas.SimilarItem], summary="查找衣橱中视觉相似的衣物")
+def find_similar_items(
+    item_id: int,
+    user_id: str,
+    k: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    index = embedding_index.get_index(db, user_id)
+    vector = index.vector_of(item_id)
+    if vector is None:
+        raise HTTPException(status_code=404, detail="衣物不存在或没有视觉向量")
+
+    matches = index.search(vector, k=k, exclude_id=item_id)
+    if not matches:
+        return []
+    columns = [getattr(models.ClothingItem, name) for name in ITEM_SUMMARY_FIELDS]
+    rows = db.query(*columns).filter(
+        models.ClothingItem.user_id == user_id,
+        models.ClothingItem.id.in_([i for i, _ in matches]),
+    ).all()
+    by_id = {row.id: dict(row._mapping) for row in rows}
+    return [{**by_id[i], "similarity": round(sim, 4)} for i, sim in matches if i in by_id]
 
 @app.delete("/items/{item_id}")
 def delete_item(item_id: int, user_id: str, db: Session = Depends(get_db)):
     item = db.query(models.ClothingItem).filter(models.ClothingItem.id == item_id, models.ClothingItem.user_id == user_id).first()
     if item:
         db.delete(item)
+        tag_facet_service.apply_tag_changes(
+            db, user_id, old_tags=tag_facet_service.item_tags(item.styles, item.occasions)
+        )
+        version_service.bump_version(db, user_id)
         db.commit()
+        wardrobe_cache.invalidate(user_id)
+        embedding_index.remove(user_id, item_id)
     return {"message": "deleted"}
 
 @app.put("/items/{item_id}", response_model=schemas.ItemResponse, summary="更新衣物属性")
@@ -334,17 +574,28 @@ def update_item(
     
     # 2. 更新字段 (排除 id 和 user_id 防止篡改)
     update_data = item.dict(exclude_unset=True)
+    old_tags = tag_facet_service.item_tags(db_item.styles, db_item.occasions)
     
     # 手动映射字段
+    old_image_url = db_item.image_url
     for key, value in update_data.items():
         # 跳过不允许修改的元数据
         if key not in ["id", "user_id", "created_at"]:
             setattr(db_item, key, value)
+    if db_item.image_url != old_image_url:
+        db_item.image_variants = image_derivatives.generate_derivatives(db_item.image_url)
     
     # 3. 提交事务
     try:
+        tag_facet_service.apply_tag_changes(
+            db, user_id, old_tags=old_tags,
+            new_tags=tag_facet_service.item_tags(db_item.styles, db_item.occasions),
+        )
+        version_service.bump_version(db, user_id)
         db.commit()
+        wardrobe_cache.invalidate(user_id)
         db.refresh(db_item)
+        embedding_index.upsert(user_id, db_item.id, db_item.embedding_vector)
     except Exception as e:
         db.rollback()
         logger.error(f"Update failed: {e}")
@@ -370,6 +621,104 @@ async def get_weather(location_input: str = Query(..., description="城市名称
     
     return weather_ctx
 
+@app.get("/system/embedding-batcher", summary="CLIP 微批调度器统计 (批大小/填充率)")
+async def get_embedding_batcher_stats():
+    return clip_batcher.stats()
+
+# ==========================================
+# 监控指标 (Prometheus 文本格式)
+# ==========================================
+def _collect_threadpool_stats():
+    # run_in_threadpool 使用 anyio 默认线程池，需在事件循环内读取
+    stats = to_thread.current_default_thread_limiter().statistics()
+    return [
+        ({"state": "busy"}, stats.borrowed_tokens),
+        ({"state": "capacity"}, stats.total_tokens),
+        ({"state": "waiting"}, stats.tasks_waiting),
+    ]
+
+def _collect_batcher_stats():
+    stats = clip_batcher.stats()
+    return [({"stat": key}, stats[key]) for key in ("fill_rate", "avg_batch_size", "queue_depth", "batches_total")]
+
+def _collect_wardrobe_cache_stats():
+    return [({"stat": key}, value) for key, value in wardrobe_cache.stats().items()]
+
+def _collect_password_pool_stats():
+    return [({"stat": key}, value) for key, value in password_service.stats().items()]
+
+def _collect_upload_gc_stats():
+    return [({"stat": key}, value) for key, value in upload_gc_service.stats().items()]
+
+def _collect_upstream_stats():
+    return [
+        ({"upstream": name, "stat": key}, value)
+        for name, stats in upstream.stats().items()
+        for key, value in stats.items()
+    ]
+
+metrics_service.register_gauge("smartwardrobe_threadpool", "同步接口线程池占用与排队深度", _collect_threadpool_stats)
+metrics_service.register_gauge("smartwardrobe_clip_batcher", "CLIP 微批调度器统计", _collect_batcher_stats)
+metrics_service.register_gauge("smartwardrobe_wardrobe_cache", "推荐快照缓存占用 (用户数/衣物件数)", _collect_wardrobe_cache_stats)
+metrics_service.register_gauge("smartwardrobe_password_pool", "密码哈希进程池排队深度", _collect_password_pool_stats)
+metrics_service.register_gauge("smartwardrobe_upload_gc", "最近一次上传文件回收统计 (回收字节数/用户占用)", _collect_upload_gc_stats)
+metrics_service.register_gauge("smartwardrobe_upstream_resilience", "外部 API 熔断状态 (0=closed,1=half_open,2=open) 与对冲请求统计", _collect_upstream_stats)
+
+@app.on_event("shutdown")
+def shutdown_password_pool():
+    password_service.shutdown()
+
+# 后台定期回收孤儿上传文件 (UPLOAD_GC_INTERVAL_SECONDS=0 时不启动)
+_upload_gc_task = None
+
+@app.on_event("startup")
+async def start_upload_gc():
+    global _upload_gc_task
+    if upload_gc_service.UPLOAD_GC_INTERVAL_SECONDS > 0:
+        _upload_gc_task = asyncio.create_task(upload_gc_service.run_forever())
+
+@app.on_event("shutdown")
+async def stop_upload_gc():
+    if _upload_gc_task is not None:
+        _upload_gc_task.cancel()
+
+@app.get("/metrics", response_class=PlainTextResponse, summary="Prometheus 监控指标")
+async def get_metrics():
+    return metrics_service.render_metrics()
+
+# ==========================================
+# 管理接口：请求剖析结果下载
+# ==========================================
+def _require_admin(x_admin_token: str = Header(default="")):
+    if not profiling_service.is_admin(x_admin_token):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+def _require_ops_admin(x_admin_token: str = Header(default="")):
+    """运维接口鉴权：使用独立的 ADMIN_TOKEN，不依赖请求剖析是否开启"""
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.post("/admin/uploads/gc", summary="立即回收未被衣物引用的上传文件，返回回收字节数与各用户占用",
+          dependencies=[Depends(_require_ops_admin)])
+async def collect_orphan_uploads(
+    dry_run: bool = Query(False, description="只统计不删除"),
+    grace_hours: Optional[float] = Query(None, ge=0, description="覆盖默认宽限期 (小时)"),
+):
+    return await upload_gc_service.run_collect(grace_hours=grace_hours, dry_run=dry_run)
+
+@app.get("/admin/profiles", summary="列出已保存的请求剖析", dependencies=[Depends(_require_admin)])
+def list_request_profiles():
+    return profiling_service.list_profiles()
+
+@app.get("/admin/profiles/{profile_id}", summary="下载请求剖析 (format=json 报告 / prof 原始 cProfile 数据)",
+         dependencies=[Depends(_require_admin)])
+def download_request_profile(profile_id: str, format: str = Query("json", pattern="^(json|prof)$")):
+    path = profiling_service.get_profile_path(profile_id, format)
+    if not path:
+        raise HTTPException(status_code=404, detail="剖析记录不存在")
+    media_type = "application/json" if format == "json" else "application/octet-stream"
+    return FileResponse(path, media_type=media_type, filename=os.path.basename(path))
+
 VIRTUAL_DIR = os.path.join(UPLOAD_DIR, "virtual")
 os.makedirs(VIRTUAL_DIR, exist_ok=True)
 
@@ -391,18 +740,20 @@ class VirtualItemRequest(BaseModel):
 # 推荐与反馈接口
 # ==========================================
 @app.post("/recommend/outfit", summary="根据天气获取推荐搭配")
-async def recommend_outfit(req: schemas.RecommendationRequest, db: Session = Depends(get_db)):
+@metrics_service.timed("recommend_total")
+async def recommend_outfit(req: schemas.RecommendationRequest, db: AsyncSession = Depends(database.get_async_db)):
     # 1. 获取天气
-    weather_ctx = await get_weather_info(req.location)
+    with metrics_service.stage_timer("recommend_weather"):
+        weather_ctx = await get_weather_info(req.location)
     if "error" in weather_ctx:
         raise HTTPException(status_code=500, detail=weather_ctx["error"])
 
     # 2. 初始化推荐引擎
-    recommender = ProfessionalRecommender(db, req.user_id, weather_ctx, req)
+    recommender = await ProfessionalRecommender.create(db, req.user_id, weather_ctx, req)
 
-    # 3. 计算推荐
+    # 3. 计算推荐 (一次算出多套互有差异的搭配，后续“换一套”直接从会话缓存读取)
     try:
-        result = await recommender.recommend()
+        result = await recommender.recommend_ranked()
     except Exception as e:
         logger.error(f"Recommendation logic error: {e}", exc_info=True)
         return {"status": "failed", "message": "推荐计算过程中发生错误，请稍后再试"}
@@ -415,7 +766,8 @@ async def recommend_outfit(req: schemas.RecommendationRequest, db: Session = Dep
             "weather_summary": weather_ctx.get("summary_text", "未知")
         }
 
-    outfit_data = result.get("outfit_items", {}) # 获取内层字典
+    ranked_outfits = result["outfits"]
+    outfit_data = ranked_outfits[0]["outfit_items"] # 综合得分最高的一套
     
     # 核心单品校验（保留上衣下装的基础校验）
     if not outfit_data.get("top") or not outfit_data.get("bottom"):
@@ -442,11 +794,12 @@ async def recommend_outfit(req: schemas.RecommendationRequest, db: Session = Dep
     generated_image_url = None
     try:
         # 这里的 outfit_items_obj 已经是正确的结构了
-        generated_image_url = await image_gen_service.generate_outfit_image(
-            outfit_items_obj, 
-            user_profile, 
-            weather_ctx
-        )
+        with metrics_service.stage_timer("recommend_tryon_image"):
+            generated_image_url = await image_gen_service.generate_outfit_image(
+                outfit_items_obj, 
+                user_profile, 
+                weather_ctx
+            )
         logger.info(f"成功生成穿搭效果图: {generated_image_url}")
     except Exception as e:
         logger.error(f"生成穿搭效果图失败: {e}", exc_info=True)
@@ -466,35 +819,158 @@ async def recommend_outfit(req: schemas.RecommendationRequest, db: Session = Dep
     # 优先使用 recommendation_service 生成的 reasoning (因为它包含了画像逻辑)
     ai_reasoning = result.get("reasoning", "")
     
-    comment = await ai_service.generate_outfit_comment(weather_desc, outfit_desc + f". 推荐逻辑: {ai_reasoning}")
+    with metrics_service.stage_timer("recommend_comment"):
+        comment = await ai_service.generate_outfit_comment(weather_desc, outfit_desc + f". 推荐逻辑: {ai_reasoning}")
     if isinstance(comment, dict) and "error" in comment:
         comment = f"这套搭配很适合今天！({ai_reasoning})"
 
     # 5. 格式化输出
     formatted_outfit = {}
 
-    def format_item(item):
-        if not item: return None
-        return {
-            "id": item.id,
-            "name": f"{item.main_color}{item.category_sub}",
-            "image_url": item.image_url,
-            "warmth": item.warmth_level,
-            "type": item.category_main,
-            "gender": item.gender # ✅ 确保返回 gender
-        }
-
     # 动态遍历所有单品类型，不再硬编码
     for key, item in outfit_data.items():
-        formatted_outfit[key] = format_item(item)
+        formatted_outfit[key] = format_outfit_item(item)
+
+    # 6. 其余备选搭配存入会话，/recommend/next 按顺序翻页
+    weather_summary = f"{weather_desc}, {weather_ctx.get('summary_text', '')}"
+    session_id = recommend_session_cache.create_session(
+        req.user_id,
+        [
+            {
+                "outfit": {key: format_outfit_item(item) for key, item in ranked["outfit_items"].items()},
+                "score": ranked["score"],
+            }
+            for ranked in ranked_outfits
+        ],
+        {"weather_summary": weather_summary, "reasoning": ai_reasoning},
+    )
 
     return {
         "status": "success",
-        "weather_summary": f"{weather_desc}, {weather_ctx.get('summary_text', '')}",
+        "weather_summary": weather_summary,
         "outfit": formatted_outfit, # 现在包含所有动态的 key（top/bottom/outer/shoes/bag 等）
         "ai_comment": comment,
-        "score": result.get("score", 0),
-        "virtual_tryon_url": generated_image_url
+        "score": ranked_outfits[0]["score"],
+        "virtual_tryon_url": generated_image_url,
+        "session_id": session_id,
+        "alternatives": len(ranked_outfits) - 1,
+    }
+
+@app.get("/recommend/next", summary="换一套：从上次推荐的备选列表中取下一套搭配")
+async def recommend_next(session_id: str, user_id: str):
+    """
+    直接读取 /recommend/outfit 时算好的备选搭配，不重新计算，也不生成效果图与点评
+    会话过期或衣橱发生变化后返回 failed，前端应重新调用 /recommend/outfit
+    """
+    entry = recommend_session_cache.next_outfit(session_id, user_id)
+    if entry is None:
+        return {"status": "failed", "message": "推荐已过期，请重新获取推荐"}
+    outfit, index, remaining, context = entry
+    if outfit is None:
+        return {"status": "failed", "message": "没有更多搭配了，请重新获取推荐"}
+    return {
+        "status": "success",
+        "weather_summary": context["weather_summary"],
+        "outfit": outfit["outfit"],
+        "score": outfit["score"],
+        "reasoning": context["reasoning"],
+        "session_id": session_id,
+        "index": index,
+        "remaining": remaining,
+    }
+
+# 多日规划中不允许跨天重复的核心单品
+PLAN_CORE_KEYS = ("top", "bottom", "one_piece", "outer")
+
+@app.post("/recommend/plan", summary="根据未来几天的天气预报，一次规划每天的穿搭")
+@metrics_service.timed("recommend_plan_total")
+async def recommend_plan(req: schemas.PlanRequest, db: AsyncSession = Depends(database.get_async_db)):
+    """
+    对 daily_forecast 中的每一天各推荐一套搭配，核心单品 (上衣/裤子/连体/外套) 不跨天重复
+    天气只请求一次；画像、衣物 (含向量) 与历史反馈快照只加载一次，逐日切换天气上下文复用
+    为控制耗时，逐日结果不生成试穿效果图与 AI 点评
+    """
+    # 1. 获取天气 (含多日预报)
+    with metrics_service.stage_timer("recommend_weather"):
+        weather_ctx = await get_weather_info(req.location)
+    if "error" in weather_ctx:
+        raise HTTPException(status_code=500, detail=weather_ctx["error"])
+
+    n_days = min(req.days, len(weather_ctx.get("daily_forecast", [])))
+    if n_days == 0:
+        raise HTTPException(status_code=500, detail="天气预报缺少逐日数据")
+
+    # 2. 初始化推荐引擎 (快照只加载一次)
+    recommender = await ProfessionalRecommender.create(db, req.user_id, weather_ctx, req)
+
+    # 3. 逐日推荐，排除前几天已用的核心单品
+    used_ids = set()
+    plan = []
+    for day_index in range(n_days):
+        day_ctx = build_day_context(weather_ctx, day_index)
+        forecast = weather_ctx["daily_forecast"][day_index]
+        try:
+            await recommender.set_weather(day_ctx)
+            result = await recommender.recommend(exclude_ids=frozenset(used_ids))
+        except Exception as e:
+            logger.error(f"Plan recommendation error (day {day_index}): {e}", exc_info=True)
+            result = {"error": "推荐计算过程中发生错误"}
+
+        if not result or "error" in result:
+            plan.append({
+                "date": forecast["date"],
+                "status": "failed",
+                "message": result.get("error") if result else "无法生成有效搭配",
+                "weather_summary": day_ctx.get("summary_text", ""),
+            })
+            continue
+
+        outfit_data = result.get("outfit_items", {})
+        for key in PLAN_CORE_KEYS:
+            item = outfit_data.get(key)
+            if item is not None and item.id is not None:
+                used_ids.add(item.id)
+
+        plan.append({
+            "date": forecast["date"],
+            "status": "success",
+            "weather_summary": day_ctx.get("summary_text", ""),
+            "temp_range": [forecast["min_temp"], forecast["max_temp"]],
+            "outfit": {key: format_outfit_item(item) for key, item in outfit_data.items()},
+            "score": result.get("score", 0),
+            "reasoning": result.get("reasoning", ""),
+            "auto_generated": result.get("auto_generated", []),
+        })
+
+    return {
+        "status": "success",
+        "location": weather_ctx.get("location"),
+        "days": plan,
+    }
+
+@app.post("/recommend/batch", summary="每日批量推荐：按城市分组获取天气，为活跃用户批量计算并写入结果表",
+          dependencies=[Depends(_require_ops_admin)])
+async def run_batch_recommendation(req: schemas.BatchRecommendRequest):
+    return await batch_recommend_service.run_batch(req)
+
+@app.get("/recommend/daily", summary="读取今日 (或指定日期) 的批量推荐结果")
+async def get_daily_recommendation(
+    user_id: str,
+    date: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$"),
+    db: AsyncSession = Depends(database.get_async_db),
+):
+    record = await batch_recommend_service.get_daily_recommendation(db, user_id, date)
+    if not record:
+        raise HTTPException(status_code=404, detail="今日推荐尚未生成")
+    return {
+        "status": record.status,
+        "date": record.date,
+        "weather_summary": record.weather_summary,
+        "outfit": record.outfit,
+        "score": record.score,
+        "reasoning": record.reasoning,
+        "message": record.message,
+        "generated_at": record.created_at,
     }
 
 @app.post("/recommend/feedback", summary="记录用户对推荐的反馈")
@@ -511,10 +987,12 @@ def submit_feedback(req: schemas.FeedbackRequest, db: Session = Depends(get_db))
     )
     db.add(history)
     db.commit()
+    # 历史反馈参与权重计算，同样需要让快照失效
+    wardrobe_cache.invalidate(req.user_id)
     return {"status": "success", "message": "反馈已记录，系统将会学习您的偏好"}
 
 @app.post("/items/generate_virtual", summary="生成虚拟衣物并入库")
-async def generate_virtual_item(req: VirtualItemRequest, db: Session = Depends(get_db)):
+async def generate_virtual_item(req: VirtualItemRequest, db: AsyncSession = Depends(database.get_async_db)):
     # 1. 准备属性字典
     attrs = req.dict()
     
@@ -528,14 +1006,16 @@ async def generate_virtual_item(req: VirtualItemRequest, db: Session = Depends(g
         filename = f"virtual_{uuid4().hex}.jpg"
         local_path = os.path.join(VIRTUAL_DIR, filename).replace("\\", "/")
         
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(img_url)
-            if resp.status_code == 200:
-                # 写入文件
-                with open(local_path, "wb") as f:
-                    f.write(resp.content)
-            else:
-                raise Exception("无法下载 AI 生成的图片")
+        with metrics_service.track_upstream("image_download") as call:
+            resp = await upstream.get("image_download", img_url)
+            if resp.status_code != 200:
+                call.error()
+        if resp.status_code == 200:
+            # 写入文件
+            async with aiofiles.open(local_path, "wb") as f:
+                await f.write(resp.content)
+        else:
+            raise Exception("无法下载 AI 生成的图片")
     except Exception as e:
         logger.error(f"Save virtual image failed: {e}")
         raise HTTPException(status_code=500, detail="图片保存失败")
@@ -563,12 +1043,18 @@ async def generate_virtual_item(req: VirtualItemRequest, db: Session = Depends(g
         waterproof_level="无",
         breathability="中",
         occasions=["休闲"], # 默认场景
-        embedding_vector=[] # 虚拟物品暂时没有向量
+        embedding_vector=[], # 虚拟物品暂时没有向量
+        image_variants=await run_in_threadpool(image_derivatives.generate_derivatives, local_path),
     )
     
     db.add(db_item)
-    db.commit()
-    db.refresh(db_item)
+    await tag_facet_service.apply_tag_changes_async(
+        db, req.user_id, new_tags=tag_facet_service.item_tags(db_item.styles, db_item.occasions)
+    )
+    await version_service.bump_version_async(db, req.user_id)
+    await db.commit()
+    wardrobe_cache.invalidate(req.user_id)
+    await db.refresh(db_item)
     
     return db_item
 
@@ -580,27 +1066,32 @@ DEFAULT_STYLES = ["休闲", "商务", "运动", "街头", "复古", "极简", "
 DEFAULT_SCENARIOS = ["通勤", "居家", "户外", "约会", "正式宴会", "旅行", "运动", "逛街"]
 
 @app.get("/user/tags", summary="获取用户所有用过的风格和场景标签")
-def get_user_tags(user_id: str, db: Session = Depends(get_db)):
-    # 1. 查出用户所有衣服
-    items = db.query(models.ClothingItem).filter(models.ClothingItem.user_id == user_id).all()
-    
-    # 2. 使用集合去重，初始化为默认标签
-    style_set = set(DEFAULT_STYLES)
-    occasion_set = set(DEFAULT_SCENARIOS)
-    
-    # 3. 遍历衣物，把自定义的标签加进去
-    for item in items:
-        # item.styles 是 JSON 列表，可能为空
-        if item.styles:
-            for s in item.styles:
-                if s: style_set.add(s)
-        
-        # item.occasions 是 JSON 列表
-        if item.occasions:
-            for o in item.occasions:
-                if o: occasion_set.add(o)
-                
+def get_user_tags(
+    user_id: str,
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    not_modified = _check_not_modified(db, user_id, "tags", "", if_none_match, response)
+    if not_modified:
+        return not_modified
+
+    # 1. 读取物化的标签计数 (按使用次数降序)
+    facets = tag_facet_service.get_user_facets(db, user_id)
+
+    # 2. 合并默认标签作为保底 (未使用过的默认标签计数为 0，排在已用标签之后)
+    def merge_with_defaults(used, defaults):
+        counts = dict(used)
+        for tag in defaults:
+            counts.setdefault(tag, 0)
+        return counts
+
+    style_counts = merge_with_defaults(facets[tag_facet_service.STYLE], DEFAULT_STYLES)
+    occasion_counts = merge_with_defaults(facets[tag_facet_service.OCCASION], DEFAULT_SCENARIOS)
+
     return {
-        "styles": list(style_set),
-        "occasions": list(occasion_set)
-    }
\ No newline at end of file
+        "styles": list(style_counts),
+        "occasions": list(occasion_counts),
+        "style_counts": style_counts,
+        "occasion_counts": occasion_counts,
+    }
@@ -0,0 +1,217 @@
+import time
+import asyncio
+import functools
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger("SmartWardrobe.Metrics")
+
+# 直方图默认分桶 (秒)，覆盖从毫秒级 SQL 到数十秒的外部 API
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+
+
+def _label_key(labels: dict):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(label_key, extra=None):
+    items = list(label_key) + list(extra or [])
+    if not items:
+        return ""
+    parts = []
+    for k, v in items:
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+
+    def inc(self, amount=1.0, **labels):
+        key = _label_key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels):
+        return self._values.get(_label_key(labels), 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with _lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        # label_key -> [各分桶计数..., sum, count]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            snapshot = {k: list(v) for k, v in self._values.items()}
+        for key, state in sorted(snapshot.items()):
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += state[i]
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {state[-1]}")
+        return lines
+
+
+class Gauge:
+    """抓取时通过回调取值的 Gauge，回调返回 [(labels_dict, value), ...]"""
+
+    def __init__(self, name, help_text, collect_fn):
+        self.name = name
+        self.help = help_text
+        self.collect_fn = collect_fn
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            samples = self.collect_fn()
+        except Exception as e:
+            logger.warning(f"Gauge {self.name} 采集失败: {e}")
+            samples = []
+        for labels, value in samples:
+            lines.append(f"{self.name}{_format_labels(_label_key(labels))} {value}")
+        return lines
+
+
+# ==========================================
+# 指标定义
+# ==========================================
+STAGE_SECONDS = Histogram("smartwardrobe_stage_duration_seconds", "各处理阶段耗时")
+UPSTREAM_REQUESTS = Counter("smartwardrobe_upstream_requests_total", "外部 API 调用次数")
+UPSTREAM_ERRORS = Counter("smartwardrobe_upstream_errors_total", "外部 API 调用失败次数")
+UPSTREAM_SECONDS = Histogram("smartwardrobe_upstream_duration_seconds", "外部 API 调用耗时")
+INFERENCE_SECONDS = Histogram("smartwardrobe_model_inference_seconds", "模型推理耗时")
+CACHE_REQUESTS = Counter("smartwardrobe_cache_requests_total", "缓存查询次数 (按命中/未命中)")
+
+_registry = [STAGE_SECONDS, UPSTREAM_REQUESTS, UPSTREAM_ERRORS, UPSTREAM_SECONDS, INFERENCE_SECONDS, CACHE_REQUESTS]
+
+
+def _collect_cache_ratios():
+    totals = {}
+    with _lock:
+        samples = list(CACHE_REQUESTS._values.items())
+    for key, value in samples:
+        labels = dict(key)
+        hits, total = totals.get(labels["cache"], (0.0, 0.0))
+        if labels["result"] == "hit":
+            hits += value
+        totals[labels["cache"]] = (hits, total + value)
+    return [({"cache": name}, hits / total if total else 0.0) for name, (hits, total) in sorted(totals.items())]
+
+
+_registry.append(Gauge("smartwardrobe_cache_hit_ratio", "缓存命中率", _collect_cache_ratios))
+
+
+def register_gauge(name, help_text, collect_fn):
+    """注册一个抓取时计算的 Gauge (如线程池排队深度)"""
+    _registry.append(Gauge(name, help_text, collect_fn))
+
+
+# ==========================================
+# 埋点工具
+# ==========================================
+def observe_stage(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """记录一个处理阶段的耗时 (无论是否抛出异常)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage)
+
+
+def timed(stage: str):
+    """装饰器：记录整个函数 (同步或异步) 的耗时，用于接口总耗时"""
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with stage_timer(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class _UpstreamCall:
+    def __init__(self):
+        self.failed = False
+
+    def error(self):
+        """标记本次调用失败 (用于非 2xx 但未抛异常的响应)"""
+        self.failed = True
+
+
+@contextmanager
+def track_upstream(upstream: str):
+    """统计一次外部调用：次数、耗时，以及异常或 call.error() 标记的失败"""
+    call = _UpstreamCall()
+    start = time.perf_counter()
+    try:
+        yield call
+    except BaseException:
+        call.failed = True
+        raise
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start, upstream=upstream)
+        UPSTREAM_REQUESTS.inc(upstream=upstream)
+        if call.failed:
+            UPSTREAM_ERRORS.inc(upstream=upstream)
+
+
+def observe_inference(model: str, seconds: float):
+    INFERENCE_SECONDS.observe(seconds, model=model)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def render_metrics() -> str:
+    """以 Prometheus 文本格式输出全部指标"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, JSON, DateTime, Boolean, Float
+from sqlalchemy import Column, Integer, String, JSON, DateTime, Boolean, Float, Index, UniqueConstraint
 from sqlalchemy.sql import func
 from database import Base
 
@@ -42,6 +42,19 @@ class ClothingItem(Base):
     # 存储 CLIP 视觉向量 (List[float])，用于计算搭配兼容度
     embedding_vector = Column(JSON, nullable=True)
 
+    # --- 6. 本地提取的主色 (分割时对不透明像素做 k-means) ---
+    color_rgb = Column(JSON, nullable=True)        # 占比最大的颜色 [r, g, b]
+    color_hsv = Column(JSON, nullable=True)        # 同上 [h(0-360), s(0-1), v(0-1)]，用于查表计算色彩和谐度
+    dominant_colors = Column(JSON, nullable=True)  # 全部主色 [{"rgb", "hsv", "ratio"}, ...]
+
+    # --- 7. 派生图 (写入时生成的 WebP 缩略图/中图，见 image_derivatives) ---
+    image_variants = Column(JSON, nullable=True)   # {"thumb": 路径, "medium": 路径}
+
+    __table_args__ = (
+        # 推荐召回 (_get_candidates) 的访问路径：用户 + 大类 + 状态 + 性别 + 保暖度范围
+        Index("ix_clothing_items_recall", "user_id", "category_main", "status", "gender", "warmth_level"),
+    )
+
 class OutfitHistory(Base):
     """
     穿搭历史记录表 (数据闭环的核心)
@@ -65,6 +78,16 @@ class OutfitHistory(Base):
     
     # 用户反馈: 1:采纳, 0:忽略, -1:太冷, -2:太热, -3:风格不搭
     feedback_score = Column(Integer, default=0)
+
+    __table_args__ = (
+        # 覆盖索引：历史权重计算只读取这些列，查询可直接在索引上完成，无需回表
+        Index(
+            "ix_outfit_history_user_weights",
+            "user_id", "weather_temp", "feedback_score", "date",
+            "top_id", "bottom_id", "outer_id", "one_piece_id",
+        ),
+    )
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -91,4 +114,59 @@ class UserProfile(Base):
     preferred_colors = Column(JSON, default=[])
     preferred_styles = Column(JSON, default=[])      # 偏好风格列表
 
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
\ No newline at end of file
+    # 4. 常驻城市 (每日批量推荐按城市分组获取天气)
+    location = Column(String, default="厦门市", server_default="厦门市")
+    # 性别 (男士/女士)，推荐页切换时同步；为空时批量推荐不按性别过滤
+    gender = Column(String, nullable=True)
+
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class WardrobeVersion(Base):
+    """
+    每个用户衣橱/画像的版本号，任何衣物或画像写入都会递增
+    用作 /items/、/user/tags、/user/profile 的强 ETag
+    """
+    __tablename__ = "wardrobe_versions"
+
+    user_id = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class UserTagFacet(Base):
+    """
+    用户风格/场景标签的物化计数表
+    在衣物增删改时增量维护，/user/tags 直接按索引读取，无需遍历衣物的 JSON 列
+    """
+    __tablename__ = "user_tag_facets"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String, nullable=False)
+    kind = Column(String, nullable=False)   # style / occasion
+    tag = Column(String, nullable=False)
+    count = Column(Integer, nullable=False, default=0)  # 带有该标签的衣物件数
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "kind", "tag", name="uq_user_tag_facets_user_kind_tag"),
+    )
+
+
+class DailyRecommendation(Base):
+    """
+    每日批量推荐的结果，每个用户每天一条，App 打开时直接读取
+    """
+    __tablename__ = "daily_recommendations"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(String, nullable=False)
+    date = Column(String, nullable=False)        # YYYY-MM-DD
+    location = Column(String)                    # 解析后的经纬度
+    status = Column(String, default="success")   # success / failed
+    weather_summary = Column(String)
+    outfit = Column(JSON)                        # 与 /recommend/outfit 的 outfit 字段结构一致
+    score = Column(Integer, default=0)
+    reasoning = Column(String)
+    message = Column(String, nullable=True)      # 失败原因
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("user_id", "date", name="uq_daily_recommendations_user_date"),
+    )
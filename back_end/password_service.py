@@ -0,0 +1,127 @@
+import os
+import asyncio
+import logging
+import multiprocessing
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from passlib.context import CryptContext
+
+import metrics_service
+
+logger = logging.getLogger("SmartWardrobe.Password")
+
+# ==========================================
+# 配置
+# ==========================================
+# bcrypt 成本因子：每 +1 计算量翻倍。调整后旧哈希会在用户下次登录成功时自动重算
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# 专用进程池大小：bcrypt 是纯 CPU 计算，放在独立进程中不占用接口线程池，也不受 GIL 影响
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(2, os.cpu_count() or 1))))
+# 进程池排队上限：超过后直接返回 503，避免登录高峰时请求无限堆积
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", "64"))
+# 同一用户名同时进行的登录校验数上限，超过返回 429
+LOGIN_MAX_CONCURRENT_PER_USER = int(os.getenv("LOGIN_MAX_CONCURRENT_PER_USER", "2"))
+
+# min/max 与默认值一致：成本因子不同于当前配置的哈希都会被 needs_update 标记为需要重算
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+class PasswordServiceBusy(Exception):
+    """进程池排队已满"""
+
+
+class LoginThrottled(Exception):
+    """同一用户名的并发登录过多"""
+
+
+# ==========================================
+# 进程池中执行的函数 (需为模块级函数以便 pickle)
+# ==========================================
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed: str):
+    """返回 (是否匹配, 新哈希或 None)；成本因子变化或方案过期时顺带重算哈希"""
+    return pwd_context.verify_and_update(password, hashed)
+
+
+# ==========================================
+# 异步接口
+# ==========================================
+_executor = None
+_pending = 0
+_active_logins = {}
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # 使用 spawn 启动工作进程：首次登录时父进程已加载 torch/CLIP/Segformer 并有多个线程在运行，
+        # fork 会复制模型内存并可能在子进程中继承被占用的锁而死锁；spawn 的子进程只导入本模块
+        _executor = ProcessPoolExecutor(
+            max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info(f"密码哈希进程池已启动: workers={PASSWORD_HASH_WORKERS}, bcrypt rounds={BCRYPT_ROUNDS}")
+    return _executor
+
+
+async def _run(stage: str, fn, *args):
+    global _pending
+    if _pending >= PASSWORD_MAX_PENDING:
+        raise PasswordServiceBusy()
+    _pending += 1
+    try:
+        with metrics_service.stage_timer(stage):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(_get_executor(), fn, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    return await _run("password_hash", _hash, password)
+
+
+async def verify_and_update(password: str, hashed: str):
+    """校验密码，返回 (是否匹配, 需要写回的新哈希或 None)"""
+    return await _run("password_verify", _verify_and_update, password, hashed)
+
+
+@asynccontextmanager
+async def login_slot(username: str):
+    """限制同一用户名的并发登录校验 (单进程内计数，事件循环线程中调用，无需加锁)"""
+    active = _active_logins.get(username, 0)
+    if active >= LOGIN_MAX_CONCURRENT_PER_USER:
+        raise LoginThrottled()
+    _active_logins[username] = active + 1
+    try:
+        yield
+    finally:
+        remaining = _active_logins[username] - 1
+        if remaining:
+            _active_logins[username] = remaining
+        else:
+            del _active_logins[username]
+
+
+def stats():
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "pending": _pending,
+        "max_pending": PASSWORD_MAX_PENDING,
+        "active_login_users": len(_active_logins),
+    }
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
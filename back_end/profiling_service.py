@@ -0,0 +1,186 @@
+import os
+import io
+import json
+import hmac
+import time
+import random
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import logging
+import contextvars
+from uuid import uuid4
+
+logger = logging.getLogger("SmartWardrobe.Profiling")
+
+# ==========================================
+# 配置 (未设置 PROFILING_ADMIN_TOKEN 时整个机制关闭，不注册中间件，零开销)
+# ==========================================
+PROFILING_ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+PROFILING_ENABLED = bool(PROFILING_ADMIN_TOKEN)
+# 对目标接口按比例随机采样 (0 表示只剖析显式标记的请求)
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_TOP_N = int(os.getenv("PROFILING_TOP_N", "30"))
+PROFILING_MAX_FILES = int(os.getenv("PROFILING_MAX_FILES", "50"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+PROFILED_PATHS = {"/recommend/outfit", "/segment", "/analyze-selected"}
+
+# 请求头 X-Profile-Token 或查询参数 profile_token 携带管理员令牌即触发剖析
+PROFILE_HEADER = "x-profile-token"
+PROFILE_QUERY = "profile_token"
+
+# tracemalloc 与 cProfile 都是进程/线程级的，同一时间只剖析一个请求
+_profile_lock = threading.Lock()
+# 当前请求的剖析记录，用于收集线程池中的子调用
+_current_profile = contextvars.ContextVar("current_profile", default=None)
+
+
+def is_admin(token: str) -> bool:
+    return PROFILING_ENABLED and hmac.compare_digest(token.encode(), PROFILING_ADMIN_TOKEN.encode())
+
+
+def _should_profile(request) -> bool:
+    if request.url.path not in PROFILED_PATHS:
+        return False
+    token = request.headers.get(PROFILE_HEADER) or request.query_params.get(PROFILE_QUERY)
+    if token:
+        return is_admin(token)
+    return PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE
+
+
+def wrap_thread_call(fn):
+    """
+    线程池任务的剖析包装：当前请求正在被剖析时，在工作线程内单独启用 cProfile 并合并到请求记录；
+    否则原样返回 fn
+    """
+    record = _current_profile.get()
+    if record is None:
+        return fn
+
+    def profiled(*args, **kwargs):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            record["thread_profiles"].append(profiler)
+    return profiled
+
+
+def _prune_old_profiles():
+    try:
+        files = sorted(
+            (os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR)),
+            key=os.path.getmtime,
+        )
+    except FileNotFoundError:
+        return
+    # 每个剖析对应 .json 与 .prof 两个文件
+    excess = len(files) - PROFILING_MAX_FILES * 2
+    for path in files[:max(0, excess)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _save_profile(profile_id, request, status_code, elapsed, profiler, record, snapshot):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    stats = pstats.Stats(profiler)
+    for thread_profiler in record["thread_profiles"]:
+        stats.add(thread_profiler)
+    stats.dump_stats(os.path.join(PROFILE_DIR, f"{profile_id}.prof"))
+
+    buf = io.StringIO()
+    stats.stream = buf
+    stats.sort_stats("cumulative").print_stats(PROFILING_TOP_N * 2)
+    stats.print_callees(PROFILING_TOP_N)
+
+    allocations = [
+        {
+            "location": str(stat.traceback[0]) if stat.traceback else "?",
+            "size_kb": round(stat.size / 1024, 1),
+            "count": stat.count,
+        }
+        for stat in snapshot.statistics("lineno")[:PROFILING_TOP_N]
+    ]
+
+    report = {
+        "id": profile_id,
+        "path": request.url.path,
+        "method": request.method,
+        "user_id": request.query_params.get("user_id"),
+        "status_code": status_code,
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "thread_calls_profiled": len(record["thread_profiles"]),
+        "call_tree": buf.getvalue(),
+        "top_allocations": allocations,
+    }
+    with open(os.path.join(PROFILE_DIR, f"{profile_id}.json"), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    _prune_old_profiles()
+
+
+async def profile_middleware(request, call_next):
+    """
+    HTTP 中间件：对被标记或被采样的请求采集 cProfile 调用树与 tracemalloc 分配 Top-N，
+    结果保存到 PROFILE_DIR，响应头 X-Profile-Id 返回剖析编号
+    注意：cProfile 按线程统计，剖析期间同一事件循环上并发执行的其他请求也会计入
+    """
+    if not _should_profile(request) or not _profile_lock.acquire(blocking=False):
+        return await call_next(request)
+
+    profile_id = uuid4().hex[:12]
+    record = {"thread_profiles": []}
+    token = _current_profile.set(record)
+    profiler = cProfile.Profile()
+    try:
+        tracemalloc.start(10)
+        profiler.enable()
+        start = time.perf_counter()
+        try:
+            response = await call_next(request)
+        finally:
+            elapsed = time.perf_counter() - start
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        try:
+            _save_profile(profile_id, request, response.status_code, elapsed, profiler, record, snapshot)
+            response.headers["X-Profile-Id"] = profile_id
+            logger.info(f"已保存请求剖析 {profile_id}: {request.url.path} {elapsed * 1000:.1f}ms")
+        except Exception as e:
+            logger.error(f"保存剖析结果失败: {e}", exc_info=True)
+        return response
+    finally:
+        _current_profile.reset(token)
+        _profile_lock.release()
+
+
+def list_profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    results = []
+    for name in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            continue
+        results.append({k: report.get(k) for k in ("id", "path", "user_id", "status_code", "elapsed_ms", "created_at")})
+    return sorted(results, key=lambda r: r["created_at"] or "", reverse=True)
+
+
+def get_profile_path(profile_id: str, ext: str):
+    """返回剖析文件路径，编号不合法或文件不存在时返回 None"""
+    if not profile_id.isalnum():
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.{ext}")
+    return path if os.path.exists(path) else None
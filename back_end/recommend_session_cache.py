@@ -0,0 +1,61 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from uuid import uuid4
+
+import metrics_service
+import wardrobe_cache
+
+# “换一套”会话：首次推荐时一次算好的多套搭配，后续按顺序翻页，不再重新计算
+RECOMMEND_SESSION_TTL_SECONDS = float(os.getenv("RECOMMEND_SESSION_TTL_SECONDS", "1800"))
+RECOMMEND_SESSION_MAX = int(os.getenv("RECOMMEND_SESSION_MAX", "1024"))
+
+_lock = threading.Lock()
+_sessions = OrderedDict()
+
+
+def create_session(user_id: str, outfits: list, context: dict) -> str:
+    """
+    保存已格式化的搭配列表 (纯字典，不含 ORM 对象)，第 0 套已返回给前端
+    同时记录衣橱版本号，衣橱变化后会话作废，避免返回已删除的衣物
+    """
+    session_id = uuid4().hex
+    with _lock:
+        _sessions[session_id] = {
+            "user_id": user_id,
+            "outfits": outfits,
+            "context": context,
+            "cursor": 0,
+            "version": wardrobe_cache.get_version(user_id),
+            "created_at": time.monotonic(),
+        }
+        while len(_sessions) > RECOMMEND_SESSION_MAX:
+            _sessions.popitem(last=False)
+    return session_id
+
+
+def next_outfit(session_id: str, user_id: str):
+    """
+    取下一套搭配，返回 (搭配, 序号, 剩余套数, 公共上下文)
+    会话不存在/已过期/衣橱已变化时返回 None；已无更多搭配时搭配为 None
+    """
+    with _lock:
+        session = _sessions.get(session_id)
+        if session is None or session["user_id"] != user_id:
+            metrics_service.record_cache("recommend_session", False)
+            return None
+        if (time.monotonic() - session["created_at"] > RECOMMEND_SESSION_TTL_SECONDS
+                or session["version"] != wardrobe_cache.get_version(user_id)):
+            del _sessions[session_id]
+            metrics_service.record_cache("recommend_session", False)
+            return None
+        _sessions.move_to_end(session_id)
+        metrics_service.record_cache("recommend_session", True)
+
+        cursor = session["cursor"] + 1
+        total = len(session["outfits"])
+        if cursor >= total:
+            return None, total, 0, session["context"]
+        session["cursor"] = cursor
+        return session["outfits"][cursor], cursor, total - cursor - 1, session["context"]
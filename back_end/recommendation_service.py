@@ -1,14 +1,21 @@
 import numpy as np
-from sqlalchemy import and_, or_
+import itertools
+import asyncio
 import models
 import logging
 import random
 import os
-import httpx
+import upstream
 from uuid import uuid4
 import image_gen_service
 import datetime
-from models import UserProfile, OutfitHistory, ClothingItem
+import metrics_service
+import version_service
+import tag_facet_service
+import wardrobe_cache
+import color_harmony
+import image_derivatives
+from models import UserProfile
 
 logger = logging.getLogger("SmartWardrobe.Recommender")
 
@@ -17,24 +24,70 @@ UPLOAD_DIR = "uploads"
 VIRTUAL_DIR = os.path.join(UPLOAD_DIR, "virtual")
 os.makedirs(VIRTUAL_DIR, exist_ok=True)
 
+# 多套推荐 (换一套) 参数
+RECOMMEND_TOP_K = int(os.getenv("RECOMMEND_TOP_K", "5"))
+# MMR 中相关性的权重，越小越强调多样性
+RECOMMEND_MMR_LAMBDA = float(os.getenv("RECOMMEND_MMR_LAMBDA", "0.7"))
+# 每个品类参与组合的候选数上限，以及组合总数上限
+RECOMMEND_SLOT_CANDIDATES = int(os.getenv("RECOMMEND_SLOT_CANDIDATES", "8"))
+RECOMMEND_MAX_COMBINATIONS = int(os.getenv("RECOMMEND_MAX_COMBINATIONS", "2000"))
+STYLE_MATCH_BONUS = 30   # 单品匹配所选风格的加分
+MATCH_SCORE_WEIGHT = 0.5  # 上衣/裤子搭配分在相关性中的权重
+COLOR_HARMONY_WEIGHT = 0.3  # 色彩和谐度在搭配分中的权重
+
+def format_outfit_item(item):
+    """ 推荐结果中单品的返回格式 (接口与每日批量推荐共用) """
+    if not item: return None
+    return {
+        "id": item.id,
+        "name": f"{item.main_color}{item.category_sub}",
+        "image_url": item.image_url,
+        "image_variants": item.image_variants,
+        "warmth": item.warmth_level,
+        "type": item.category_main,
+        "gender": item.gender # ✅ 确保返回 gender
+    }
+
 class ProfessionalRecommender:
+    """
+    推荐引擎，db 为 AsyncSession
+    需通过 `await ProfessionalRecommender.create(...)` 构造，以异步加载画像与历史权重
+    画像、衣物与历史反馈来自 wardrobe_cache 快照，召回与外套筛选均在内存中完成
+    """
     def __init__(self, db, user_id, weather_ctx, request_data):
         self.db = db
         self.user_id = user_id
         self.weather = weather_ctx
         self.req = request_data
-        
-        # 获取用户画像 (如果没有则使用默认)
-        from models import UserProfile  # 延迟导入避免循环引用
-        self.profile = self.db.query(UserProfile).filter(UserProfile.user_id == user_id).first()
+        self.snapshot = None
+        self.profile = None
+        self.user_offset = 0
+        self.history_weights = {}
+
+    @classmethod
+    async def create(cls, db, user_id, weather_ctx, request_data):
+        self = cls(db, user_id, weather_ctx, request_data)
+        
+        # 获取用户快照 (画像 + 衣物 + 历史)，缓存命中时不访问数据库
+        with metrics_service.stage_timer("recommend_profile"):
+            self.snapshot = await wardrobe_cache.get_snapshot(db, user_id)
+        self.profile = self.snapshot.profile
         if not self.profile:
             self.profile = UserProfile(user_id=user_id)  # 默认空配置
 
+        await self.set_weather(weather_ctx)
+        return self
+
+    async def set_weather(self, weather_ctx):
+        """ 切换天气上下文 (多日规划时逐日调用)，复用已加载的快照，只重算与天气相关的状态 """
+        self.weather = weather_ctx
+
         # 1. 结合画像计算体感偏差
         self.user_offset = self._calculate_complex_thermal_offset()
         
         # 2. 加载基于历史反馈的权重字典
-        self.history_weights = self._load_history_weights()
+        with metrics_service.stage_timer("recommend_history_weights"):
+            self.history_weights = await self._load_history_weights()
         
     def _calculate_complex_thermal_offset(self):
         """ 
@@ -60,17 +113,14 @@ class ProfessionalRecommender:
         logger.info(f"用户{self.user_id}温度修正值计算完成: {offset} (生理敏感度:{self.profile.thermal_sensitivity}, 通勤方式:{self.profile.commute_method})")
         return offset
     
-    def _load_history_weights(self):
+    async def _load_history_weights(self):
         """
         [核心升级] 简单的在线学习机制
         根据当前气温，查询历史反馈，计算每个单品的偏好权重（含时间衰减）
         """
         current_temp = self.weather["current"]["temp_real"]
         
-        # 查询该用户的所有历史记录
-        history_records = self.db.query(OutfitHistory).filter(
-            OutfitHistory.user_id == self.user_id
-        ).all()
+        history_records = self.snapshot.history
         
         weights = {}  # {item_id: score_bonus}
         
@@ -141,56 +191,45 @@ class ProfessionalRecommender:
         else:
             return (4, 5)  # 极寒
 
-    def _apply_hard_filters(self, query, category):
-        """ 应用基于画像的硬过滤规则 """
+    def _passes_hard_filters(self, item, category):
+        """ 基于画像的硬过滤规则 (与原 SQL 条件一致：字段为 NULL 的衣物不通过比较条件) """
         
         # 1. 颜色黑名单 (Aesthetic)
         if self.profile.avoid_colors:
-            for color in self.profile.avoid_colors:
-                query = query.filter(models.ClothingItem.main_color != color)
+            if item.main_color is None or item.main_color in self.profile.avoid_colors:
+                return False
         
         # 2. 职业场景约束 (Lifestyle)
         is_formal_context = getattr(self.req, "scenario", "") in ["通勤", "正式宴会"]
         
         if self.profile.occupation == "金融/律所/体制内" and is_formal_context:
             # 过滤掉休闲单品
-            query = query.filter(models.ClothingItem.category_sub.notin_(["背心/吊带", "短裤", "拖鞋", "凉鞋", "运动裤"]))
+            if item.category_sub is None or item.category_sub in ["背心/吊带", "短裤", "拖鞋", "凉鞋", "运动裤"]:
+                return False
             
         # 3. 骑行约束 (Commute)
         if self.profile.commute_method == "骑行":
             if category == "裤子":  # 骑行不便穿长裙
-                query = query.filter(models.ClothingItem.category_sub.notin_(["半身裙", "连衣裙", "长裙"]))
+                if item.category_sub is None or item.category_sub in ["半身裙", "连衣裙", "长裙"]:
+                    return False
                 
-        return query
+        return True
 
-    def _get_candidates(self, category, warmth_range, relaxed=False):
-        """ 召回层 (Recall): 基于属性硬过滤 """
-        min_w, max_w = warmth_range
-        
-        # 如果开启宽松模式，保暖范围扩大 (上下各扩1级)
-        if relaxed:
-            min_w = max(1, min_w - 1)
-            max_w = min(5, max_w + 1)
-            logger.info(f"用户{self.user_id}宽松模式生效，{category}保暖范围调整为: [{min_w}, {max_w}] (原范围: {warmth_range})")
+    @staticmethod
+    def _warmth_between(item, min_w, max_w):
+        return item.warmth_level is not None and min_w <= item.warmth_level <= max_w
 
-        query = self.db.query(models.ClothingItem).filter(
-            models.ClothingItem.user_id == self.user_id,
-            models.ClothingItem.category_main == category,
-            models.ClothingItem.status == "正常"
-        )
-        
-        # 应用画像硬过滤
-        if not relaxed:
-            query = self._apply_hard_filters(query, category)
-        
-        # ===== 新增性别过滤逻辑 =====
+    def _allowed_genders(self, relaxed=False):
         # 获取前端传来的性别 (例如: "男士" 或 "女士")，兼容无gender字段的情况
         user_gender_input = getattr(self.req, "gender", "男士")
         
         # 定义允许的性别分类列表
         allowed_genders = ["中性"]  # 中性是通用的
         
-        if "男" in user_gender_input:
+        if user_gender_input == "中性":
+            # 性别未知 (如批量推荐时用户画像未设置性别)：不按性别过滤
+            allowed_genders.extend(["男款", "女款"])
+        elif "男" in user_gender_input:
             allowed_genders.append("男款")
             # 注意：男士绝对不穿女款
         else:
@@ -199,29 +238,40 @@ class ProfessionalRecommender:
             req_style = getattr(self.req, "style", "")
             if relaxed or req_style in ["街头", "运动", "休闲"]:
                 allowed_genders.append("男款")
+        return allowed_genders
+
+    async def _get_candidates(self, category, warmth_range, relaxed=False):
+        """ 召回层 (Recall): 基于属性硬过滤 (在快照上过滤，不访问数据库) """
+        min_w, max_w = warmth_range
         
-        # 应用性别过滤
-        query = query.filter(models.ClothingItem.gender.in_(allowed_genders))
-        # ===== 性别过滤逻辑结束 =====
+        # 如果开启宽松模式，保暖范围扩大 (上下各扩1级)
+        if relaxed:
+            min_w = max(1, min_w - 1)
+            max_w = min(5, max_w + 1)
+            logger.info(f"用户{self.user_id}宽松模式生效，{category}保暖范围调整为: [{min_w}, {max_w}] (原范围: {warmth_range})")
+
+        # 快照中只有 status=正常 的衣物
+        pool = [item for item in self.snapshot.items if item.category_main == category]
+        allowed_genders = self._allowed_genders(relaxed)
+        check_warmth = category in ["上衣", "裤子"]  # 保暖度过滤 (配饰类可以放宽)
         
-        # 保暖度过滤 (配饰类可以放宽)
-        if category in ["上衣", "裤子"]:
-            query = query.filter(models.ClothingItem.warmth_level.between(min_w, max_w))
-            
-        items = query.all()
+        items = [
+            item for item in pool
+            if item.gender in allowed_genders
+            and (relaxed or self._passes_hard_filters(item, category))  # 应用画像硬过滤
+            and (not check_warmth or self._warmth_between(item, min_w, max_w))
+        ]
         
         # 兜底：如果过滤太狠没衣服了，尝试放宽一级保暖度
-        if not items and category in ["上衣", "裤子"] and not relaxed:
-            query = self.db.query(models.ClothingItem).filter(
-                models.ClothingItem.user_id == self.user_id,
-                models.ClothingItem.category_main == category,
-                models.ClothingItem.status == "正常",
-                models.ClothingItem.gender.in_(allowed_genders),  # 兜底时保留性别过滤
-                models.ClothingItem.warmth_level.between(max(1, min_w-1), min(5, max_w+1))
-            )
+        if not items and check_warmth and not relaxed:
+            fallback_min, fallback_max = max(1, min_w - 1), min(5, max_w + 1)
             # 仍然应用硬过滤（例如你是律师，没衣服穿也不能穿拖鞋上班）
-            query = self._apply_hard_filters(query, category)
-            items = query.all()
+            items = [
+                item for item in pool
+                if item.gender in allowed_genders  # 兜底时保留性别过滤
+                and self._warmth_between(item, fallback_min, fallback_max)
+                and self._passes_hard_filters(item, category)
+            ]
             logger.info(f"用户{self.user_id}{category}严格模式兜底召回: {len(items)} 件")
             
         return items
@@ -316,9 +366,15 @@ class ProfessionalRecommender:
         
             
         final = (visual_score * 0.5) + (style_score * 0.5) - rule_penalty
+
+        # 4. 色彩和谐度 (预计算查找表，O(1))；旧数据没有本地主色时按中性值计分
+        harmony = color_harmony.harmony_score(top.color_hsv, bottom.color_hsv)
+        if harmony is None:
+            harmony = color_harmony.NEUTRAL_HARMONY_SCORE
+        final = final * (1 - COLOR_HARMONY_WEIGHT) + harmony * COLOR_HARMONY_WEIGHT
         return final
 
-    def _select_outer(self, inner_top):
+    async def _select_outer(self, inner_top, exclude_ids=frozenset()):
         """ 外套决策逻辑 """
         # 计算体感（含画像修正）
         feels_like = self.weather["current"]["temp_feel"] + self.user_offset
@@ -330,29 +386,16 @@ class ProfessionalRecommender:
         if not needs_coat:
             return None
             
-        outer_candidates = self.db.query(models.ClothingItem).filter(
-            models.ClothingItem.user_id == self.user_id,
-            models.ClothingItem.category_main == "上衣",
-            or_(models.ClothingItem.default_layer == "Outer", models.ClothingItem.default_layer == "Outer_Heavy"),
-            models.ClothingItem.status == "正常"
-        )
-        
-        # 应用硬过滤 + 性别过滤
-        outer_candidates = self._apply_hard_filters(outer_candidates, "上衣")
-        
-        # 外套也需要应用性别过滤
-        user_gender_input = getattr(self.req, "gender", "男士")
-        allowed_genders = ["中性"]
-        if "男" in user_gender_input:
-            allowed_genders.append("男款")
-        else:
-            allowed_genders.append("女款")
-            req_style = getattr(self.req, "style", "")
-            if req_style in ["街头", "运动", "休闲"]:
-                allowed_genders.append("男款")
-        outer_candidates = outer_candidates.filter(models.ClothingItem.gender.in_(allowed_genders))
-        
-        outer_candidates = outer_candidates.all()
+        # 外套也需要应用硬过滤 + 性别过滤
+        allowed_genders = self._allowed_genders()
+        outer_candidates = [
+            item for item in self.snapshot.items
+            if item.category_main == "上衣"
+            and item.default_layer in ("Outer", "Outer_Heavy")
+            and item.gender in allowed_genders
+            and self._passes_hard_filters(item, "上衣")
+            and item.id not in exclude_ids
+        ]
         
         if not outer_candidates: return None
         
@@ -496,15 +539,18 @@ class ProfessionalRecommender:
             filename = f"auto_{uuid4().hex}.jpg"
             local_path = os.path.join(VIRTUAL_DIR, filename).replace("\\", "/")
             
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                resp = await client.get(img_url)
-                if resp.status_code == 200:
-                    with open(local_path, "wb") as f:
-                        f.write(resp.content)
-                else:
-                    raise Exception(f"图片下载失败，状态码: {resp.status_code}")
+            with metrics_service.track_upstream("image_download") as call:
+                resp = await upstream.get("image_download", img_url, timeout=30.0)
+                if resp.status_code != 200:
+                    call.error()
+            if resp.status_code == 200:
+                with open(local_path, "wb") as f:
+                    f.write(resp.content)
+            else:
+                raise Exception(f"图片下载失败，状态码: {resp.status_code}")
             
             item_attrs["image_url"] = local_path
+            item_attrs["image_variants"] = await asyncio.to_thread(image_derivatives.generate_derivatives, local_path)
             
         except Exception as e:
             logger.error(f"自动生成图片失败: {e}，使用默认图")
@@ -513,20 +559,30 @@ class ProfessionalRecommender:
         # 4. 存入数据库
         db_item = models.ClothingItem(**item_attrs)
         self.db.add(db_item)
-        self.db.commit()
-        self.db.refresh(db_item)
+        await tag_facet_service.apply_tag_changes_async(
+            self.db, self.user_id,
+            new_tags=tag_facet_service.item_tags(db_item.styles, db_item.occasions),
+        )
+        await version_service.bump_version_async(self.db, self.user_id)
+        await self.db.commit()
+        # 与其他衣物写入路径一致：提交后让快照与推荐会话失效
+        wardrobe_cache.invalidate(self.user_id)
+        await self.db.refresh(db_item)
         
         return db_item
 
-    async def recommend(self):
-        """ 主推荐流程 (全品类支持 + 自动生成机制) """
-        warmth_range = self._get_target_warmth()
-        target_warmth = max(warmth_range[0], min(warmth_range[1], 4))
-        
-        # 处理性别逻辑
-        gender_req = getattr(self.req, "gender", "中性")
-        target_gender = "男款" if "男" in gender_req else ("女款" if "女" in gender_req else "中性")
-        
+    # 品类 -> 返回结构中的 key (适配前端key映射)
+    CATEGORY_KEYS = {
+        "上衣": "top", 
+        "裤子": "bottom", 
+        "连体类": "one_piece", 
+        "鞋": "shoes", 
+        "包": "bag",
+        "帽子": "hat",
+        "配饰": "accessory"
+    }
+
+    def _target_categories(self):
         # 获取用户想要搭配的品类列表 (默认上衣+裤子)
         target_categories = list(getattr(self.req, "target_categories", ["上衣", "裤子"]))  # 转为 list 以便修改（remove操作）
         
@@ -534,69 +590,63 @@ class ProfessionalRecommender:
         if "连体类" in target_categories:
             if "上衣" in target_categories: target_categories.remove("上衣")
             if "裤子" in target_categories: target_categories.remove("裤子")
+        return target_categories
+
+    async def _collect_slots(self, target_categories, exclude_ids, auto_generate):
+        """
+        逐品类召回并排序
+        返回 ({key: [(单品, 是否匹配风格, 天气分), ...] 按风格匹配、天气分降序}, 自动生成的品类, 缺失的品类)
+        """
+        warmth_range = self._get_target_warmth()
+        target_warmth = max(warmth_range[0], min(warmth_range[1], 4))
+        
+        # 处理性别逻辑
+        gender_req = getattr(self.req, "gender", "中性")
+        target_gender = "男款" if "男" in gender_req else ("女款" if "女" in gender_req else "中性")
+        current_style = getattr(self.req, "style", None)
 
-        final_outfit = {}
+        slots = {}
         auto_gen_log = []
-        total_score = 0
+        missing_log = []
 
         # --- 循环处理每一个目标品类 ---
         for cat in target_categories:
             # 1. 尝试召回 (Relaxed 模式)
-            candidates = self._get_candidates(cat, warmth_range, relaxed=True)
+            with metrics_service.stage_timer("recommend_recall"):
+                candidates = await self._get_candidates(cat, warmth_range, relaxed=True)
             
             # 特殊处理上衣层级，避免把外套当内搭
             if cat == "上衣":
                 candidates = [t for t in candidates if t.default_layer in ["Base", "Mid", "Unknown", None]]
+            if exclude_ids:
+                candidates = [c for c in candidates if c.id not in exclude_ids]
 
-            selected_item = None
+            json_key = self.CATEGORY_KEYS.get(cat, cat) # 兼容未映射的品类
             
             # 2. 如果没找到 -> 自动生成
+            if not candidates and not auto_generate:
+                missing_log.append(cat)
+                continue
             if not candidates:
                 logger.info(f"❌ 缺少 {cat}，正在调用 AI 自动生成...")
-                selected_item = await self._auto_generate_item(cat, target_warmth, target_gender)
+                with metrics_service.stage_timer("recommend_auto_generate"):
+                    generated = await self._auto_generate_item(cat, target_warmth, target_gender)
                 auto_gen_log.append(cat)
-                total_score += 80  # 自动生成的基础分
-            else:
-                # 3. 如果找到了 -> 简单打分选最好的 (贪心算法)
-                current_style = getattr(self.req, "style", None)
-                # 优先匹配风格，再按天气适配度排序
-                candidates.sort(
-                    key=lambda x: (
-                        1 if current_style in (x.styles or []) else 0,
-                        self._calc_weather_score(x)
-                    ), 
-                    reverse=True
-                )
-                selected_item = candidates[0]
-                total_score += self._calc_weather_score(selected_item) # 累加天气适配分
-
-            # 放入结果集 (适配前端key映射)
-            key_map = {
-                "上衣": "top", 
-                "裤子": "bottom", 
-                "连体类": "one_piece", 
-                "鞋": "shoes", 
-                "包": "bag",
-                "帽子": "hat",
-                "配饰": "accessory"
-            }
-            json_key = key_map.get(cat, cat) # 兼容未映射的品类
-            final_outfit[json_key] = selected_item
+                slots[json_key] = [(generated, True, 80)]  # 自动生成的基础分
+                continue
 
-        # 4. 外套补充
-        if "top" in final_outfit:
-            outer = self._select_outer(final_outfit["top"])
-            if outer:
-                final_outfit["outer"] = outer
-                total_score += self._calc_weather_score(outer)
+            # 3. 如果找到了 -> 打分排序，优先匹配风格，再按天气适配度
+            with metrics_service.stage_timer("recommend_scoring"):
+                scored = [
+                    (item, current_style in (item.styles or []), self._calc_weather_score(item))
+                    for item in candidates
+                ]
+                scored.sort(key=lambda x: (1 if x[1] else 0, x[2]), reverse=True)
+            slots[json_key] = scored
 
-        # 5. 最终检查：无有效搭配返回错误
-        if not final_outfit:
-            return {
-                "error": "无法生成有效搭配，请检查目标品类配置或录入更多衣物"
-            }
+        return slots, auto_gen_log, missing_log
 
-        # 6. 构造返回结构
+    def _build_reasoning(self, auto_gen_log):
         weather_desc = self.weather.get("summary_text", "")
         reasoning = f"基于今天{weather_desc}的天气推荐。"
         if auto_gen_log:
@@ -607,12 +657,154 @@ class ProfessionalRecommender:
             reasoning += " 考虑到您较怕冷，已加强保暖配置。"
         if self.profile.commute_method == "骑行":
             reasoning += " 为骑行通勤优化了防风防水性能。"
+        return reasoning
+
+    async def recommend(self, exclude_ids=frozenset(), auto_generate=True):
+        """
+        主推荐流程 (全品类支持 + 自动生成机制)
+        exclude_ids: 不参与本次推荐的衣物 id (多日规划中前几天已用过的核心单品)
+        auto_generate: 缺少品类时是否调用 AI 生成虚拟单品 (批量推荐时关闭，缺失品类直接跳过)
+        """
+        target_categories = self._target_categories()
+        slots, auto_gen_log, missing_log = await self._collect_slots(target_categories, exclude_ids, auto_generate)
+
+        # 每个品类取排序第一的单品 (贪心算法)，累加天气适配分
+        final_outfit = {key: entries[0][0] for key, entries in slots.items()}
+        total_score = sum(entries[0][2] for entries in slots.values())
 
+        # 4. 外套补充
+        if "top" in final_outfit:
+            with metrics_service.stage_timer("recommend_outer"):
+                outer = await self._select_outer(final_outfit["top"], exclude_ids)
+            if outer:
+                final_outfit["outer"] = outer
+                total_score += self._calc_weather_score(outer)
+
+        # 5. 最终检查：无有效搭配返回错误
+        if not final_outfit:
+            return {
+                "error": "无法生成有效搭配，请检查目标品类配置或录入更多衣物"
+            }
+
+        # 6. 构造返回结构
         return {
             "outfit_items": final_outfit,
             "score": int(total_score / len(target_categories)) if target_categories else 0,
-            "weather_summary": weather_desc,
-            "reasoning": reasoning,
+            "weather_summary": self.weather.get("summary_text", ""),
+            "reasoning": self._build_reasoning(auto_gen_log),
+            "weather_context": self.weather,
+            "auto_generated": auto_gen_log,
+            "missing_categories": missing_log
+        }
+
+    @staticmethod
+    def _slot_similarity(items):
+        """ 同一品类候选之间的视觉相似度矩阵 (余弦相似度，裁剪到 [0, 1])；无向量的单品只与自身相似 """
+        dim = max((len(item.embedding_vector or []) for item in items), default=0)
+        n = len(items)
+        sim = np.eye(n)
+        if dim == 0:
+            return sim
+        matrix = np.zeros((n, dim))
+        for i, item in enumerate(items):
+            vec = item.embedding_vector or []
+            if len(vec) == dim:
+                matrix[i] = vec
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        valid = norms[:, 0] > 0
+        matrix[valid] /= norms[valid]
+        sim = np.clip(matrix @ matrix.T, 0.0, 1.0)
+        np.fill_diagonal(sim, 1.0)
+        return sim
+
+    def _rank_combinations(self, slots, k, diversity):
+        """
+        MMR 多样性排序：在各品类候选的组合中选出 k 套
+        相关性 = 各单品 (风格匹配加分 + 天气分) 之和 + 上衣/裤子搭配分；
+        每选一套，剩余组合按与已选组合的最大视觉相似度扣分 (同品类单品向量的平均相似度)
+        返回 [{key: (单品, 是否匹配风格, 天气分)}, ...]，按选中顺序排列
+        """
+        keys = list(slots)
+        # 限制每个品类参与组合的候选数，使组合总数不超过上限
+        per_slot = max(1, int(RECOMMEND_MAX_COMBINATIONS ** (1 / len(keys))))
+        per_slot = min(per_slot, RECOMMEND_SLOT_CANDIDATES)
+        pools = [slots[key][:per_slot] for key in keys]
+
+        combos = np.array(list(itertools.product(*(range(len(pool)) for pool in pools))), dtype=int)
+        item_scores = [
+            np.array([(STYLE_MATCH_BONUS if style_hit else 0) + score for _, style_hit, score in pool])
+            for pool in pools
+        ]
+        relevance = sum(item_scores[j][combos[:, j]] for j in range(len(keys)))
+
+        # 上衣与裤子的搭配分 (视觉兼容 + 风格一致)，按候选对预先计算
+        if "top" in keys and "bottom" in keys:
+            t, b = keys.index("top"), keys.index("bottom")
+            match = np.array([
+                [self.compute_match_score(top, bottom) for bottom, _, _ in pools[b]]
+                for top, _, _ in pools[t]
+            ])
+            relevance = relevance + MATCH_SCORE_WEIGHT * match[combos[:, t], combos[:, b]]
+
+        span = relevance.max() - relevance.min()
+        rel_norm = (relevance - relevance.min()) / span if span > 0 else np.ones(len(combos))
+
+        sims = [self._slot_similarity([item for item, _, _ in pool]) for pool in pools]
+        max_sim = np.zeros(len(combos))
+        available = np.ones(len(combos), dtype=bool)
+        selected = []
+        for _ in range(min(k, len(combos))):
+            mmr = np.where(available, diversity * rel_norm - (1 - diversity) * max_sim, -np.inf)
+            best = int(np.argmax(mmr))
+            selected.append(best)
+            available[best] = False
+            sim_to_best = sum(sims[j][combos[:, j], combos[best, j]] for j in range(len(keys))) / len(keys)
+            max_sim = np.maximum(max_sim, sim_to_best)
+        return [{key: pools[j][combos[best, j]] for j, key in enumerate(keys)} for best in selected]
+
+    async def recommend_ranked(self, k=None, diversity=None):
+        """
+        一次计算 k 套互有差异的搭配 (MMR 多样性排序)，第一套为综合得分最高的搭配
+        返回结构同 recommend()，其中 outfits 为 [{"outfit_items", "score"}, ...]
+        """
+        k = k or RECOMMEND_TOP_K
+        diversity = RECOMMEND_MMR_LAMBDA if diversity is None else diversity
+        target_categories = self._target_categories()
+        slots, auto_gen_log, missing_log = await self._collect_slots(target_categories, frozenset(), True)
+
+        if not slots:
+            return {
+                "error": "无法生成有效搭配，请检查目标品类配置或录入更多衣物"
+            }
+
+        with metrics_service.stage_timer("recommend_rank"):
+            ranked = self._rank_combinations(slots, k, diversity)
+
+        outfits = []
+        outer_by_top = {}
+        for combo in ranked:
+            outfit = {key: entry[0] for key, entry in combo.items()}
+            total_score = sum(entry[2] for entry in combo.values())
+            # 外套补充 (同一件上衣只计算一次)
+            if "top" in outfit:
+                top = outfit["top"]
+                if top.id not in outer_by_top:
+                    with metrics_service.stage_timer("recommend_outer"):
+                        outer_by_top[top.id] = await self._select_outer(top)
+                outer = outer_by_top[top.id]
+                if outer:
+                    outfit["outer"] = outer
+                    total_score += self._calc_weather_score(outer)
+            outfits.append({
+                "outfit_items": outfit,
+                "score": int(total_score / len(target_categories)) if target_categories else 0,
+            })
+
+        return {
+            "outfits": outfits,
+            "weather_summary": self.weather.get("summary_text", ""),
+            "reasoning": self._build_reasoning(auto_gen_log),
             "weather_context": self.weather,
-            "auto_generated": auto_gen_log
-        }
\ No newline at end of file
+            "auto_generated": auto_gen_log,
+            "missing_categories": missing_log
+        }
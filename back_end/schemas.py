@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Dict
 from datetime import datetime
 
 # 基础属性模型
@@ -13,7 +13,8 @@ class Token(BaseModel):
     user_id: str  # 返回给前端存起来
     username: str
     
-class ItemBase(BaseModel):
+class ItemAttributes(BaseModel):
+    """衣物的结构化属性 (不含视觉向量)"""
     user_id: str = Field(..., description="用户唯一标识")
     category_main: str
     category_sub: str
@@ -38,7 +39,12 @@ class ItemBase(BaseModel):
     # 改为 Optional 并设置默认空列表
     occasions: Optional[List[str]] = []
     gender: Optional[str] = "中性"
-    
+    # 分割时本地提取的主色 (由 /analyze-selected 返回，保存时回传)
+    color_rgb: Optional[List[int]] = None
+    color_hsv: Optional[List[float]] = None
+    dominant_colors: Optional[List[dict]] = None
+
+class ItemBase(ItemAttributes):
     # 接收前端回传的向量 (分析时生成，创建时存入)
     embedding_vector: Optional[List[float]] = None
 
@@ -48,11 +54,45 @@ class ItemCreate(ItemBase):
 class ItemResponse(ItemBase):
     id: int
     image_url: str
+    # 派生图路径 {"thumb", "medium"}，列表/网格优先使用，生成失败时为空
+    image_variants: Optional[Dict[str, str]] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+class ItemSummary(ItemAttributes):
+    """衣橱列表默认返回的精简模型，不含 512 维 embedding_vector"""
+    id: int
+    image_url: str
+    image_variants: Optional[Dict[str, str]] = None
     created_at: datetime
     
     class Config:
         from_attributes = True
 
+class DuplicateCandidate(BaseModel):
+    id: int
+    similarity: float
+
+class ItemCreateResponse(ItemResponse):
+    # 衣橱中与新衣物几乎相同的已有衣物 (疑似重复录入)，仅作提醒，不阻止保存
+    duplicates: List[DuplicateCandidate] = []
+
+class SimilarItem(ItemSummary):
+    similarity: float
+
+class BulkImportRowError(BaseModel):
+    index: int  # 行号 (从 0 开始，按提交顺序)
+    errors: List[str]
+
+class BulkImportResult(BaseModel):
+    received: int
+    inserted: int
+    failed: int
+    ids: List[int]  # 成功入库的衣物 id，与提交顺序一致 (跳过失败行)
+    errors: List[BulkImportRowError]
+
 class ItemUpdate(BaseModel):
     user_id: Optional[str] = None
     category_main: Optional[str] = None
@@ -81,6 +121,18 @@ class RecommendationRequest(BaseModel):
     gender: str = "男士"
     target_categories: List[str] = ["上衣", "裤子"]
 
+class PlanRequest(RecommendationRequest):
+    days: int = Field(3, ge=1, le=7, description="规划天数，不超过天气预报提供的天数")
+
+class BatchRecommendRequest(BaseModel):
+    date: Optional[str] = Field(None, pattern=r"^\d{4}-\d{2}-\d{2}$", description="结果日期，默认今天")
+    user_ids: Optional[List[str]] = None  # 为空则为所有活跃用户计算
+    concurrency: Optional[int] = Field(None, ge=1, le=64)
+    scenario: str = "通勤"
+    style: str = "休闲"  # 用户画像没有偏好风格时使用
+    gender: Optional[str] = None  # 用户画像没有性别时使用，为空则不按性别过滤 (中性)
+    target_categories: List[str] = ["上衣", "裤子"]
+
 class FeedbackRequest(BaseModel):
     user_id: str
     top_id: Optional[int] = None   
@@ -101,6 +153,8 @@ class UserProfileBase(BaseModel):
     avoid_colors: List[str] = []
     preferred_styles: List[str] = []
     preferred_colors: List[str] = []
+    location: Optional[str] = "厦门市"
+    gender: Optional[str] = None  # 男士 / 女士
 
 class UserProfileCreate(UserProfileBase):
     pass
@@ -0,0 +1,107 @@
+import logging
+from collections import Counter
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import ClothingItem, UserTagFacet
+
+logger = logging.getLogger("SmartWardrobe.TagFacets")
+
+STYLE = "style"
+OCCASION = "occasion"
+
+
+def item_tags(styles, occasions):
+    """单件衣物的标签集合 {(kind, tag)}，同一件衣物内重复的标签只计一次"""
+    tags = {(STYLE, s) for s in (styles or []) if s}
+    tags |= {(OCCASION, o) for o in (occasions or []) if o}
+    return tags
+
+
+def _tag_deltas(old_tags, new_tags):
+    deltas = Counter()
+    for key in new_tags - old_tags:
+        deltas[key] += 1
+    for key in old_tags - new_tags:
+        deltas[key] -= 1
+    return deltas
+
+
+def _upsert_statements(user_id, deltas):
+    rows = [
+        {"user_id": user_id, "kind": kind, "tag": tag, "count": delta}
+        for (kind, tag), delta in deltas.items() if delta
+    ]
+    if not rows:
+        return None, None
+    stmt = sqlite_insert(UserTagFacet).values(rows)
+    upsert = stmt.on_conflict_do_update(
+        index_elements=[UserTagFacet.user_id, UserTagFacet.kind, UserTagFacet.tag],
+        set_={"count": UserTagFacet.count + stmt.excluded.count},
+    )
+    # 计数归零的标签直接删除
+    cleanup = delete(UserTagFacet).where(UserTagFacet.user_id == user_id, UserTagFacet.count <= 0)
+    return upsert, cleanup
+
+
+def apply_tag_changes(db, user_id, old_tags=frozenset(), new_tags=frozenset()):
+    """
+    按衣物标签的变化增量更新计数 (同步会话)，由调用方提交
+    新增衣物: old_tags 为空；删除衣物: new_tags 为空
+    """
+    upsert, cleanup = _upsert_statements(user_id, _tag_deltas(set(old_tags), set(new_tags)))
+    if upsert is not None:
+        db.execute(upsert)
+        db.execute(cleanup)
+
+
+async def apply_tag_changes_async(db, user_id, old_tags=frozenset(), new_tags=frozenset()):
+    """apply_tag_changes 的异步会话版本"""
+    upsert, cleanup = _upsert_statements(user_id, _tag_deltas(set(old_tags), set(new_tags)))
+    if upsert is not None:
+        await db.execute(upsert)
+        await db.execute(cleanup)
+
+
+async def add_items_tags_async(db, user_id, tag_sets):
+    """批量新增衣物时合并所有衣物的标签增量，一条语句写入 (异步会话)，由调用方提交"""
+    deltas = Counter()
+    for tags in tag_sets:
+        deltas.update(tags)
+    upsert, _ = _upsert_statements(user_id, deltas)
+    if upsert is not None:
+        await db.execute(upsert)
+
+
+def get_user_facets(db, user_id):
+    """读取用户的标签计数，返回 {kind: [(tag, count), ...]}，按使用次数降序"""
+    rows = db.execute(
+        select(UserTagFacet.kind, UserTagFacet.tag, UserTagFacet.count)
+        .where(UserTagFacet.user_id == user_id)
+        .order_by(UserTagFacet.count.desc(), UserTagFacet.tag)
+    ).all()
+    facets = {STYLE: [], OCCASION: []}
+    for kind, tag, count in rows:
+        facets.setdefault(kind, []).append((tag, count))
+    return facets
+
+
+def backfill_if_empty(db):
+    """
+    启动回填：计数表为空但已有衣物时 (首次升级到本版本)，从衣物表全量重建一次
+    只读取 user_id / styles / occasions 三列
+    """
+    if db.execute(select(func.count()).select_from(UserTagFacet)).scalar():
+        return 0
+    counts = {}
+    for user_id, styles, occasions in db.execute(
+        select(ClothingItem.user_id, ClothingItem.styles, ClothingItem.occasions)
+    ):
+        counts.setdefault(user_id, Counter()).update(item_tags(styles, occasions))
+    for user_id, deltas in counts.items():
+        upsert, _ = _upsert_statements(user_id, deltas)
+        if upsert is not None:
+            db.execute(upsert)
+    db.commit()
+    if counts:
+        logger.info(f"标签计数表回填完成: {len(counts)} 个用户")
+    return len(counts)
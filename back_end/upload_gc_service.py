@@ -0,0 +1,217 @@
+"""
+上传文件回收：删除不再被任何衣物引用的上传产物，并统计每个用户的磁盘占用
+
+产生孤儿文件的来源：
+- /segment 每次写入原图与最多 7 张部件 PNG (及主色旁路文件、派生图)，用户通常只保存其中一张
+- DELETE /items/{id} 只删除数据库记录
+- 推荐时自动生成的虚拟单品图片 (uploads/virtual)
+
+引用集合 = 所有 ClothingItem.image_url 与 image_variants 中的路径；
+未被引用且超过宽限期 (给 分割 -> 识别 -> 保存 流程留出时间) 的文件才会被删除。
+
+命令行用法 (在 back_end 目录下):
+    python upload_gc_service.py --dry-run
+    python upload_gc_service.py --grace-hours 6
+"""
+import os
+import time
+import asyncio
+import logging
+import argparse
+import threading
+
+import database
+import models
+
+logger = logging.getLogger("SmartWardrobe.UploadGC")
+
+UPLOAD_DIR = "uploads"
+# 未被引用的文件至少保留多久才回收 (小时)
+UPLOAD_GC_GRACE_HOURS = float(os.getenv("UPLOAD_GC_GRACE_HOURS", "24"))
+# 后台回收间隔 (秒)，0 表示不启动后台任务，只能通过管理接口或命令行触发
+UPLOAD_GC_INTERVAL_SECONDS = float(os.getenv("UPLOAD_GC_INTERVAL_SECONDS", "3600"))
+# 每个用户上传目录的磁盘配额 (MB)，0 表示不限制
+UPLOAD_QUOTA_MB_PER_USER = float(os.getenv("UPLOAD_QUOTA_MB_PER_USER", "500"))
+
+# 不属于任何用户、但必须保留的文件 (默认占位图)
+PROTECTED_FILES = {"uploads/default.png", "uploads/default_virtual.jpg"}
+# 不按用户统计配额的共享目录
+SHARED_DIRS = {"virtual", "derived"}
+# 衣物图片的旁路文件 (主色)，随图片一起保留或回收
+SIDECAR_SUFFIXES = (".colors.json",)
+
+_run_lock = threading.Lock()
+_last_report = {}
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, user_id, used_bytes, quota_bytes):
+        self.user_id = user_id
+        self.used_bytes = used_bytes
+        self.quota_bytes = quota_bytes
+        super().__init__(f"用户 {user_id} 上传占用 {used_bytes / 1024 / 1024:.1f}MB，超过配额 {quota_bytes / 1024 / 1024:.0f}MB")
+
+
+def _normalize(path: str) -> str:
+    return os.path.normpath(path).replace("\\", "/")
+
+
+def load_referenced_paths(db):
+    """所有衣物引用的文件路径 (原图/抠图 + 派生图)"""
+    referenced = set(PROTECTED_FILES)
+    rows = db.query(models.ClothingItem.image_url, models.ClothingItem.image_variants).yield_per(1000)
+    for image_url, variants in rows:
+        if image_url:
+            referenced.add(_normalize(image_url))
+        for path in (variants or {}).values():
+            if path:
+                referenced.add(_normalize(path))
+    return referenced
+
+
+def _owner_of(rel_path: str):
+    """uploads/{user_id}/... 归属该用户；共享目录与根目录文件不计入任何用户"""
+    parts = rel_path.split("/")
+    if len(parts) < 3 or parts[1] in SHARED_DIRS:
+        return None
+    return parts[1]
+
+
+def _is_referenced(path: str, referenced) -> bool:
+    if path in referenced:
+        return True
+    for suffix in SIDECAR_SUFFIXES:
+        if path.endswith(suffix) and path[: -len(suffix)] in referenced:
+            return True
+    return False
+
+
+def collect(db, grace_hours=None, dry_run=False):
+    """
+    扫描上传目录并回收孤儿文件
+    :return: 报告字典 (扫描/删除文件数、回收字节数、每个用户的占用与超额用户)
+    """
+    grace_seconds = (UPLOAD_GC_GRACE_HOURS if grace_hours is None else grace_hours) * 3600
+    quota_bytes = UPLOAD_QUOTA_MB_PER_USER * 1024 * 1024
+    with _run_lock:
+        start = time.perf_counter()
+        referenced = load_referenced_paths(db)
+        cutoff = time.time() - grace_seconds
+
+        scanned = deleted = reclaimed = kept_in_grace = 0
+        usage = {}
+        for root, _, files in os.walk(UPLOAD_DIR):
+            for name in files:
+                path = _normalize(os.path.join(root, name))
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                scanned += 1
+                owner = _owner_of(path)
+
+                if not _is_referenced(path, referenced):
+                    if st.st_mtime < cutoff:
+                        if not dry_run:
+                            try:
+                                os.remove(path)
+                            except OSError as e:
+                                logger.warning(f"删除孤儿文件失败 {path}: {e}")
+                                continue
+                        deleted += 1
+                        reclaimed += st.st_size
+                        continue
+                    kept_in_grace += 1
+
+                if owner is not None:
+                    usage[owner] = usage.get(owner, 0) + st.st_size
+
+        over_quota = sorted(u for u, used in usage.items() if quota_bytes and used > quota_bytes)
+        report = {
+            "dry_run": dry_run,
+            "scanned_files": scanned,
+            "deleted_files": deleted,
+            "reclaimed_bytes": reclaimed,
+            "kept_in_grace": kept_in_grace,
+            "referenced_paths": len(referenced),
+            "users": len(usage),
+            "total_user_bytes": sum(usage.values()),
+            "quota_bytes": int(quota_bytes),
+            "over_quota_users": over_quota,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+            "finished_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        if not dry_run:
+            _last_report.clear()
+            _last_report.update(report)
+        logger.info(
+            f"上传文件回收{'(演练)' if dry_run else ''}: 扫描 {scanned} 个，删除 {deleted} 个，"
+            f"回收 {reclaimed / 1024 / 1024:.1f}MB，超额用户 {len(over_quota)} 个"
+        )
+        return report
+
+
+def user_usage_bytes(user_id: str) -> int:
+    total = 0
+    user_dir = os.path.join(UPLOAD_DIR, user_id)
+    for root, _, files in os.walk(user_dir):
+        for name in files:
+            try:
+                total += os.stat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def check_quota(user_id: str, incoming_bytes: int = 0):
+    """写入新上传前检查配额，超出时抛出 QuotaExceeded (未被引用的文件在回收后自动释放配额)"""
+    if UPLOAD_QUOTA_MB_PER_USER <= 0:
+        return
+    quota_bytes = UPLOAD_QUOTA_MB_PER_USER * 1024 * 1024
+    used = user_usage_bytes(user_id)
+    if used + incoming_bytes > quota_bytes:
+        raise QuotaExceeded(user_id, used, quota_bytes)
+
+
+def stats():
+    """最近一次 (非演练) 回收的统计"""
+    return {
+        key: _last_report.get(key, 0)
+        for key in ("scanned_files", "deleted_files", "reclaimed_bytes", "kept_in_grace", "total_user_bytes")
+    }
+
+
+def _collect_with_session(grace_hours=None, dry_run=False):
+    with database.SessionLocal() as db:
+        return collect(db, grace_hours=grace_hours, dry_run=dry_run)
+
+
+async def run_collect(grace_hours=None, dry_run=False):
+    """在线程池中执行一次回收 (目录遍历与删除都是阻塞 IO)"""
+    return await asyncio.to_thread(_collect_with_session, grace_hours, dry_run)
+
+
+async def run_forever():
+    """后台定期回收，随应用启动/关闭"""
+    while True:
+        await asyncio.sleep(UPLOAD_GC_INTERVAL_SECONDS)
+        try:
+            await run_collect()
+        except Exception as e:
+            logger.error(f"上传文件回收失败: {e}", exc_info=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回收未被衣物引用的上传文件")
+    parser.add_argument("--grace-hours", type=float, default=None, help=f"宽限期，默认 {UPLOAD_GC_GRACE_HOURS}")
+    parser.add_argument("--dry-run", action="store_true", help="只统计不删除")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = _collect_with_session(args.grace_hours, args.dry_run)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
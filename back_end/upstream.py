@@ -0,0 +1,385 @@
+import os
+import re
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import logging
+from collections import deque
+from urllib.parse import urlsplit, urlencode
+
+import httpx
+
+logger = logging.getLogger("SmartWardrobe.Upstream")
+
+# ==========================================
+# 外部 API 接入层 (彩云天气 / Nominatim / 硅基流动 / DeepSeek / 图片下载)
+# UPSTREAM_MODE:
+#   live   - 直连真实 API (默认)
+#   record - 直连真实 API，并把响应按请求哈希写入 UPSTREAM_RECORD_DIR
+#   replay - 不访问网络，从 UPSTREAM_RECORD_DIR 回放录制的响应
+#   stub   - 把请求改写到本地桩服务 (benchmarks/stub_upstream.py)，用于离线压测
+# ==========================================
+UPSTREAM_MODE = os.getenv("UPSTREAM_MODE", "live").lower()
+UPSTREAM_RECORD_DIR = os.getenv("UPSTREAM_RECORD_DIR", "upstream_recordings")
+UPSTREAM_STUB_URL = os.getenv("UPSTREAM_STUB_URL", "http://127.0.0.1:8900").rstrip("/")
+# 回放时是否按录制时的耗时 sleep (recorded) 还是立即返回 (none)
+UPSTREAM_REPLAY_LATENCY = os.getenv("UPSTREAM_REPLAY_LATENCY", "recorded").lower()
+# 回放未命中精确哈希时，是否退回同一接口 (方法 + 路径) 的任意录制 (图片分析等请求体每次不同)
+UPSTREAM_REPLAY_LOOSE = os.getenv("UPSTREAM_REPLAY_LOOSE", "1") == "1"
+
+# 熔断：连续失败 N 次后打开，期间直接拒绝调用，冷却后放行一个探测请求
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_OPEN_SECONDS = float(os.getenv("UPSTREAM_BREAKER_OPEN_SECONDS", "30"))
+# 对冲请求：幂等 GET 超过近期延迟的该分位数仍未返回时，再发一个相同请求，取先返回者
+UPSTREAM_HEDGE_PERCENTILE = float(os.getenv("UPSTREAM_HEDGE_PERCENTILE", "95"))
+UPSTREAM_HEDGE_MIN_SAMPLES = int(os.getenv("UPSTREAM_HEDGE_MIN_SAMPLES", "20"))
+# 样本不足时使用的默认对冲延迟，以及对冲延迟下限 (毫秒)
+UPSTREAM_HEDGE_DEFAULT_DELAY_MS = float(os.getenv("UPSTREAM_HEDGE_DEFAULT_DELAY_MS", "1000"))
+UPSTREAM_HEDGE_MIN_DELAY_MS = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY_MS", "50"))
+# 对冲请求数不超过总请求数的该比例，避免上游整体变慢时请求量翻倍
+UPSTREAM_HEDGE_MAX_RATIO = float(os.getenv("UPSTREAM_HEDGE_MAX_RATIO", "0.1"))
+UPSTREAM_LATENCY_WINDOW = int(os.getenv("UPSTREAM_LATENCY_WINDOW", "200"))
+
+MODES = ("live", "record", "replay", "stub")
+if UPSTREAM_MODE not in MODES:
+    logger.warning(f"未知的 UPSTREAM_MODE={UPSTREAM_MODE}，按 live 处理")
+    UPSTREAM_MODE = "live"
+elif UPSTREAM_MODE != "live":
+    logger.warning(f"外部 API 接入模式: {UPSTREAM_MODE} (录制目录 {UPSTREAM_RECORD_DIR}, 桩服务 {UPSTREAM_STUB_URL})")
+
+# 内存中的录制索引: upstream -> {"exact": {key: path}, "loose": {endpoint: [path, ...]}}
+_replay_index = {}
+
+# URL 路径中带密钥的上游：录制文件与请求指纹中把该段替换为占位符
+# (彩云天气的 token 是路径的一部分: /v2.6/{token}/{经纬度}/weather.json)，密钥不落盘，轮换后录制仍可用
+_SECRET_PATH_SEGMENTS = {
+    "caiyun": re.compile(r"^(\S+ [^/]+/v[^/]+/)[^/]+"),
+}
+# 回放宽松匹配只看主机名的上游 (AI 生成图片的下载地址每张都不同)
+_LOOSE_MATCH_HOST_ONLY = {"image_download"}
+
+
+class ReplayMiss(httpx.RequestError):
+    """回放模式下找不到对应录制 (继承 httpx.RequestError，调用方按网络错误走降级逻辑)"""
+
+
+class CircuitOpen(httpx.RequestError):
+    """熔断器打开期间直接拒绝调用 (同样按网络错误走调用方的降级逻辑)"""
+
+
+class CircuitBreaker:
+    """单个上游的熔断器：closed -> open (冷却) -> half_open (单个探测) -> closed / open"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < UPSTREAM_BREAKER_OPEN_SECONDS:
+                return False
+            self.state = "half_open"
+            self.probe_in_flight = False
+        # half_open：同一时间只放行一个探测请求
+        if self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    def release(self):
+        """探测请求被取消 (未得出结果) 时释放名额"""
+        self.probe_in_flight = False
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info(f"{self.name} 熔断恢复")
+        self.state = "closed"
+        self.failures = 0
+        self.probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_in_flight = False
+        if self.state == "half_open" or self.failures >= UPSTREAM_BREAKER_FAILURES:
+            if self.state != "open":
+                logger.warning(f"{self.name} 连续失败 {self.failures} 次，熔断 {UPSTREAM_BREAKER_OPEN_SECONDS:.0f}s")
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class _UpstreamState:
+    def __init__(self, name: str):
+        self.breaker = CircuitBreaker(name)
+        self.latencies = deque(maxlen=UPSTREAM_LATENCY_WINDOW)
+        self.requests = 0
+        self.rejected = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < UPSTREAM_HEDGE_MIN_SAMPLES:
+            return UPSTREAM_HEDGE_DEFAULT_DELAY_MS / 1000
+        ordered = sorted(self.latencies)
+        idx = min(len(ordered) - 1, int(len(ordered) * UPSTREAM_HEDGE_PERCENTILE / 100))
+        return max(ordered[idx], UPSTREAM_HEDGE_MIN_DELAY_MS / 1000)
+
+    def may_hedge(self) -> bool:
+        return self.hedged < UPSTREAM_HEDGE_MAX_RATIO * self.requests + 1
+
+
+_states = {}
+
+
+def _state(upstream: str) -> _UpstreamState:
+    state = _states.get(upstream)
+    if state is None:
+        state = _states[upstream] = _UpstreamState(upstream)
+    return state
+
+
+def _is_failure(response: httpx.Response) -> bool:
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def requires_credentials() -> bool:
+    """只有真正访问外部 API 时才需要校验 API Key"""
+    return UPSTREAM_MODE in ("live", "record")
+
+
+def _mask_endpoint(upstream: str, endpoint: str) -> str:
+    pattern = _SECRET_PATH_SEGMENTS.get(upstream)
+    return pattern.sub(r"\1{token}", endpoint) if pattern else endpoint
+
+
+def _endpoint(upstream: str, method: str, url: str) -> str:
+    """格式为 "方法 主机/路径"，路径中的密钥已替换为 {token}"""
+    parts = urlsplit(url)
+    return _mask_endpoint(upstream, f"{method.upper()} {parts.netloc}{parts.path}")
+
+
+def _loose_key(upstream: str, endpoint: str) -> str:
+    if upstream in _LOOSE_MATCH_HOST_ONLY:
+        return endpoint.split("/", 1)[0]
+    return endpoint
+
+
+def request_key(upstream: str, method: str, url: str, params=None, json_body=None) -> str:
+    """请求指纹：方法 + URL + 排序后的查询参数 + 规范化的 JSON 请求体 (不含请求头与路径中的密钥，避免 API Key 进入录制)"""
+    digest = hashlib.sha256()
+    digest.update(_endpoint(upstream, method, url).encode("utf-8"))
+    digest.update(urlsplit(url).query.encode("utf-8"))
+    if params:
+        digest.update(urlencode(sorted((str(k), str(v)) for k, v in params.items())).encode("utf-8"))
+    if json_body is not None:
+        digest.update(json.dumps(json_body, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+def _recording_dir(upstream: str) -> str:
+    return os.path.join(UPSTREAM_RECORD_DIR, upstream)
+
+
+def _save_recording(upstream, key, method, url, response, elapsed):
+    record = {
+        "upstream": upstream,
+        "endpoint": _endpoint(upstream, method, url),
+        "status_code": response.status_code,
+        "content_type": response.headers.get("content-type", ""),
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "body_b64": base64.b64encode(response.content).decode("ascii"),
+    }
+    directory = _recording_dir(upstream)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{key}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False)
+    index = _replay_index.get(upstream)
+    if index is not None:
+        index["exact"][key] = path
+        index["loose"].setdefault(_loose_key(upstream, record["endpoint"]), []).append(path)
+
+
+def _load_index(upstream: str):
+    index = _replay_index.get(upstream)
+    if index is not None:
+        return index
+    index = {"exact": {}, "loose": {}}
+    directory = _recording_dir(upstream)
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    # 兼容脱敏前的旧录制：加载时同样替换路径中的密钥
+                    endpoint = _mask_endpoint(upstream, json.load(f).get("endpoint", ""))
+            except (OSError, ValueError):
+                continue
+            index["exact"][name[:-5]] = path
+            index["loose"].setdefault(_loose_key(upstream, endpoint), []).append(path)
+    _replay_index[upstream] = index
+    return index
+
+
+async def _replay(upstream, key, method, url):
+    index = _load_index(upstream)
+    path = index["exact"].get(key)
+    endpoint = _endpoint(upstream, method, url)
+    if path is None and UPSTREAM_REPLAY_LOOSE:
+        candidates = index["loose"].get(_loose_key(upstream, endpoint))
+        if candidates:
+            # 用请求指纹选取，保证同一请求每次回放同一条录制
+            path = candidates[int(key, 16) % len(candidates)]
+    if path is None:
+        raise ReplayMiss(f"{upstream} 无对应录制: {endpoint} ({key})")
+
+    with open(path, encoding="utf-8") as f:
+        record = json.load(f)
+    if UPSTREAM_REPLAY_LATENCY == "recorded" and record.get("elapsed_ms"):
+        await asyncio.sleep(record["elapsed_ms"] / 1000)
+    return httpx.Response(
+        record["status_code"],
+        headers={"content-type": record.get("content_type") or "application/json"},
+        content=base64.b64decode(record["body_b64"]),
+        request=httpx.Request(method, url),
+    )
+
+
+def stub_url(upstream: str, url: str) -> str:
+    """把外部 API 的 URL 改写为桩服务地址: {UPSTREAM_STUB_URL}/{upstream}{原路径}"""
+    if url.startswith(UPSTREAM_STUB_URL):
+        # 桩服务返回的图片链接已指向自身
+        return url
+    parts = urlsplit(url)
+    rewritten = f"{UPSTREAM_STUB_URL}/{upstream}{parts.path}"
+    return f"{rewritten}?{parts.query}" if parts.query else rewritten
+
+
+async def _send(state, upstream, method, url, timeout, kwargs):
+    target = stub_url(upstream, url) if UPSTREAM_MODE == "stub" else url
+    client_kwargs = {} if timeout is None else {"timeout": timeout}
+    start = time.perf_counter()
+    async with httpx.AsyncClient(**client_kwargs) as client:
+        response = await client.request(method, target, **kwargs)
+        # 读完响应体再计时，录制的耗时与调用方实际等待一致
+        await response.aread()
+    elapsed = time.perf_counter() - start
+    if not _is_failure(response):
+        state.latencies.append(elapsed)
+
+    if UPSTREAM_MODE == "record":
+        key = request_key(upstream, method, url, kwargs.get("params"), kwargs.get("json"))
+        try:
+            _save_recording(upstream, key, method, url, response, elapsed)
+        except OSError as e:
+            logger.warning(f"写入 {upstream} 录制失败: {e}")
+    return response
+
+
+async def _send_hedged(state, upstream, method, url, timeout, kwargs):
+    """主请求超过对冲延迟仍未返回时补发一个备份请求，返回先成功的一个并取消另一个"""
+    primary = asyncio.ensure_future(_send(state, upstream, method, url, timeout, kwargs))
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=state.hedge_delay())
+    except asyncio.CancelledError:
+        # asyncio.wait 被取消时不会取消其中的任务，需手动取消，避免主请求在后台继续占用连接并更新熔断状态
+        primary.cancel()
+        raise
+    if done or not state.may_hedge():
+        return await primary
+
+    state.hedged += 1
+    backup = asyncio.ensure_future(_send(state, upstream, method, url, timeout, kwargs))
+    pending = {primary, backup}
+    fallback, error = None, None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = task.exception()
+                elif _is_failure(task.result()):
+                    fallback = task.result()
+                else:
+                    if task is backup:
+                        state.hedge_wins += 1
+                    return task.result()
+        if fallback is not None:
+            return fallback
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def request(upstream: str, method: str, url: str, *, timeout=None, hedge=False, **kwargs) -> httpx.Response:
+    """
+    所有外部 HTTP 调用的统一入口，参数与 httpx.AsyncClient.request 一致
+    :param upstream: 上游名称 (与 metrics_service.track_upstream 的名称一致，也是录制子目录名)
+    :param timeout: 超时秒数，None 沿用 httpx 默认值
+    :param hedge: 是否允许对冲 (仅用于幂等的 GET)
+    熔断打开时抛出 CircuitOpen，调用方按已有的异常分支降级
+    """
+    if UPSTREAM_MODE == "replay":
+        key = request_key(upstream, method, url, kwargs.get("params"), kwargs.get("json"))
+        return await _replay(upstream, key, method, url)
+
+    state = _state(upstream)
+    if not state.breaker.allow():
+        state.rejected += 1
+        raise CircuitOpen(f"{upstream} 熔断中，跳过调用", request=httpx.Request(method, url))
+
+    state.requests += 1
+    try:
+        if hedge and method.upper() == "GET":
+            response = await _send_hedged(state, upstream, method, url, timeout, kwargs)
+        else:
+            response = await _send(state, upstream, method, url, timeout, kwargs)
+    except asyncio.CancelledError:
+        state.breaker.release()
+        raise
+    except Exception:
+        state.breaker.record_failure()
+        raise
+
+    if _is_failure(response):
+        state.breaker.record_failure()
+    else:
+        state.breaker.record_success()
+    return response
+
+
+async def get(upstream: str, url: str, **kwargs) -> httpx.Response:
+    return await request(upstream, "GET", url, **kwargs)
+
+
+async def post(upstream: str, url: str, **kwargs) -> httpx.Response:
+    return await request(upstream, "POST", url, **kwargs)
+
+
+_BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def stats():
+    """各上游的熔断状态与对冲统计 (state: 0=closed, 1=half_open, 2=open)"""
+    return {
+        name: {
+            "state": _BREAKER_STATES[state.breaker.state],
+            "consecutive_failures": state.breaker.failures,
+            "requests": state.requests,
+            "rejected": state.rejected,
+            "hedged": state.hedged,
+            "hedge_wins": state.hedge_wins,
+            "hedge_delay_ms": round(state.hedge_delay() * 1000, 1),
+        }
+        for name, state in sorted(_states.items())
+    }
@@ -0,0 +1,46 @@
+import hashlib
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import WardrobeVersion
+
+
+def _upsert_statement(user_id: str):
+    # 原子递增：不存在则插入 1，存在则 version + 1
+    stmt = sqlite_insert(WardrobeVersion).values(user_id=user_id, version=1)
+    return stmt.on_conflict_do_update(
+        index_elements=[WardrobeVersion.user_id],
+        set_={"version": WardrobeVersion.version + 1},
+    )
+
+
+def bump_version(db, user_id: str):
+    """递增用户衣橱版本号 (同步会话)，与业务写入在同一事务中，由调用方提交"""
+    db.execute(_upsert_statement(user_id))
+
+
+async def bump_version_async(db, user_id: str):
+    """递增用户衣橱版本号 (异步会话)，由调用方提交"""
+    await db.execute(_upsert_statement(user_id))
+
+
+def get_version(db, user_id: str) -> int:
+    """读取用户衣橱版本号 (主键查询，不访问衣物表)"""
+    version = db.execute(
+        select(WardrobeVersion.version).where(WardrobeVersion.user_id == user_id)
+    ).scalar()
+    return version or 0
+
+
+def make_etag(user_id: str, version: int, resource: str, variant: str = "") -> str:
+    """生成强 ETag：同一用户、版本、资源与查询参数组合对应唯一标签"""
+    digest = hashlib.sha1(f"{user_id}\0{version}\0{resource}\0{variant}".encode("utf-8")).hexdigest()
+    return f'"{digest[:24]}"'
+
+
+def etag_matches(if_none_match, etag: str) -> bool:
+    """判断 If-None-Match 请求头是否命中当前 ETag"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # If-None-Match 使用弱比较，忽略 W/ 前缀
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
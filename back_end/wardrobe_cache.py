@@ -0,0 +1,145 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from sqlalchemy import select
+
+import metrics_service
+from models import UserProfile, OutfitHistory, ClothingItem
+
+logger = logging.getLogger("SmartWardrobe.WardrobeCache")
+
+# ==========================================
+# 配置
+# ==========================================
+# 最多缓存的用户数，设为 0 关闭缓存
+WARDROBE_CACHE_MAX_USERS = int(os.getenv("WARDROBE_CACHE_MAX_USERS", "256"))
+# 所有快照合计缓存的衣物件数上限 (每件含 512 维向量，约 10KB)
+WARDROBE_CACHE_MAX_ITEMS = int(os.getenv("WARDROBE_CACHE_MAX_ITEMS", "50000"))
+# 兜底过期时间：多进程部署时其他进程的写入无法通知到本进程
+WARDROBE_CACHE_TTL_SECONDS = float(os.getenv("WARDROBE_CACHE_TTL_SECONDS", "600"))
+
+
+@dataclass
+class WardrobeSnapshot:
+    """推荐所需的用户状态：画像、可推荐衣物 (status=正常，按 id 排序) 与历史反馈"""
+    user_id: str
+    profile: object  # UserProfile 或 None
+    items: list
+    history: list
+    version: int
+    loaded_at: float
+
+
+_lock = threading.Lock()
+# 进程内版本号：每次写入后递增，快照记录加载时的版本号，不一致即视为失效
+_versions = {}
+_snapshots = OrderedDict()
+_cached_items = 0
+
+
+def get_version(user_id: str) -> int:
+    with _lock:
+        return _versions.get(user_id, 0)
+
+
+def invalidate(user_id: str):
+    """
+    写入提交后调用：递增用户版本号并丢弃快照
+    必须在 commit 之后调用，否则并发请求可能把提交前的旧数据以新版本号写入缓存
+    """
+    global _cached_items
+    with _lock:
+        _versions[user_id] = _versions.get(user_id, 0) + 1
+        snapshot = _snapshots.pop(user_id, None)
+        if snapshot is not None:
+            _cached_items -= len(snapshot.items)
+
+
+def clear():
+    global _cached_items
+    with _lock:
+        _snapshots.clear()
+        _cached_items = 0
+
+
+def _lookup(user_id: str):
+    with _lock:
+        snapshot = _snapshots.get(user_id)
+        if snapshot is None:
+            return None
+        if (snapshot.version != _versions.get(user_id, 0)
+                or time.monotonic() - snapshot.loaded_at > WARDROBE_CACHE_TTL_SECONDS):
+            return None
+        _snapshots.move_to_end(user_id)
+        return snapshot
+
+
+def _store(snapshot: WardrobeSnapshot):
+    global _cached_items
+    if WARDROBE_CACHE_MAX_USERS <= 0 or len(snapshot.items) > WARDROBE_CACHE_MAX_ITEMS:
+        return
+    with _lock:
+        # 加载期间发生了写入：快照已过期，不放入缓存
+        if snapshot.version != _versions.get(snapshot.user_id, 0):
+            return
+        old = _snapshots.pop(snapshot.user_id, None)
+        if old is not None:
+            _cached_items -= len(old.items)
+        _snapshots[snapshot.user_id] = snapshot
+        _cached_items += len(snapshot.items)
+        # LRU 淘汰，直到用户数与衣物件数都不超限
+        while _snapshots and (len(_snapshots) > WARDROBE_CACHE_MAX_USERS
+                              or _cached_items > WARDROBE_CACHE_MAX_ITEMS):
+            _, evicted = _snapshots.popitem(last=False)
+            _cached_items -= len(evicted.items)
+
+
+async def _load(db, user_id: str, version: int):
+    result = await db.execute(select(UserProfile).where(UserProfile.user_id == user_id))
+    profile = result.scalars().first()
+
+    result = await db.execute(
+        select(ClothingItem)
+        .where(ClothingItem.user_id == user_id, ClothingItem.status == "正常")
+        .order_by(ClothingItem.id)
+    )
+    items = list(result.scalars().all())
+
+    # 只取历史权重计算所需的列，命中覆盖索引
+    result = await db.execute(select(
+        OutfitHistory.date,
+        OutfitHistory.weather_temp,
+        OutfitHistory.feedback_score,
+        OutfitHistory.top_id,
+        OutfitHistory.bottom_id,
+        OutfitHistory.outer_id,
+        OutfitHistory.one_piece_id,
+    ).where(OutfitHistory.user_id == user_id))
+    history = result.all()
+
+    return WardrobeSnapshot(user_id, profile, items, history, version, time.monotonic())
+
+
+async def get_snapshot(db, user_id: str) -> WardrobeSnapshot:
+    """
+    返回用户快照 (db 为 AsyncSession)；命中时不访问数据库
+    快照中的 ORM 对象会被多个请求共享，只读使用，不可修改或重新 add 到会话
+    """
+    snapshot = _lookup(user_id)
+    metrics_service.record_cache("wardrobe", snapshot is not None)
+    if snapshot is not None:
+        return snapshot
+
+    version = get_version(user_id)
+    with metrics_service.stage_timer("wardrobe_snapshot_load"):
+        snapshot = await _load(db, user_id, version)
+    _store(snapshot)
+    return snapshot
+
+
+def stats():
+    with _lock:
+        return {"users": len(_snapshots), "items": _cached_items}
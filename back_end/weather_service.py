@@ -1,10 +1,39 @@
-import httpx
+import os
 import re
+import time
 from datetime import datetime
+import metrics_service
+import upstream
 
 CAIYUN_TOKEN = "" 
 BASE_URL = "https://api.caiyunapp.com/v2.6"
 
+# 彩云/Nominatim 故障或熔断时，退回该时长内最近一次成功的结果 (秒)
+WEATHER_STALE_MAX_SECONDS = float(os.getenv("WEATHER_STALE_MAX_SECONDS", "21600"))
+WEATHER_STALE_MAX_ENTRIES = int(os.getenv("WEATHER_STALE_MAX_ENTRIES", "1024"))
+
+# coords -> (保存时间, 天气上下文)；地址 -> 经纬度
+_last_good_weather = {}
+_last_good_coords = {}
+
+
+def _remember(cache: dict, key, value):
+    cache.pop(key, None)
+    cache[key] = value
+    while len(cache) > WEATHER_STALE_MAX_ENTRIES:
+        cache.pop(next(iter(cache)))
+
+
+def _stale_weather(coords):
+    # 命中率即降级 (过期数据) 响应的占比，未命中表示只能返回错误
+    entry = _last_good_weather.get(coords)
+    if entry is None or time.time() - entry[0] > WEATHER_STALE_MAX_SECONDS:
+        metrics_service.record_cache("weather_stale", False)
+        return None
+    metrics_service.record_cache("weather_stale", True)
+    print(f"天气接口不可用，使用 {time.time() - entry[0]:.0f}s 前的缓存: {coords}")
+    return dict(entry[1], stale=True)
+
 SKYCON_MAP = {
     "CLEAR_DAY": "晴", "CLEAR_NIGHT": "晴",
     "PARTLY_CLOUDY_DAY": "多云", "PARTLY_CLOUDY_NIGHT": "多云",
@@ -28,17 +57,70 @@ async def resolve_coordinates(input_str: str):
     search_url = "https://nominatim.openstreetmap.org/search"
     headers = {"User-Agent": "SmartWardrobe/1.0"}
     
-    async with httpx.AsyncClient(timeout=10.0) as client:
+    with metrics_service.stage_timer("weather_geocode"), metrics_service.track_upstream("nominatim") as call:
         try:
-            resp = await client.get(search_url, params={"q": input_str, "format": "json", "limit": 1}, headers=headers)
+            resp = await upstream.get(
+                "nominatim", search_url, timeout=10.0, hedge=True,
+                params={"q": input_str, "format": "json", "limit": 1}, headers=headers,
+            )
             data = resp.json()
             if data and len(data) > 0:
-                return f"{data[0]['lon']},{data[0]['lat']}"
+                coords = f"{data[0]['lon']},{data[0]['lat']}"
+                _remember(_last_good_coords, input_str, coords)
+                return coords
             else:
                 return None
         except Exception as e:
+            call.error()
             print(f"地址解析失败: {e}")
-            return None
+            coords = _last_good_coords.get(input_str)
+            metrics_service.record_cache("geocode_stale", coords is not None)
+            return coords
+
+def _build_signals(today_daily, humidity):
+    """ 特征工程：由当日统计生成推荐用的天气信号 """
+    wind_tag = False
+    if today_daily["wind_max"] > 20: wind_tag = True
+    
+    prob = today_daily["rain_prob"]
+    return {
+        "need_umbrella": prob >= 30,
+        "need_windbreaker": wind_tag,
+        "need_sun_protection": today_daily.get("uv_max", 0) >= 5,
+        "high_humidity": humidity > 0.7, 
+        "temp_diff_alert": (today_daily["temp_max"] - today_daily["temp_min"]) > 10 
+    }
+
+def build_day_context(weather_ctx, day_index: int):
+    """
+    由 get_weather_info 的结果构造第 day_index 天的天气上下文 (结构与 get_weather_info 一致)
+    第 0 天直接使用实时数据；之后的天数以日均温作为实时/体感温度，按同样规则计算信号
+    """
+    if day_index == 0:
+        return weather_ctx
+
+    day = weather_ctx["daily_forecast"][day_index]
+    today_daily = {
+        "temp_max": day["max_temp"],
+        "temp_min": day["min_temp"],
+        "rain_prob": day["rain_prob"],
+        "wind_max": day["wind_max"],
+    }
+    return {
+        "location": weather_ctx["location"],
+        "summary_text": f"{day['date']} {day['condition']} {day['min_temp']:.0f}~{day['max_temp']:.0f}°C",
+        "current": {
+            "temp_real": day["avg_temp"],
+            "temp_feel": day["avg_temp"],
+            "humidity": day["humidity"],
+            "skycon": day["condition"],
+            "wind_speed": day["wind_avg"],
+        },
+        "today_stat": today_daily,
+        "hourly_trend": [],
+        "daily_forecast": weather_ctx["daily_forecast"],
+        "signals": _build_signals(today_daily, day["humidity"]),
+    }
 
 async def get_weather_info(location_input: str = "厦门"):
     coords = await resolve_coordinates(location_input)
@@ -47,105 +129,112 @@ async def get_weather_info(location_input: str = "厦门"):
 
     url = f"{BASE_URL}/{CAIYUN_TOKEN}/{coords}/weather.json"
     
-    async with httpx.AsyncClient() as client:
-        try:
-            resp = await client.get(url, params={"alert": "true", "dailysteps": "3", "hourlysteps": "24"})
+    try:
+        with metrics_service.stage_timer("weather_caiyun"), metrics_service.track_upstream("caiyun") as call:
+            resp = await upstream.get(
+                "caiyun", url, hedge=True, params={"alert": "true", "dailysteps": "3", "hourlysteps": "24"}
+            )
             resp.raise_for_status()
             data = resp.json()
-            
+            # HTTP 200 但业务状态失败 (token 无效、额度用尽等) 同样计为上游错误
             if data.get("status") != "ok":
-                return {"error": f"API Error: {data.get('error')}"}
-
-            result = data.get("result", {})
-            realtime = result.get("realtime", {})
-            hourly = result.get("hourly", {})
-            daily = result.get("daily", {}) 
-
-            def to_float(val, default=0.0):
-                try:
-                    if val is None: return default
-                    return float(val)
-                except (ValueError, TypeError):
-                    return default
-
-            # 1. 实时数据
-            current_data = {
-                "temp_real": to_float(realtime.get("temperature")),
-                "temp_feel": to_float(realtime.get("apparent_temperature")),
-                "humidity": to_float(realtime.get("humidity")),
-                "skycon": translate_skycon(realtime.get("skycon")), 
-                "wind_speed": to_float(realtime.get("wind", {}).get("speed")),
-                "uv_index": to_float(realtime.get("life_index", {}).get("ultraviolet", {}).get("index")),
-                "aqi": to_float(realtime.get("air_quality", {}).get("aqi", {}).get("chn")),
-            }
-
-            # 2. 当日详情
-            today_daily = {
-                "temp_max": to_float(daily.get("temperature", [])[0].get("max")),
-                "temp_min": to_float(daily.get("temperature", [])[0].get("min")),
-                "rain_prob": to_float(daily.get("precipitation", [])[0].get("probability")), 
-                "wind_max": to_float(daily.get("wind", [])[0].get("max", {}).get("speed")),  
-                "uv_max": to_float(daily.get("life_index", {}).get("ultraviolet", [])[0].get("index")), 
-                "comfort_index": to_float(daily.get("life_index", {}).get("comfort", [])[0].get("index")), 
-                "sunrise": daily.get("astro", [])[0].get("sunrise"),
-                "sunset": daily.get("astro", [])[0].get("sunset"),
-            }
-
-            # 3. 小时级趋势
-            hourly_trend = []
-            h_temps = hourly.get("temperature", [])
-            h_skycons = hourly.get("skycon", [])
-            for i in range(min(len(h_temps), 12)):
-                hourly_trend.append({
-                    "time": h_temps[i].get("datetime")[11:16], 
-                    "temp": to_float(h_temps[i].get("value")),
-                    "cond": translate_skycon(h_skycons[i].get("value"))
-                })
-
-            # --- 4. 未来多天预报 (Daily Forecast) ---
-            daily_forecast = []
-            d_temps = daily.get("temperature", [])
-            d_skycons = daily.get("skycon", [])
-            
-            # 遍历 API 返回的所有天数
-            count = min(len(d_temps), len(d_skycons))
-            for i in range(count):
-                daily_forecast.append({
-                    "date": d_temps[i].get("date"), # "2023-12-14"
-                    "min_temp": to_float(d_temps[i].get("min")),
-                    "max_temp": to_float(d_temps[i].get("max")),
-                    "condition": translate_skycon(d_skycons[i].get("value"))
-                })
+                call.error()
+        
+        if data.get("status") != "ok":
+            return {"error": f"API Error: {data.get('error')}"}
 
-            # 5. 特征工程
-            wind_tag = False
-            if today_daily["wind_max"] > 20: wind_tag = True
-            
-            water_tag = "无"
-            prob = today_daily["rain_prob"]
-            if prob >= 80: water_tag = "完全防水" 
-            elif prob >= 30: water_tag = "防泼水"   
-            
-            # 构造返回
-            final_context = {
-                "location": coords,
-                "summary_text": result.get("forecast_keypoint", "暂无预报描述"), 
-                "current": current_data,
-                "today_stat": today_daily,
-                "hourly_trend": hourly_trend,
-                "daily_forecast": daily_forecast,
-                
-                "signals": {
-                    "need_umbrella": prob >= 30,
-                    "need_windbreaker": wind_tag,
-                    "need_sun_protection": today_daily["uv_max"] >= 5,
-                    "high_humidity": current_data["humidity"] > 0.7, 
-                    "temp_diff_alert": (today_daily["temp_max"] - today_daily["temp_min"]) > 10 
-                }
-            }
+        result = data.get("result", {})
+        realtime = result.get("realtime", {})
+        hourly = result.get("hourly", {})
+        daily = result.get("daily", {}) 
+
+        def to_float(val, default=0.0):
+            try:
+                if val is None: return default
+                return float(val)
+            except (ValueError, TypeError):
+                return default
+
+        # 1. 实时数据
+        current_data = {
+            "temp_real": to_float(realtime.get("temperature")),
+            "temp_feel": to_float(realtime.get("apparent_temperature")),
+            "humidity": to_float(realtime.get("humidity")),
+            "skycon": translate_skycon(realtime.get("skycon")), 
+            "wind_speed": to_float(realtime.get("wind", {}).get("speed")),
+            "uv_index": to_float(realtime.get("life_index", {}).get("ultraviolet", {}).get("index")),
+            "aqi": to_float(realtime.get("air_quality", {}).get("aqi", {}).get("chn")),
+        }
+
+        # 2. 当日详情
+        today_daily = {
+            "temp_max": to_float(daily.get("temperature", [])[0].get("max")),
+            "temp_min": to_float(daily.get("temperature", [])[0].get("min")),
+            "rain_prob": to_float(daily.get("precipitation", [])[0].get("probability")), 
+            "wind_max": to_float(daily.get("wind", [])[0].get("max", {}).get("speed")),  
+            "uv_max": to_float(daily.get("life_index", {}).get("ultraviolet", [])[0].get("index")), 
+            "comfort_index": to_float(daily.get("life_index", {}).get("comfort", [])[0].get("index")), 
+            "sunrise": daily.get("astro", [])[0].get("sunrise"),
+            "sunset": daily.get("astro", [])[0].get("sunset"),
+        }
+
+        # 3. 小时级趋势
+        hourly_trend = []
+        h_temps = hourly.get("temperature", [])
+        h_skycons = hourly.get("skycon", [])
+        for i in range(min(len(h_temps), 12)):
+            hourly_trend.append({
+                "time": h_temps[i].get("datetime")[11:16], 
+                "temp": to_float(h_temps[i].get("value")),
+                "cond": translate_skycon(h_skycons[i].get("value"))
+            })
+
+        # --- 4. 未来多天预报 (Daily Forecast) ---
+        daily_forecast = []
+        d_temps = daily.get("temperature", [])
+        d_skycons = daily.get("skycon", [])
+        d_humidity = daily.get("humidity", [])
+        d_wind = daily.get("wind", [])
+        d_precip = daily.get("precipitation", [])
+
+        def day_entry(values, i):
+            return values[i] if i < len(values) else {}
+        
+        # 遍历 API 返回的所有天数
+        count = min(len(d_temps), len(d_skycons))
+        for i in range(count):
+            min_temp = to_float(d_temps[i].get("min"))
+            max_temp = to_float(d_temps[i].get("max"))
+            daily_forecast.append({
+                "date": d_temps[i].get("date"), # "2023-12-14"
+                "min_temp": min_temp,
+                "max_temp": max_temp,
+                "condition": translate_skycon(d_skycons[i].get("value")),
+                # 供多日规划构造每天的天气上下文
+                "avg_temp": to_float(d_temps[i].get("avg"), (min_temp + max_temp) / 2),
+                "humidity": to_float(day_entry(d_humidity, i).get("avg")),
+                "wind_avg": to_float(day_entry(d_wind, i).get("avg", {}).get("speed")),
+                "wind_max": to_float(day_entry(d_wind, i).get("max", {}).get("speed")),
+                "rain_prob": to_float(day_entry(d_precip, i).get("probability")),
+            })
+
+        
+        # 构造返回
+        final_context = {
+            "location": coords,
+            "summary_text": result.get("forecast_keypoint", "暂无预报描述"), 
+            "current": current_data,
+            "today_stat": today_daily,
+            "hourly_trend": hourly_trend,
+            "daily_forecast": daily_forecast,
             
-            return final_context
+            # 5. 特征工程
+            "signals": _build_signals(today_daily, current_data["humidity"]),
+        }
+        
+        _remember(_last_good_weather, coords, (time.time(), final_context))
+        return final_context
 
-        except Exception as e:
-            print(f"API调用失败详细信息: {e}")
-            return {"error": "无法获取天气信息"}
\ No newline at end of file
+    except Exception as e:
+        print(f"API调用失败详细信息: {e}")
+        return _stale_weather(coords) or {"error": "无法获取天气信息"}
\ No newline at end of file
@@ -29,6 +29,7 @@ interface OutfitItem {
   id: number
   name: string
   image_url: string
+  image_variants?: { thumb?: string; medium?: string } | null
   warmth: number
   type: string
   gender?: "男款" | "女款" | "中性"
@@ -144,6 +145,12 @@ export default function RecommendPage() {
     if (typeof window !== 'undefined') {
       localStorage.setItem("gender", g)
     }
+    // 同步到用户画像，每日批量推荐按画像中的性别筛选衣物
+    fetch(`${API_BASE_URL}/user/profile?user_id=${getUserId()}`, {
+      method: "PUT",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ gender: g }),
+    }).catch((error) => console.error("同步性别失败:", error))
   }
 
   // 1. 发起推荐请求
@@ -525,7 +532,7 @@ function ClothingItemCard({ item, label, delay }: { item: OutfitItem, label: str
       className="flex-1 bg-zinc-800 rounded-xl p-3 flex gap-4 items-center border border-zinc-700/50 hover:border-zinc-500 transition-colors"
     >
       <div className="w-20 h-20 bg-black rounded-lg overflow-hidden flex-shrink-0 border border-zinc-800">
-        <img src={getImageUrl(item.image_url)} className="w-full h-full object-cover" />
+        <img src={getImageUrl(item.image_variants?.thumb || item.image_url)} className="w-full h-full object-cover" />
       </div>
       <div className="flex-1 min-w-0">
         <div className="flex justify-between items-start flex-wrap gap-1">
@@ -17,6 +17,7 @@ interface SegmentPart {
   category_key: string
   label: string
   image_path: string
+  variants?: { thumb?: string; medium?: string } | null
 }
 
 interface ExtendedFormData extends ClothingFormData {
@@ -313,7 +314,7 @@ export default function UploadPage() {
                           >
                             <div className="aspect-square w-full bg-zinc-900/50 p-4 flex items-center justify-center">
                               <img 
-                                src={`${API_BASE_URL}/${part.image_path}`} 
+                                src={`${API_BASE_URL}/${part.variants?.thumb || part.image_path}`} 
                                 className="max-w-full max-h-full object-contain drop-shadow-2xl transition-transform group-hover:scale-110"
                               />
                             </div>
@@ -546,8 +546,9 @@ function ClothingCard({ item, onCardClick, onStatusChange }: {
       onClick={onCardClick}
     >
       <img 
-        src={`${API_BASE_URL}/${item.image_url}`} 
+        src={`${API_BASE_URL}/${item.image_variants?.thumb || item.image_url}`} 
         alt={item.category_sub || "衣物图片"} 
+        loading="lazy"
         className={cn(
           "w-full h-full object-cover", 
           isNotOwned && "opacity-80 grayscale-[0.3]" // 未拥有物品图片灰度+透明度调整
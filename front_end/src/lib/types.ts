@@ -2,6 +2,8 @@ export interface ClothingItem {
   id: number;
   user_id: string;
   image_url: string;
+  // 后端生成的 WebP 派生图 (thumb/medium)，网格展示优先使用
+  image_variants?: { thumb?: string; medium?: string } | null;
   created_at?: string;
   
   // 核心分类